@@ -1,27 +1,32 @@
 """
 Dependencies для FastAPI эндпоинтов
 """
-from functools import lru_cache
-from app.model_loader import load_model
-from app.shap_explainer import create_shap_explainer
+from app.core.model_registry import model_registry
 from app.core.config import settings
 
 
-@lru_cache()
+def get_model_bundle():
+    """
+    Возвращает текущий bundle модели из реестра.
+    Реестр сам кэширует загруженную модель и подменяет её при hot reload,
+    поэтому отдельный LRU cache здесь не нужен (он бы удерживал старую версию).
+    """
+    bundle = model_registry.current
+    if bundle is None:
+        bundle = model_registry.load_initial()
+    return bundle
+
+
 def get_model():
     """
-    Загружает и кэширует ML модель
-    Использует LRU cache для предотвращения повторной загрузки
+    Возвращает ML модель текущей версии
     """
-    return load_model()
+    return get_model_bundle().model
 
 
-@lru_cache()
 def get_shap_explainer():
     """
-    Создает и кэширует SHAP explainer
+    Возвращает SHAP explainer текущей версии
     """
-    model = get_model()
-    return create_shap_explainer(model)
-
+    return get_model_bundle().shap_explainer
 
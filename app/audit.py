@@ -3,10 +3,10 @@ import uuid
 
 from app.model_loader import get_model_version
 
-def build_audit_block():
+def build_audit_block(model_version: str | None = None):
     return {
         "timestamp": datetime.now(timezone.utc).isoformat(),
-        "model_version": get_model_version(),
+        "model_version": model_version or get_model_version(),
         "request_id": str(uuid.uuid4()),
         "api_version": "1.0.0"
     }
\ No newline at end of file
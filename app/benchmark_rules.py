@@ -0,0 +1,100 @@
+"""
+Throughput of the clinical rule table: vectorized (FeatureBatch) vs the
+per-patient path, plus a parity check that both produce identical flags.
+
+Usage:
+    python -m app.benchmark_rules --rows 10000 100000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.clinical_rules import RULE_GROUPS, evaluate_rules, flags_from_bits, flags_from_batch
+from app.features import FeatureBatch
+
+# Scalar path is slow; time it on a sample and extrapolate
+SCALAR_SAMPLE = 5000
+
+
+def synthetic_batch(n: int, seed: int = 42) -> FeatureBatch:
+    """Random patients within the PatientInput ranges."""
+    rng = np.random.default_rng(seed)
+    ap_lo = rng.integers(40, 140, n)
+    return FeatureBatch.from_columns(
+        age_years=rng.integers(18, 91, n),
+        gender=rng.integers(1, 3, n),
+        height=rng.uniform(140, 200, n).round(),
+        weight=rng.uniform(40, 160, n).round(1),
+        ap_hi=ap_lo + rng.integers(-5, 100, n),
+        ap_lo=ap_lo,
+        cholesterol=rng.integers(1, 4, n),
+        gluc=rng.integers(1, 4, n),
+        smoke=rng.integers(0, 2, n),
+        alco=rng.integers(0, 2, n),
+        active=rng.integers(0, 2, n),
+    )
+
+
+def check_parity(batch: FeatureBatch, bits: np.ndarray, sample: int) -> int:
+    """Rows (out of `sample`) where the batch flags differ from the single-patient path."""
+    mismatches = 0
+    per_group = {group: flags_from_batch(bits[:sample], group) for group in RULE_GROUPS}
+    for i in range(min(sample, len(batch))):
+        scalar_bits = evaluate_rules(batch.row(i))
+        if scalar_bits != int(bits[i]):
+            mismatches += 1
+            continue
+        if any(flags_from_bits(scalar_bits, g) != per_group[g][i] for g in RULE_GROUPS):
+            mismatches += 1
+    return mismatches
+
+
+def benchmark(n: int, repeats: int = 3) -> dict:
+    batch = synthetic_batch(n)
+
+    vector_times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        bits = evaluate_rules(batch)
+        vector_times.append(time.perf_counter() - started)
+    vector_sec = min(vector_times)
+
+    sample = min(n, SCALAR_SAMPLE)
+    rows = [batch.row(i) for i in range(sample)]
+    started = time.perf_counter()
+    for record in rows:
+        evaluate_rules(record)
+    scalar_sec = (time.perf_counter() - started) * n / sample
+
+    return {
+        "rows": n,
+        "vectorized_sec": vector_sec,
+        "vectorized_rows_per_sec": n / vector_sec,
+        "scalar_sec_estimated": scalar_sec,
+        "scalar_rows_per_sec": n / scalar_sec,
+        "speedup": scalar_sec / vector_sec,
+        "parity_mismatches": check_parity(batch, bits, sample),
+        "parity_rows_checked": sample,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized clinical rule engine")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    for n in args.rows:
+        r = benchmark(n, args.repeats)
+        print(
+            f"{r['rows']:>8} rows | vectorized {r['vectorized_sec'] * 1000:8.1f} ms "
+            f"({r['vectorized_rows_per_sec']:,.0f} rows/s) | "
+            f"scalar ~{r['scalar_sec_estimated'] * 1000:8.1f} ms "
+            f"({r['scalar_rows_per_sec']:,.0f} rows/s) | x{r['speedup']:.0f} | "
+            f"parity mismatches {r['parity_mismatches']}/{r['parity_rows_checked']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
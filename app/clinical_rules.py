@@ -0,0 +1,140 @@
+"""
+Declarative clinical threshold rules.
+
+One table drives the clinical condition flags, behavioural risk factors,
+safety warnings and the pathological overrides used by interpret_shap.
+Rules are evaluated with the same code for one patient (PatientFeatures,
+plain comparisons) and for many (FeatureBatch, NumPy masks over columns);
+the result is a bitset per patient with one bit per (group, key).
+"""
+import operator
+
+import numpy as np
+
+from app.features import FeatureBatch
+
+OPERATORS = {
+    ">=": operator.ge,
+    ">": operator.gt,
+    "<=": operator.le,
+    "<": operator.lt,
+    "==": operator.eq,
+}
+
+
+class ThresholdRule:
+    """
+    `feature <op> value`. `value` may name another feature (e.g. ap_hi < ap_lo).
+    Several rules with the same (group, key) are OR-combined into one bit.
+    """
+
+    __slots__ = ("group", "key", "feature", "op", "value", "bit")
+
+    def __init__(self, group: str, key: str, feature: str, op: str, value):
+        self.group = group
+        self.key = key
+        self.feature = feature
+        self.op = op
+        self.value = value
+        self.bit = None
+
+    def test(self, features):
+        left = getattr(features, self.feature)
+        right = getattr(features, self.value) if isinstance(self.value, str) else self.value
+        return OPERATORS[self.op](left, right)
+
+
+# Order within a group is the order flags are reported in
+THRESHOLD_RULES = (
+    # Clinical conditions / flags (collect_rule_based_flags)
+    ThresholdRule("condition", "high_bp", "ap_hi", ">=", 140),
+    ThresholdRule("condition", "obesity", "bmi", ">=", 30),
+    ThresholdRule("condition", "cholesterol_attention", "cholesterol", "==", 2),
+    ThresholdRule("condition", "cholesterol_high", "cholesterol", "==", 3),
+
+    # Behavioural risk factors (collect_clinical_risk_factors)
+    ThresholdRule("behavior", "smoke", "smoke", "==", 1),
+    ThresholdRule("behavior", "gluc", "gluc", "==", 3),
+    ThresholdRule("behavior", "alco", "alco", "==", 1),
+    ThresholdRule("behavior", "active", "active", "==", 0),
+
+    # Input sanity warnings (safety.input_sanity_check)
+    ThresholdRule("sanity", "young_age", "age_years", "<", 40),
+    ThresholdRule("sanity", "bp_inversion", "ap_hi", "<", "ap_lo"),
+    ThresholdRule("sanity", "underweight", "bmi", "<", 18.5),
+    ThresholdRule("sanity", "very_old_age", "age_years", ">", 85),
+
+    # Out-of-distribution warnings (safety.ood_check)
+    ThresholdRule("ood", "extreme_bp", "ap_hi", ">", 200),
+    ThresholdRule("ood", "extreme_bp", "ap_lo", ">", 120),
+    ThresholdRule("ood", "extreme_bmi", "bmi", ">", 50),
+
+    # Pathological thresholds forcing "increases" in interpret_shap (key = model feature)
+    ThresholdRule("pathological", "ap_hi", "ap_hi", ">=", 140),
+    ThresholdRule("pathological", "ap_lo", "ap_lo", ">=", 90),
+    ThresholdRule("pathological", "gluc", "gluc", ">", 1),
+    ThresholdRule("pathological", "smoke", "smoke", "==", 1),
+    ThresholdRule("pathological", "alco", "alco", "==", 1),
+    ThresholdRule("pathological", "active", "active", "==", 0),
+    ThresholdRule("pathological", "bmi", "bmi", ">=", 30),
+    ThresholdRule("pathological", "age", "age", ">=", 21900),  # 60 years * 365
+)
+
+RULE_GROUPS = tuple(dict.fromkeys(rule.group for rule in THRESHOLD_RULES))
+
+# (group, key) -> bit index, and group -> ordered [(key, bit), ...]
+RULE_BITS = {}
+GROUP_FLAGS = {group: [] for group in RULE_GROUPS}
+for _rule in THRESHOLD_RULES:
+    _id = (_rule.group, _rule.key)
+    if _id not in RULE_BITS:
+        RULE_BITS[_id] = len(RULE_BITS)
+        GROUP_FLAGS[_rule.group].append((_rule.key, RULE_BITS[_id]))
+    _rule.bit = RULE_BITS[_id]
+
+if len(RULE_BITS) > 64:
+    raise RuntimeError("Clinical rule table does not fit a 64-bit flag set")
+
+
+def evaluate_rules(features, groups=None):
+    """
+    Evaluates the rule table.
+
+    For a PatientFeatures record returns an int bitset; for a FeatureBatch
+    returns a uint64 array of bitsets, one per row. `groups` limits
+    evaluation to some rule groups (bits of other groups stay 0).
+    """
+    rules = THRESHOLD_RULES if groups is None else [r for r in THRESHOLD_RULES if r.group in groups]
+
+    if isinstance(features, FeatureBatch):
+        bits = np.zeros(len(features), dtype=np.uint64)
+        for rule in rules:
+            bits |= rule.test(features).astype(np.uint64) << np.uint64(rule.bit)
+        return bits
+
+    bits = 0
+    for rule in rules:
+        if rule.test(features):
+            bits |= 1 << rule.bit
+    return bits
+
+
+def flags_from_bits(bits: int, group: str) -> list:
+    """Keys of the set flags of one group, in table order."""
+    return [key for key, bit in GROUP_FLAGS[group] if bits >> bit & 1]
+
+
+def flag_matrix(bits: np.ndarray, group: str) -> tuple:
+    """
+    Batch view of one group: (keys, (N, len(keys)) boolean matrix).
+    """
+    keys = [key for key, _ in GROUP_FLAGS[group]]
+    shifts = np.array([bit for _, bit in GROUP_FLAGS[group]], dtype=np.uint64)
+    matrix = (bits[:, None] >> shifts[None, :]) & np.uint64(1)
+    return keys, matrix.astype(bool)
+
+
+def flags_from_batch(bits: np.ndarray, group: str) -> list:
+    """Per-row flag lists for one group (materialize only when rendering)."""
+    keys, matrix = flag_matrix(bits, group)
+    return [[keys[j] for j in np.flatnonzero(row)] for row in matrix]
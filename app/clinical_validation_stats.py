@@ -1,4 +1,7 @@
 
+import argparse
+import time
+
 import pandas as pd
 import numpy as np
 import json
@@ -8,69 +11,61 @@ from sklearn.metrics import brier_score_loss, roc_auc_score
 from sklearn.calibration import calibration_curve
 from pathlib import Path
 
+from app.dataset import FEATURE_COLUMNS, TARGET_COLUMN
+from app.columnar import load_clean_frame
+from app.bootstrap import DEFAULT_RESAMPLES, bootstrap_ci, point_metrics
+from app.risk_logic import HIGH_RISK_THRESHOLD
+from app.thresholds import ThresholdCurve, decision_curve, thresholds_by_group
+from app.subgroups import (
+    PROBABILITY_COLUMN,
+    SortedPredictions,
+    add_audit_dimensions,
+    audit_groupings,
+    subgroup_metrics,
+    to_records,
+)
+
 # Configuration
 DATA_PATH = "CVD_risk_dataset.csv"
 MODEL_PATH = "model/improved_catboost.cbm"
 OUTPUT_METRICS = "model/validation_stats.json"
 RANDOM_SEED = 42
+CI_KEY = "ci95"
+MIN_SUBGROUP_COUNT = 30
+TARGET_SENSITIVITY = 0.90
+SUBGROUP_ORDER = ["gender_1", "gender_2", "age_young", "age_middle", "age_old"]
 
 def calculate_ece(y_true, y_prob, n_bins=10):
-    prob_true, prob_pred = calibration_curve(y_true, y_prob, n_bins=n_bins, strategy='uniform')
-    
-    # We need the counts in each bin to weigh the ECE
-    counts, _ = np.histogram(y_prob, bins=np.linspace(0, 1, n_bins + 1))
-    nonzero = counts > 0
-    
-    ece = np.sum(np.abs(prob_true - prob_pred[nonzero]) * counts[nonzero]) / np.sum(counts)
-    return float(ece)
+    # Count-weighted |observed - predicted| over uniform bins, with the same
+    # bin assignment as calibration_curve (empty bins are skipped)
+    return point_metrics(y_true, y_prob, n_bins)["ece"]
 
 def calculate_net_benefit(y_true, y_prob, thresholds):
-    net_benefits = []
-    n = len(y_true)
-    
-    # Treat All
-    tp_all = np.sum(y_true == 1)
-    fp_all = np.sum(y_true == 0)
-    
-    # Treat None
-    # Net benefit is 0 by definition
-    
-    for t in thresholds:
-        if t == 1.0:
-            net_benefits.append({"threshold": float(t), "model": 0.0, "all": 0.0, "none": 0.0})
-            continue
-            
-        y_pred = (y_prob >= t).astype(int)
-        tp = np.sum((y_pred == 1) & (y_true == 1))
-        fp = np.sum((y_pred == 1) & (y_true == 0))
-        
-        weight = t / (1 - t)
-        nb_model = (tp / n) - (fp / n) * weight
-        nb_all = (tp_all / n) - (fp_all / n) * weight
-        
-        net_benefits.append({
-            "threshold": float(t),
-            "model": float(nb_model),
-            "all": float(nb_all),
-            "none": 0.0
-        })
-    
-    return net_benefits
+    # One sort + cumulative sums for all thresholds (app/thresholds.py)
+    return decision_curve(y_true, y_prob, thresholds)
 
 def main():
+    parser = argparse.ArgumentParser(description="Clinical validation statistics on the test split")
+    parser.add_argument("--bootstrap", type=int, default=DEFAULT_RESAMPLES,
+                        help="Bootstrap resamples for 95%% CIs (0 disables)")
+    parser.add_argument("--workers", type=int, default=1, help="Processes for the bootstrap")
+    args = parser.parse_args()
+
+    def ci(y_t, y_p):
+        # Resampling is done within each group
+        return bootstrap_ci(np.asarray(y_t), np.asarray(y_p), args.bootstrap,
+                            seed=RANDOM_SEED, workers=args.workers)
+
+    bootstrap_sec = 0.0
+
     print("Loading data...")
-    df = pd.read_csv(DATA_PATH)
+    # Same cleaning as the training script (app/dataset.py), from the
+    # columnar copy when it is up to date
+    df = load_clean_frame(DATA_PATH)
     
-    # Simple cleaning as in training script to ensure consistency
-    df = df[(df['ap_hi'] >= 40) & (df['ap_hi'] <= 250) & 
-            (df['ap_lo'] >= 30) & (df['ap_lo'] <= 200) & 
-            (df['ap_hi'] > df['ap_lo'])]
-    df['bmi'] = df['weight'] / ((df['height'] / 100) ** 2)
-    df = df[(df['bmi'] >= 10) & (df['bmi'] <= 60)]
-    
-    feature_cols = ['age', 'gender', 'height', 'weight', 'ap_hi', 'ap_lo', 'cholesterol', 'gluc', 'smoke', 'alco', 'active', 'bmi']
+    feature_cols = FEATURE_COLUMNS
     X = df[feature_cols]
-    y = df['cardio']
+    y = df[TARGET_COLUMN]
     
     _, X_test, _, y_test = train_test_split(X, y, test_size=0.2, random_state=RANDOM_SEED, stratify=y)
     
@@ -84,49 +79,63 @@ def main():
     brier = brier_score_loss(y_test, y_prob)
     ece = calculate_ece(y_test, y_prob)
     auc = roc_auc_score(y_test, y_prob)
+    if args.bootstrap:
+        print(f"Bootstrapping {args.bootstrap} resamples...")
+        started = time.perf_counter()
+        overall_ci = ci(y_test, y_prob)
+        overall_sec = time.perf_counter() - started
+        bootstrap_sec += overall_sec
+        print(f"Overall CIs: {overall_sec:.2f}s for {args.bootstrap} resamples x {len(y_test)} rows")
     
     # Calibration Plot Data
     prob_true, prob_pred = calibration_curve(y_test, y_prob, n_bins=10)
     
     print("Calculating subgroup analysis...")
-    # Gender (1=female, 2=male usually)
-    subgroups = {}
-    
-    for gender in [1, 2]:
-        mask = X_test['gender'] == gender
-        if mask.any():
-            y_t = y_test[mask]
-            y_p = y_prob[mask]
-            subgroups[f"gender_{gender}"] = {
-                "auc": float(roc_auc_score(y_t, y_p)),
-                "brier": float(brier_score_loss(y_t, y_p)),
-                "ece": calculate_ece(y_t, y_p),
-                "count": int(mask.sum())
-            }
-            
-    # Age Groups
-    # age in dataset is in days
+    # age in dataset is in days; gender 1=female, 2=male
     df_test = X_test.copy()
-    df_test['y_true'] = y_test
-    df_test['y_prob'] = y_prob
-    df_test['age_years'] = df_test['age'] / 365.25
-    
-    age_bins = [0, 45, 65, 100]
-    age_labels = ["young", "middle", "old"]
-    df_test['age_group'] = pd.cut(df_test['age_years'], bins=age_bins, labels=age_labels)
-    
-    for label in age_labels:
-        mask = df_test['age_group'] == label
-        if mask.any():
-            y_t = df_test.loc[mask, 'y_true']
-            y_p = df_test.loc[mask, 'y_prob']
-            subgroups[f"age_{label}"] = {
-                "auc": float(roc_auc_score(y_t, y_p)),
-                "brier": float(brier_score_loss(y_t, y_p)),
-                "ece": calculate_ece(y_t, y_p),
-                "count": int(mask.sum())
-            }
+    df_test[TARGET_COLUMN] = y_test
+    df_test[PROBABILITY_COLUMN] = y_prob
+    df_test['gender_group'] = df_test['gender'].astype(str)
+    df_test['age_group'] = pd.cut(df_test['age'] / 365.25, bins=[0, 45, 65, 100],
+                                  labels=["young", "middle", "old"]).astype(str)
+    df_test = add_audit_dimensions(df_test)
+
+    # All groupings in one grouped pass over predictions sorted once (app/subgroups.py)
+    predictions = SortedPredictions(df_test[TARGET_COLUMN], y_prob, HIGH_RISK_THRESHOLD)
+    started = time.perf_counter()
+    legacy = subgroup_metrics(df_test, [("gender_group",), ("age_group",)], sorted_predictions=predictions)
+    intersectional = subgroup_metrics(df_test, audit_groupings(df_test.columns),
+                                      min_count=MIN_SUBGROUP_COUNT, sorted_predictions=predictions)
+    print(f"{len(intersectional)} subgroups in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    subgroups = {}
+    for row in legacy.to_dict("records"):
+        if row["grouping"] == "gender_group":
+            key, mask = f"gender_{row['gender_group']}", df_test['gender_group'] == row['gender_group']
+        else:
+            key, mask = f"age_{row['age_group']}", df_test['age_group'] == row['age_group']
+        subgroups[key] = {
+            "auc": float(row["auc"]),
+            "brier": float(row["brier"]),
+            "ece": float(row["ece"]),
+            "count": int(row["count"]),
+            "sensitivity": float(row["sensitivity"]),
+            "specificity": float(row["specificity"]),
+        }
+        if args.bootstrap:
+            started = time.perf_counter()
+            subgroups[key][CI_KEY] = ci(y_test[mask.to_numpy()], y_prob[mask.to_numpy()])
+            bootstrap_sec += time.perf_counter() - started
+    subgroups = dict(sorted(subgroups.items(), key=lambda item: SUBGROUP_ORDER.index(item[0])))
             
+    print("Calculating operating thresholds...")
+    # Threshold reaching the target sensitivity, overall and within each subgroup
+    operating = {"target_sensitivity": TARGET_SENSITIVITY}
+    operating["overall"] = ThresholdCurve(y_test, y_prob).pick_threshold(min_sensitivity=TARGET_SENSITIVITY)
+    for column in ("sex", "age_group", "bmi_band"):
+        operating[column] = thresholds_by_group(y_test, y_prob, df_test[column],
+                                                min_sensitivity=TARGET_SENSITIVITY)
+
     print("Calculating DCA...")
     thresholds = np.linspace(0, 0.5, 51) # Focus on low-moderate thresholds for screening
     dca_data = calculate_net_benefit(y_test, y_prob, thresholds)
@@ -142,8 +151,24 @@ def main():
             }
         },
         "subgroups": subgroups,
+        "intersectional": {
+            "threshold": HIGH_RISK_THRESHOLD,
+            "min_count": MIN_SUBGROUP_COUNT,
+            "groups": to_records(intersectional),
+        },
+        "operating_thresholds": operating,
         "dca": dca_data
     }
+    if args.bootstrap:
+        stats["overall"][CI_KEY] = overall_ci
+        stats["bootstrap"] = {
+            "resamples": args.bootstrap,
+            "method": "percentile",
+            "workers": args.workers,
+            "overall_sec": round(overall_sec, 3),
+            "total_sec": round(bootstrap_sec, 3),
+        }
+        print(f"Bootstrap total: {bootstrap_sec:.2f}s")
     
     with open(OUTPUT_METRICS, 'w') as f:
         json.dump(stats, f, indent=4)
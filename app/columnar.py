@@ -0,0 +1,302 @@
+"""
+Колоночный слой данных: очищенный датасет в Arrow IPC и Parquet.
+
+The CSV is parsed and cleaned once (app/dataset.py rules, BMI
+materialized); offline tools then read the Arrow file memory-mapped, so
+columns are NumPy views over the mapped file with no parsing or copying.
+Parquet is written alongside as the compressed interchange copy. Both
+carry the source CSV hash and the cleaning fingerprint in their schema
+metadata; a stale file is ignored and the CSV path is used instead.
+
+Requires pyarrow (optional dependency).
+
+Usage:
+    python -m app.columnar build
+    python -m app.columnar benchmark
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timezone
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from app.dataset import (
+    DATA_PATH,
+    FEATURE_COLUMNS,
+    TARGET_COLUMN,
+    clean_dataset,
+    cleaning_fingerprint,
+    file_fingerprint,
+)
+
+COLUMNAR_DIR = Path("data")
+CLEAN_ARROW_PATH = COLUMNAR_DIR / "cvd_clean.arrow"
+CLEAN_PARQUET_PATH = COLUMNAR_DIR / "cvd_clean.parquet"
+
+METADATA_KEY = b"cvd_dataset"
+
+
+def pyarrow_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Columnar datasets require pyarrow (pip install pyarrow)")
+    return pa, pq
+
+
+def build_columnar_dataset(csv_path=DATA_PATH, arrow_path=CLEAN_ARROW_PATH,
+                           parquet_path=CLEAN_PARQUET_PATH) -> dict:
+    """Cleans the CSV once and writes the Arrow + Parquet copies. Returns their metadata."""
+    pa, pq = _pyarrow()
+
+    df = pd.read_csv(csv_path)
+    df_clean = clean_dataset(df)
+    columns = [c for c in ("id",) if c in df_clean.columns] + FEATURE_COLUMNS + [TARGET_COLUMN]
+
+    metadata = {
+        "source": str(csv_path),
+        "source_sha256": file_fingerprint(csv_path),
+        "cleaning": cleaning_fingerprint(),
+        "source_rows": len(df),
+        "rows": len(df_clean),
+        "built_at": datetime.now(timezone.utc).isoformat(),
+    }
+    # One contiguous chunk per column, so reads can be zero-copy
+    table = pa.Table.from_pandas(df_clean[columns], preserve_index=False).combine_chunks()
+    table = table.replace_schema_metadata({METADATA_KEY: json.dumps(metadata)})
+
+    for path, write in (
+        (arrow_path, lambda tmp: _write_arrow(pa, table, tmp)),
+        (parquet_path, lambda tmp: pq.write_table(table, tmp, compression="zstd")),
+    ):
+        if path is None:
+            continue
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        write(tmp)
+        os.replace(tmp, path)
+
+    return metadata
+
+
+def _write_arrow(pa, table, path):
+    # Uncompressed IPC file: required for memory-mapped zero-copy reads
+    with pa.OSFile(str(path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def open_columnar_dataset(path=CLEAN_ARROW_PATH):
+    """
+    Returns a pyarrow.Table. Arrow files are memory-mapped (zero-copy);
+    Parquet files are decoded into memory.
+    """
+    pa, pq = _pyarrow()
+    path = Path(path)
+    if path.suffix == ".parquet":
+        return pq.read_table(path, memory_map=True)
+    return pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+
+
+def read_metadata(path) -> dict:
+    pa, pq = _pyarrow()
+    path = Path(path)
+    if path.suffix == ".parquet":
+        schema = pq.read_schema(path)
+    else:
+        schema = pa.ipc.open_file(pa.memory_map(str(path), "r")).schema
+    raw = (schema.metadata or {}).get(METADATA_KEY)
+    return json.loads(raw) if raw else {}
+
+
+def is_fresh(path, csv_path=DATA_PATH) -> bool:
+    """True when `path` was built from the current CSV with the current cleaning rules."""
+    path = Path(path)
+    if not path.exists() or not pyarrow_available():
+        return False
+    metadata = read_metadata(path)
+    return (
+        metadata.get("cleaning") == cleaning_fingerprint()
+        and metadata.get("source_sha256") == file_fingerprint(csv_path)
+    )
+
+
+def column_arrays(table, names=None) -> dict:
+    """
+    name -> NumPy array. For single-chunk, null-free numeric columns of a
+    memory-mapped table these are views over the file (no copy).
+    """
+    arrays = {}
+    for name in names or table.column_names:
+        column = table.column(name)
+        if column.num_chunks == 1 and column.null_count == 0:
+            arrays[name] = column.chunk(0).to_numpy(zero_copy_only=False)
+        else:
+            arrays[name] = column.to_numpy()
+    return arrays
+
+
+def feature_matrix(table) -> tuple:
+    """(X as (N, 12) float matrix in model order, y) from a cleaned table."""
+    arrays = column_arrays(table, FEATURE_COLUMNS + [TARGET_COLUMN])
+    X = np.column_stack([arrays[c] for c in FEATURE_COLUMNS]).astype(float, copy=False)
+    return X, arrays[TARGET_COLUMN]
+
+
+def load_clean_frame(csv_path=DATA_PATH, columnar_path=CLEAN_ARROW_PATH) -> pd.DataFrame:
+    """
+    Cleaned dataset as a DataFrame: from the columnar copy when it is fresh,
+    otherwise parsed and cleaned from the CSV. `df.attrs["source_rows"]`
+    holds the raw row count and `df.attrs["source"]` where it came from.
+    """
+    if columnar_path is not None and is_fresh(columnar_path, csv_path):
+        table = open_columnar_dataset(columnar_path)
+        df_clean = table.to_pandas()
+        df_clean.attrs["source_rows"] = read_metadata(columnar_path)["source_rows"]
+        df_clean.attrs["source"] = str(columnar_path)
+        return df_clean
+
+    df = pd.read_csv(csv_path)
+    df_clean = clean_dataset(df).reset_index(drop=True)
+    df_clean.attrs["source_rows"] = len(df)
+    df_clean.attrs["source"] = str(csv_path)
+    return df_clean
+
+
+def iter_record_batches(path, batch_size: int, skip_batches: int = 0):
+    """Streams a Parquet or Arrow file as pyarrow RecordBatches of `batch_size` rows."""
+    pa, pq = _pyarrow()
+    path = Path(path)
+    if path.suffix == ".parquet":
+        batches = pq.ParquetFile(path).iter_batches(batch_size=batch_size)
+    else:
+        batches = open_columnar_dataset(path).to_batches(max_chunksize=batch_size)
+    return islice(batches, skip_batches, None)
+
+
+# -------------------------
+# Memory-mapped index files
+# -------------------------
+
+def save_mapped_array(output_dir, stem: str, array: np.ndarray) -> str:
+    """
+    Writes `array` to a new <stem>-<build>.npy in `output_dir` and returns
+    its file name. A file a running process may have memory-mapped is never
+    rewritten in place (truncating it under the mapping is a SIGBUS); the
+    manifest written by publish_manifest points to the new file.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    name = f"{stem}-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}.npy"
+    tmp = output_dir / f".{name}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, output_dir / name)
+    return name
+
+
+def publish_manifest(output_dir, manifest_name: str, manifest: dict, stem: str, key: str = "array"):
+    """
+    Atomically replaces the manifest (readers see the old build or the new
+    one, never a mix), then removes <stem>-*.npy files of older builds,
+    keeping the previous one for readers that loaded the old manifest
+    a moment ago. Unlinking a mapped file is safe: the mapping keeps it.
+    """
+    output_dir = Path(output_dir)
+    path = output_dir / manifest_name
+    previous = None
+    if path.exists():
+        try:
+            with open(path, "r") as f:
+                previous = json.load(f).get(key)
+        except (OSError, ValueError):
+            previous = None
+
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+    keep = {manifest[key], previous}
+    for old in output_dir.glob(f"{stem}-*.npy"):
+        if old.name not in keep:
+            try:
+                old.unlink()
+            except OSError:
+                pass  # Still open on a platform that forbids deleting it
+
+
+# -------------------------
+# Load-time comparison
+# -------------------------
+
+def _best_of(fn, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def benchmark_load(csv_path=DATA_PATH, arrow_path=CLEAN_ARROW_PATH,
+                   parquet_path=CLEAN_PARQUET_PATH, repeats: int = 5) -> dict:
+    """
+    Best-of-`repeats` seconds to get the cleaned feature matrix + target:
+    CSV (parse + clean), Parquet (decode) and memory-mapped Arrow.
+    """
+    def from_csv():
+        df_clean = clean_dataset(pd.read_csv(csv_path))
+        return df_clean[FEATURE_COLUMNS].to_numpy(dtype=float), df_clean[TARGET_COLUMN].to_numpy()
+
+    results = {"rows": read_metadata(arrow_path).get("rows")}
+    results["csv_sec"] = _best_of(from_csv, repeats)
+    results["parquet_sec"] = _best_of(lambda: feature_matrix(open_columnar_dataset(parquet_path)), repeats)
+    results["arrow_mmap_sec"] = _best_of(lambda: feature_matrix(open_columnar_dataset(arrow_path)), repeats)
+    results["arrow_mmap_columns_sec"] = _best_of(
+        lambda: column_arrays(open_columnar_dataset(arrow_path)), repeats
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar (Arrow/Parquet) copy of the cleaned dataset")
+    parser.add_argument("command", choices=("build", "benchmark"))
+    parser.add_argument("--csv", default=DATA_PATH)
+    parser.add_argument("--arrow", default=str(CLEAN_ARROW_PATH))
+    parser.add_argument("--parquet", default=str(CLEAN_PARQUET_PATH))
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "build" or not is_fresh(args.arrow, args.csv):
+        metadata = build_columnar_dataset(args.csv, args.arrow, args.parquet)
+        print(f"Built {args.arrow} and {args.parquet}: {metadata['rows']} of {metadata['source_rows']} rows")
+        if args.command == "build":
+            return
+
+    r = benchmark_load(args.csv, args.arrow, args.parquet, args.repeats)
+    print(f"Rows: {r['rows']}")
+    print(f"CSV parse + clean:        {r['csv_sec'] * 1000:8.1f} ms")
+    print(f"Parquet -> matrix:        {r['parquet_sec'] * 1000:8.1f} ms  (x{r['csv_sec'] / r['parquet_sec']:.0f})")
+    print(f"Arrow mmap -> matrix:     {r['arrow_mmap_sec'] * 1000:8.1f} ms  (x{r['csv_sec'] / r['arrow_mmap_sec']:.0f})")
+    print(f"Arrow mmap column views:  {r['arrow_mmap_columns_sec'] * 1000:8.1f} ms  "
+          f"(x{r['csv_sec'] / r['arrow_mmap_columns_sec']:.0f})")
+
+
+if __name__ == "__main__":
+    main()
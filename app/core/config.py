@@ -28,6 +28,80 @@ class Settings(BaseSettings):
     
     # Производительность
     max_request_size: int = 1024 * 1024  # 1MB
+
+    # Журнал предсказаний (JSONL) для аудита и replay трафика.
+    # Пустая строка отключает запись.
+    # ВНИМАНИЕ: файл содержит медицинские данные (вход пациента и объяснение).
+    # Они пишутся только при согласии пользователя (бот: consent_yes,
+    # API: заголовок X-Data-Consent: true); храните файл с ограниченным доступом.
+    prediction_log_path: str = ""
+
+    # Ключ для административных эндпоинтов (hot reload модели).
+    # Пустая строка отключает их.
+    admin_api_key: str = ""
+
+    # Региональные модели: <region_models_dir>/<WHO код>/improved_catboost.cbm.
+    # Загружаются лениво, в памяти держится не больше region_model_cache_size.
+    region_models_dir: str = "model/regions"
+    region_model_cache_size: int = 2
+
+    # Адаптивная деградация объяснений под нагрузкой:
+    # full SHAP -> SHAP на сжатом background -> только правила.
+    adaptive_degradation: bool = True
+    explain_latency_budget_ms: float = 3000.0
+    degradation_max_in_flight: int = 4
+    degradation_window: int = 20
+    degradation_cooldown_sec: float = 15.0
+    shap_summary_background_size: int = 20
+
+    # Бюджет времени на запрос (мс). Заголовок X-Request-Timeout-Ms
+    # переопределяет его в пределах max_request_budget_ms; 0 — без дедлайна.
+    request_budget_ms: float = 10000.0
+    max_request_budget_ms: float = 60000.0
+
+    # Shadow-оценка модели-кандидата на доле живого трафика.
+    # Пустой путь отключает shadow-режим.
+    shadow_model_path: str = ""
+    shadow_sample_rate: float = 0.1
+    shadow_cpu_budget: float = 0.25  # доля одного ядра для shadow-потока
+    shadow_queue_size: int = 64
+
+    # Потоковый скоринг NDJSON (/api/predict/stream): строки скорятся
+    # микробатчами до stream_batch_size; max_request_size ограничивает одну строку.
+    # Неотправленные результаты держатся в памяти до stream_spool_memory_bytes,
+    # дальше во временном файле; выше stream_spool_max_bytes чтение входа встает.
+    stream_batch_size: int = 256
+    stream_spool_memory_bytes: int = 8 * 1024 * 1024
+    stream_spool_max_bytes: int = 512 * 1024 * 1024
+
+    # What-if сценарии (/api/predict/what-if): все варианты скорятся одним
+    # вызовом модели; SHAP только для сценариев с explain=true.
+    whatif_max_scenarios: int = 16
+
+    # Контрфактический поиск (/api/predict/counterfactual): максимум
+    # оценок модели на запрос (клиент может запросить меньше).
+    counterfactual_max_evaluations: int = 2000
+
+    # Кривые риска (/api/predict/risk-curves): точек на кривую и LRU кэш
+    # по (версия модели, вектор признаков, кривые, точки).
+    risk_curve_max_points: int = 200
+    risk_curve_cache_size: int = 1024
+
+    # Популяционный перцентиль (python -m app.population_index): индекс
+    # читается лениво через memory map; страты меньше min_count
+    # заменяются более широкими.
+    population_index_dir: str = "model/population_index"
+    population_index_min_count: int = 50
+
+    # Похожие пациенты (python -m app.similar_patients): KD-tree шарды
+    # грузятся при первом запросе, не при старте API.
+    similar_index_dir: str = "data/similar_patients"
+    similar_max_k: int = 100
+
+    # Приближённый SHAP по таблице (python -m app.shap_lookup): уровень
+    # деградации "lookup" между summary и rules; смешивание k соседей.
+    shap_lookup_dir: str = "data/shap_lookup"
+    shap_lookup_neighbors: int = 5
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,215 @@
+"""
+Реестр моделей: фоновая загрузка, прогрев и атомарная замена
+"""
+import logging
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from app.core.config import settings
+from app.model_loader import (
+    MODEL_PATH,
+    METRICS_PATH,
+    load_model,
+    compute_model_hash,
+    describe_model_version,
+    load_training_metrics,
+    get_model_performance_metrics,
+)
+from app.shap_explainer import BACKGROUND_PATH, create_shap_explainer, load_background_data
+from app.risk_logic import HIGH_RISK_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+
+class ModelBundle:
+    """
+    Everything a request needs from one model version.
+
+    A bundle is never mutated after construction: requests take a reference
+    to the current bundle once and use it for their whole lifetime, so a
+    swap in the middle of a request cannot mix two model versions.
+    """
+
+    __slots__ = (
+        "model", "shap_explainer", "summary_explainer", "model_metrics", "training_metrics",
+        "high_risk_threshold", "model_hash", "version", "model_path",
+        "background_path", "loaded_at",
+    )
+
+    def __init__(self, model, shap_explainer, summary_explainer, model_metrics,
+                 training_metrics, high_risk_threshold, model_hash, version,
+                 model_path, background_path, loaded_at):
+        self.model = model
+        self.shap_explainer = shap_explainer
+        self.summary_explainer = summary_explainer
+        self.model_metrics = model_metrics
+        self.training_metrics = training_metrics
+        self.high_risk_threshold = high_risk_threshold
+        self.model_hash = model_hash
+        self.version = version
+        self.model_path = model_path
+        self.background_path = background_path
+        self.loaded_at = loaded_at
+
+    def describe(self) -> dict:
+        return {
+            "version": self.version,
+            "model_hash": self.model_hash,
+            "model_path": str(self.model_path),
+            "background_path": str(self.background_path),
+            "high_risk_threshold": self.high_risk_threshold,
+            "loaded_at": self.loaded_at,
+        }
+
+
+def load_bundle(model_path=MODEL_PATH, background_path=BACKGROUND_PATH,
+                metrics_path=METRICS_PATH, warm: bool = True) -> ModelBundle:
+    """Loads model + SHAP background + metrics and optionally warms them up."""
+    model_path = Path(model_path)
+    model = load_model(model_path)
+    model_hash = compute_model_hash(model_path)
+    shap_explainer = create_shap_explainer(model, background_path)
+    summary_explainer = create_shap_explainer(
+        model, background_path, background_size=settings.shap_summary_background_size
+    )
+    training_metrics = load_training_metrics(metrics_path)
+
+    if warm:
+        warm_up(model, shap_explainer, background_path)
+        warm_up(model, summary_explainer, background_path)
+
+    return ModelBundle(
+        model=model,
+        shap_explainer=shap_explainer,
+        summary_explainer=summary_explainer,
+        model_metrics=get_model_performance_metrics(training_metrics),
+        training_metrics=training_metrics,
+        high_risk_threshold=float(training_metrics.get("threshold_90_sens", HIGH_RISK_THRESHOLD)),
+        model_hash=model_hash,
+        version=describe_model_version(model_hash),
+        model_path=model_path,
+        background_path=Path(background_path),
+        loaded_at=datetime.now(timezone.utc).isoformat(),
+    )
+
+
+def warm_up(model, shap_explainer, background_path=BACKGROUND_PATH):
+    """
+    Runs the prediction and explanation paths once so the first live
+    request on a new version does not pay for lazy initialization,
+    and rejects models that produce invalid probabilities.
+    """
+    sample = load_background_data(background_path).values[:1]
+    proba = model.predict_proba(sample)
+    if not np.all(np.isfinite(proba)) or proba.shape != (1, 2):
+        raise ValueError("Model warm-up produced invalid probabilities")
+    # One permutation is enough to exercise the explainer
+    shap_explainer(sample, max_evals=2 * sample.shape[1] + 1, silent=True)
+
+
+class ModelRegistry:
+    """
+    Holds the bundle currently being served.
+
+    Reads are a single attribute access (atomic under the GIL); reloads
+    build the new bundle on a background thread and publish it with one
+    assignment. Listeners are notified after each swap so version-keyed
+    caches can drop stale entries.
+    """
+
+    def __init__(self):
+        self._current = None
+        self._lock = threading.Lock()
+        self._reload_thread = None
+        self._listeners = []
+        self.last_reload = {"status": "idle"}
+
+    @property
+    def current(self) -> ModelBundle | None:
+        return self._current
+
+    def load_initial(self, **paths):
+        """
+        Loads the startup bundle without blocking on warm-up; the first SHAP
+        call pays a one-off JIT compile, so it is triggered in the background
+        instead of on the first live request.
+        """
+        with self._lock:
+            if self._current is None:
+                bundle = load_bundle(warm=False, **paths)
+                self._publish(bundle)
+                threading.Thread(
+                    target=self._warm_in_background,
+                    args=(bundle,),
+                    name="model-warmup",
+                    daemon=True,
+                ).start()
+        return self._current
+
+    @staticmethod
+    def _warm_in_background(bundle: ModelBundle):
+        try:
+            warm_up(bundle.model, bundle.shap_explainer, bundle.background_path)
+            warm_up(bundle.model, bundle.summary_explainer, bundle.background_path)
+        except Exception as e:
+            logger.error(f"Background warm-up of {bundle.version} failed: {e}")
+
+    def subscribe(self, callback):
+        """callback(new_bundle, old_bundle) is invoked after every swap."""
+        self._listeners.append(callback)
+
+    def _publish(self, bundle: ModelBundle):
+        previous = self._current
+        self._current = bundle
+        logger.info(f"Serving model {bundle.version}")
+        for callback in self._listeners:
+            try:
+                callback(bundle, previous)
+            except Exception as e:
+                logger.error(f"Model swap listener failed: {e}")
+
+    def reload_async(self, model_path=MODEL_PATH, background_path=BACKGROUND_PATH,
+                     metrics_path=METRICS_PATH) -> bool:
+        """
+        Starts a background reload. Returns False if one is already running.
+        """
+        with self._lock:
+            if self._reload_thread is not None and self._reload_thread.is_alive():
+                return False
+            self.last_reload = {
+                "status": "loading",
+                "model_path": str(model_path),
+                "started_at": datetime.now(timezone.utc).isoformat(),
+            }
+            self._reload_thread = threading.Thread(
+                target=self._reload,
+                args=(model_path, background_path, metrics_path),
+                name="model-reload",
+                daemon=True,
+            )
+            self._reload_thread.start()
+        return True
+
+    def _reload(self, model_path, background_path, metrics_path):
+        try:
+            bundle = load_bundle(model_path, background_path, metrics_path, warm=True)
+        except Exception as e:
+            logger.error(f"Model reload failed, keeping {self._current and self._current.version}: {e}")
+            self.last_reload = {**self.last_reload, "status": "failed", "error": str(e)}
+            return
+
+        with self._lock:
+            self._publish(bundle)
+        self.last_reload = {
+            **self.last_reload,
+            "status": "swapped",
+            "version": bundle.version,
+            "finished_at": bundle.loaded_at,
+        }
+
+
+# Global instance
+model_registry = ModelRegistry()
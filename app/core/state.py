@@ -1,16 +1,36 @@
-from app.model_loader import load_model, get_model_performance_metrics
-from app.shap_explainer import create_shap_explainer
+from app.core.model_registry import model_registry
+
 
 class AppState:
-    model = None
-    shap_explainer = None
-    model_metrics = None
-    
-    @classmethod
-    def initialize(cls):
-        if cls.model is None:
-            cls.model = load_model()
-            cls.shap_explainer = create_shap_explainer(cls.model)
-            cls.model_metrics = get_model_performance_metrics()
-
-global_state = AppState
+    """
+    Facade over the model registry.
+
+    Attributes always reflect the bundle being served right now; code that
+    needs a consistent model/explainer/metrics triple for a whole request
+    should take `bundle` once instead of reading the attributes separately.
+    """
+    registry = model_registry
+
+    def initialize(self):
+        self.registry.load_initial()
+
+    @property
+    def bundle(self):
+        return self.registry.current
+
+    @property
+    def model(self):
+        bundle = self.registry.current
+        return bundle.model if bundle is not None else None
+
+    @property
+    def shap_explainer(self):
+        bundle = self.registry.current
+        return bundle.shap_explainer if bundle is not None else None
+
+    @property
+    def model_metrics(self):
+        bundle = self.registry.current
+        return bundle.model_metrics if bundle is not None else None
+
+global_state = AppState()
@@ -0,0 +1,109 @@
+"""
+Датасет CVD_risk_dataset.csv: единые правила очистки и признаки.
+
+Used by train_improved_model.py, clinical validation and bulk scoring so
+all of them see exactly the same rows and the same derived BMI.
+"""
+import hashlib
+import json
+from pathlib import Path
+
+import pandas as pd
+
+from app.features import MODEL_FEATURES, compute_bmi
+
+DATA_PATH = "CVD_risk_dataset.csv"
+
+FEATURE_COLUMNS = list(MODEL_FEATURES)
+TARGET_COLUMN = "cardio"
+
+# Valid ranges based on physiological limits and common sense for this dataset
+AP_HI_RANGE = (40, 250)
+AP_LO_RANGE = (30, 200)
+HEIGHT_RANGE = (100, 250)
+WEIGHT_RANGE = (30, 250)
+BMI_RANGE = (10, 60)
+
+# Bump when cleaning_mask / clean_dataset change in a way the ranges above
+# do not capture; invalidates cached derived datasets (see cleaning_fingerprint).
+CLEANING_VERSION = 1
+
+
+def cleaning_mask(df: pd.DataFrame) -> pd.Series:
+    """Rows with realistic blood pressure and anthropometry."""
+    # Systolic must be > Diastolic
+    mask_bp = df['ap_hi'].between(*AP_HI_RANGE) & \
+              df['ap_lo'].between(*AP_LO_RANGE) & \
+              (df['ap_hi'] > df['ap_lo'])
+
+    mask_anthropometry = df['height'].between(*HEIGHT_RANGE) & \
+                         df['weight'].between(*WEIGHT_RANGE)
+
+    return mask_bp & mask_anthropometry
+
+
+def add_bmi(df: pd.DataFrame) -> pd.DataFrame:
+    df['bmi'] = compute_bmi(df['weight'], df['height'])
+    return df
+
+
+def clean_dataset(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Outlier removal + BMI feature + BMI filter (realistic range 10-60).
+    Returns a new frame; the input is not modified.
+    """
+    df_clean = add_bmi(df[cleaning_mask(df)].copy())
+    return df_clean[df_clean['bmi'].between(*BMI_RANGE)]
+
+
+def load_clean_dataset(path=DATA_PATH):
+    """Returns (X, y) ready for training/validation."""
+    df_clean = clean_dataset(pd.read_csv(path))
+    return df_clean[FEATURE_COLUMNS], df_clean[TARGET_COLUMN]
+
+
+def cleaning_fingerprint() -> str:
+    """Identifies the cleaning rules; part of every derived-dataset cache key."""
+    rules = {
+        "version": CLEANING_VERSION,
+        "ap_hi": AP_HI_RANGE,
+        "ap_lo": AP_LO_RANGE,
+        "height": HEIGHT_RANGE,
+        "weight": WEIGHT_RANGE,
+        "bmi": BMI_RANGE,
+        "features": FEATURE_COLUMNS,
+    }
+    return hashlib.sha256(json.dumps(rules, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def file_fingerprint(path) -> str:
+    """SHA-256 of a source file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_clean_chunks(path, chunksize: int, skip_chunks: int = 0):
+    """
+    Streams a dataset file: yields (chunk_number, raw_rows, cleaned_df).
+
+    CSV is read with pandas; `.parquet` / `.arrow` inputs (see
+    app/columnar.py) are read batch by batch with pyarrow. `skip_chunks`
+    skips already processed chunks without parsing them (for CSV this
+    assumes one record per line, as in CVD_risk_dataset.csv).
+    """
+    suffix = Path(path).suffix
+    if suffix in (".parquet", ".arrow"):
+        from app.columnar import iter_record_batches
+
+        reader = (
+            batch.to_pandas()
+            for batch in iter_record_batches(path, chunksize, skip_batches=skip_chunks)
+        )
+    else:
+        skiprows = range(1, 1 + skip_chunks * chunksize) if skip_chunks else None
+        reader = pd.read_csv(path, chunksize=chunksize, skiprows=skiprows)
+    for number, chunk in enumerate(reader, start=skip_chunks):
+        yield number, len(chunk), clean_dataset(chunk)
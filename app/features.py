@@ -0,0 +1,150 @@
+"""
+Derived-feature stage: model vector and clinical derived values, computed once.
+
+Every pipeline stage (model, SHAP interpretation, safety checks, clinical
+rules) reads from these records instead of re-deriving BMI or age in days
+from the raw input.
+"""
+import numpy as np
+
+# Model input order, identical to train_improved_model.py
+MODEL_FEATURES = (
+    "age", "gender", "height", "weight", "ap_hi", "ap_lo",
+    "cholesterol", "gluc", "smoke", "alco", "active", "bmi",
+)
+
+DAYS_PER_YEAR = 365.25
+
+
+def compute_bmi(weight, height):
+    """BMI = weight (kg) / height (m)^2. Works on scalars and arrays."""
+    return weight / ((height / 100) ** 2)
+
+
+class PatientFeatures:
+    """
+    Single-patient record.
+
+    Attribute names match both PatientInput (`age_years`, `ap_hi`, ...) and
+    the model columns (`age` is in days, `bmi` is derived), so stages can
+    read any of them directly.
+    """
+
+    __slots__ = (
+        "age_years", "age", "gender", "height", "weight", "ap_hi", "ap_lo",
+        "cholesterol", "gluc", "smoke", "alco", "active", "bmi", "vector",
+    )
+
+    def __init__(self, age_years, gender, height, weight, ap_hi, ap_lo,
+                 cholesterol, gluc, smoke, alco, active):
+        self.age_years = age_years
+        self.age = age_years * DAYS_PER_YEAR
+        self.gender = gender
+        self.height = height
+        self.weight = weight
+        self.ap_hi = ap_hi
+        self.ap_lo = ap_lo
+        self.cholesterol = cholesterol
+        self.gluc = gluc
+        self.smoke = smoke
+        self.alco = alco
+        self.active = active
+        self.bmi = compute_bmi(weight, height) if height > 0 else 0.0
+        self.vector = np.array([[
+            self.age, gender, height, weight, ap_hi, ap_lo,
+            cholesterol, gluc, smoke, alco, active, self.bmi,
+        ]])
+
+    @classmethod
+    def from_patient(cls, patient) -> "PatientFeatures":
+        return cls(
+            age_years=patient.age_years,
+            gender=patient.gender,
+            height=patient.height,
+            weight=patient.weight,
+            ap_hi=patient.ap_hi,
+            ap_lo=patient.ap_lo,
+            cholesterol=patient.cholesterol,
+            gluc=patient.gluc,
+            smoke=patient.smoke,
+            alco=patient.alco,
+            active=patient.active,
+        )
+
+    @property
+    def age_days(self):
+        return self.age
+
+
+def as_features(patient) -> PatientFeatures:
+    """Accepts a PatientInput (or anything with the same fields) or a ready record."""
+    if isinstance(patient, PatientFeatures):
+        return patient
+    return PatientFeatures.from_patient(patient)
+
+
+class FeatureBatch:
+    """
+    Column arrays for many patients.
+
+    `matrix` is the (N, 12) model input in MODEL_FEATURES order; each
+    feature is also exposed as a 1-D column view of it, plus `age_years`.
+    """
+
+    __slots__ = MODEL_FEATURES + ("age_years", "matrix")
+
+    def __init__(self, matrix: np.ndarray):
+        matrix = np.asarray(matrix, dtype=float)
+        if matrix.ndim != 2 or matrix.shape[1] != len(MODEL_FEATURES):
+            raise ValueError(f"Expected an (N, {len(MODEL_FEATURES)}) feature matrix, got {matrix.shape}")
+        self.matrix = matrix
+        for i, name in enumerate(MODEL_FEATURES):
+            setattr(self, name, matrix[:, i])
+        self.age_years = self.age / DAYS_PER_YEAR
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @classmethod
+    def from_columns(cls, age_years, gender, height, weight, ap_hi, ap_lo,
+                     cholesterol, gluc, smoke, alco, active) -> "FeatureBatch":
+        height = np.asarray(height, dtype=float)
+        weight = np.asarray(weight, dtype=float)
+        matrix = np.column_stack([
+            np.asarray(age_years, dtype=float) * DAYS_PER_YEAR,
+            gender, height, weight, ap_hi, ap_lo,
+            cholesterol, gluc, smoke, alco, active,
+            compute_bmi(weight, height),
+        ])
+        return cls(matrix)
+
+    @classmethod
+    def from_patients(cls, patients) -> "FeatureBatch":
+        patients = list(patients)
+        if not patients:
+            return cls(np.empty((0, len(MODEL_FEATURES))))
+        return cls(np.vstack([as_features(p).vector for p in patients]))
+
+    @classmethod
+    def from_frame(cls, df) -> "FeatureBatch":
+        """
+        From a dataset-format frame (`age` in days, as in CVD_risk_dataset.csv).
+        BMI is taken from the frame if present, otherwise derived.
+        """
+        columns = [c for c in MODEL_FEATURES if c != "bmi"]
+        matrix = np.empty((len(df), len(MODEL_FEATURES)), dtype=float)
+        matrix[:, :-1] = df[columns].to_numpy(dtype=float)
+        if "bmi" in df.columns:
+            matrix[:, -1] = df["bmi"].to_numpy(dtype=float)
+        else:
+            matrix[:, -1] = compute_bmi(matrix[:, 3], matrix[:, 2])
+        return cls(matrix)
+
+    def row(self, i: int) -> PatientFeatures:
+        """Single-patient record for row i (e.g. to render one result)."""
+        record = PatientFeatures.__new__(PatientFeatures)
+        for j, name in enumerate(MODEL_FEATURES):
+            setattr(record, name, self.matrix[i, j].item())
+        record.age_years = self.age_years[i].item()
+        record.vector = self.matrix[i:i + 1]
+        return record
@@ -0,0 +1,284 @@
+"""
+Подбор гиперпараметров CatBoost: k-fold CV по сетке или случайному пространству.
+
+Trials run in a process pool. Each worker loads the cached quantized
+training pool (app/training_data.py) once and slices the folds from it;
+CatBoost gets a per-trial `thread_count` so workers x threads does not
+exceed the machine. Each fold is early-stopped on a stratified slice
+held out from its training part (EARLY_STOP_FRACTION), so AUC,
+specificity and threshold are scored on a validation part the model
+never saw, not even to pick the iteration count. After every fold a trial is compared with the trials that already
+reached that fold and is pruned when its running mean AUC falls below
+their median (median pruning). The held-out test split is never touched.
+
+The leaderboard (AUC, specificity at the 90%-sensitivity threshold,
+training time) is printed and saved as JSON; train_improved_model.py
+--params <leaderboard> trains the final model with the best trial.
+
+Usage:
+    python -m app.hparam_search --mode random --trials 20 --folds 5 --workers 4
+    python -m app.hparam_search --mode grid --space space.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from multiprocessing import Manager
+
+import numpy as np
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import StratifiedKFold, train_test_split
+
+from app.training_data import POOL_CACHE_DIR, RANDOM_SEED, get_training_pools, pool_labels
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_PATH = "model/hparam_search.json"
+
+# Values per parameter; grid mode takes the product, random mode samples it
+SEARCH_SPACE = {
+    "depth": [4, 5, 6, 7, 8],
+    "learning_rate": [0.02, 0.03, 0.05, 0.08, 0.12],
+    "l2_leaf_reg": [1, 3, 5, 10],
+    "random_strength": [0.5, 1, 2],
+}
+
+DEFAULT_FOLDS = 5
+# Share of each training fold held out for early stopping
+EARLY_STOP_FRACTION = 0.1
+DEFAULT_TRIALS = 20
+# Pruning starts once this many trials have reported a fold
+PRUNE_MIN_TRIALS = 4
+
+# Worker-local data, set up once per process by _init_worker
+_worker = {}
+
+
+def _init_worker(cache_dir, folds, thread_count, fold_scores, lock):
+    from app.training_data import load_cached_pools
+
+    pool = load_cached_pools(cache_dir).train
+    _worker["labels"] = pool_labels(pool)
+    _worker["folds"] = [
+        (pool.slice(fit_idx.tolist()), pool.slice(stop_idx.tolist()), pool.slice(valid_idx.tolist()), valid_idx)
+        for fit_idx, stop_idx, valid_idx in folds
+    ]
+    _worker["thread_count"] = thread_count
+    _worker["fold_scores"] = fold_scores
+    _worker["lock"] = lock
+
+
+def split_folds(y, n_folds: int = DEFAULT_FOLDS, seed: int = RANDOM_SEED,
+                early_stop_fraction: float = EARLY_STOP_FRACTION) -> list:
+    """
+    Stratified k-fold as (fit_idx, stop_idx, valid_idx): the training part
+    of each fold is split again into rows to fit and rows to early-stop on.
+    """
+    y = np.asarray(y)
+    folds = []
+    for train_idx, valid_idx in StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=seed).split(
+            np.zeros(len(y)), y):
+        fit_idx, stop_idx = train_test_split(
+            train_idx, test_size=early_stop_fraction, random_state=seed, stratify=y[train_idx]
+        )
+        folds.append((np.sort(fit_idx), np.sort(stop_idx), valid_idx))
+    return folds
+
+
+def grid_trials(space: dict) -> list:
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+
+def random_trials(space: dict, n_trials: int, seed: int = RANDOM_SEED) -> list:
+    """Up to `n_trials` distinct random combinations from `space`."""
+    rng = random.Random(seed)
+    total = int(np.prod([len(v) for v in space.values()]))
+    seen, trials = set(), []
+    while len(trials) < min(n_trials, total):
+        params = {k: rng.choice(v) for k, v in space.items()}
+        key = tuple(params.values())
+        if key not in seen:
+            seen.add(key)
+            trials.append(params)
+    return trials
+
+
+def resolve_parallelism(workers: int | None, threads_per_trial: int | None) -> tuple:
+    """
+    (workers, threads_per_trial) with workers * threads <= CPU count.
+    Requested values are clamped (threads first, then workers) with a
+    warning when they would oversubscribe the machine.
+    """
+    cpus = os.cpu_count() or 1
+    requested = (workers, threads_per_trial)
+    if threads_per_trial is not None:
+        threads_per_trial = min(max(1, threads_per_trial), cpus)
+    if workers is not None:
+        workers = min(max(1, workers), cpus)
+    if workers is None and threads_per_trial is None:
+        threads_per_trial = min(2, cpus)
+    if workers is None:
+        workers = max(1, cpus // threads_per_trial)
+    if threads_per_trial is None:
+        threads_per_trial = max(1, cpus // workers)
+    if workers * threads_per_trial > cpus:
+        workers = max(1, cpus // threads_per_trial)
+    if any(r is not None and r != v for r, v in zip(requested, (workers, threads_per_trial))):
+        logger.warning(
+            f"workers={requested[0]} x threads_per_trial={requested[1]} oversubscribes "
+            f"{cpus} CPUs; using {workers} x {threads_per_trial}"
+        )
+    return workers, threads_per_trial
+
+
+def _should_prune(fold: int, running_mean: float) -> bool:
+    """Records this trial's running mean at `fold`; True if below the median of earlier trials."""
+    with _worker["lock"]:
+        scores = _worker["fold_scores"].get(fold, [])
+        _worker["fold_scores"][fold] = scores + [running_mean]
+    return len(scores) >= PRUNE_MIN_TRIALS and running_mean < float(np.median(scores))
+
+
+def run_trial(trial_id: int, params: dict, prune: bool = True) -> dict:
+    from app.training import MODEL_PARAMS, calibrate_threshold, train_model
+
+    model_params = {**MODEL_PARAMS, **params, "thread_count": _worker["thread_count"], "verbose": 0}
+    labels = _worker["labels"]
+    folds = _worker["folds"]
+    aucs, specificities, thresholds, best_iterations = [], [], [], []
+    status = "complete"
+    started = time.perf_counter()
+
+    for k, (fit_pool, stop_pool, valid_pool, valid_idx) in enumerate(folds):
+        model = train_model(fit_pool, stop_pool, model_params)
+        proba = model.predict_proba(valid_pool)[:, 1]
+        y_valid = labels[valid_idx]
+        calibration = calibrate_threshold(y_valid, proba)
+
+        aucs.append(roc_auc_score(y_valid, proba))
+        specificities.append(calibration["specificity"])
+        thresholds.append(calibration["threshold"])
+        best_iterations.append(model.get_best_iteration())
+
+        if prune and k < len(folds) - 1 and _should_prune(k, float(np.mean(aucs))):
+            status = "pruned"
+            break
+
+    return {
+        "trial": trial_id,
+        "params": params,
+        "status": status,
+        "folds": len(aucs),
+        "auc_mean": round(float(np.mean(aucs)), 4),
+        "auc_std": round(float(np.std(aucs)), 4),
+        "specificity_at_90_sens": round(float(np.mean(specificities)), 4),
+        "threshold_90_sens": round(float(np.mean(thresholds)), 4),
+        "best_iteration": int(np.mean(best_iterations)),
+        "train_sec": round(time.perf_counter() - started, 2),
+    }
+
+
+def leaderboard(results: list) -> list:
+    """Completed trials by mean AUC, then pruned ones."""
+    return sorted(results, key=lambda r: (r["status"] != "complete", -r["auc_mean"], r["train_sec"]))
+
+
+def run_search(trials: list, n_folds: int = DEFAULT_FOLDS, workers: int | None = None,
+               threads_per_trial: int | None = None, prune: bool = True,
+               cache_dir=POOL_CACHE_DIR, seed: int = RANDOM_SEED, progress=None) -> dict:
+    workers, threads_per_trial = resolve_parallelism(workers, threads_per_trial)
+    pools = get_training_pools(cache_dir)
+    y_train = pools.y_train
+    folds = split_folds(y_train, n_folds, seed)
+
+    started = time.perf_counter()
+    results = []
+    with Manager() as manager:
+        fold_scores, lock = manager.dict(), manager.Lock()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(cache_dir, folds, threads_per_trial, fold_scores, lock)) as executor:
+            futures = [executor.submit(run_trial, i, params, prune) for i, params in enumerate(trials)]
+            for future in as_completed(futures):
+                results.append(future.result())
+                if progress:
+                    progress(results[-1], len(results), len(trials))
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "dataset_fingerprint": pools.manifest.get("fingerprint"),
+        "folds": n_folds,
+        "early_stop_fraction": EARLY_STOP_FRACTION,
+        "workers": workers,
+        "threads_per_trial": threads_per_trial,
+        "pruning": prune,
+        "elapsed_sec": round(time.perf_counter() - started, 1),
+        "leaderboard": leaderboard(results),
+    }
+
+
+def best_params(path=LEADERBOARD_PATH) -> dict:
+    """Parameters of the top completed trial in a saved leaderboard."""
+    with open(path, "r") as f:
+        board = json.load(f)["leaderboard"]
+    complete = [r for r in board if r["status"] == "complete"]
+    if not complete:
+        raise ValueError(f"No completed trials in {path}")
+    return complete[0]["params"]
+
+
+def _print_leaderboard(board: list, top: int):
+    print(f"\n{'#':>4} {'status':9} {'AUC':>7} {'±':>6} {'spec@90':>8} {'thr':>7} {'iter':>5} {'sec':>7}  params")
+    for r in board[:top]:
+        print(f"{r['trial']:>4} {r['status']:9} {r['auc_mean']:>7.4f} {r['auc_std']:>6.4f} "
+              f"{r['specificity_at_90_sens']:>8.4f} {r['threshold_90_sens']:>7.4f} "
+              f"{r['best_iteration']:>5} {r['train_sec']:>7.1f}  {json.dumps(r['params'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="k-fold CV hyperparameter search for the CatBoost model")
+    parser.add_argument("--mode", choices=("random", "grid"), default="random")
+    parser.add_argument("--trials", type=int, default=DEFAULT_TRIALS, help="Number of trials in random mode")
+    parser.add_argument("--space", help="JSON file {param: [values]} replacing the default search space")
+    parser.add_argument("--folds", type=int, default=DEFAULT_FOLDS)
+    parser.add_argument("--workers", type=int, default=None, help="Parallel trials (default: CPUs / threads)")
+    parser.add_argument("--threads-per-trial", type=int, default=None, help="CatBoost thread_count per trial")
+    parser.add_argument("--no-prune", action="store_true")
+    parser.add_argument("--seed", type=int, default=RANDOM_SEED)
+    parser.add_argument("--output", default=LEADERBOARD_PATH)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    space = SEARCH_SPACE
+    if args.space:
+        with open(args.space, "r") as f:
+            space = json.load(f)
+    trials = grid_trials(space) if args.mode == "grid" else random_trials(space, args.trials, args.seed)
+
+    workers, threads = resolve_parallelism(args.workers, args.threads_per_trial)
+    print(f"{len(trials)} trials x {args.folds} folds, {workers} workers x {threads} threads")
+
+    def progress(result, done, total):
+        print(f"[{done}/{total}] trial {result['trial']} {result['status']}: "
+              f"AUC {result['auc_mean']:.4f} after {result['folds']} folds ({result['train_sec']:.1f}s)")
+
+    search = run_search(trials, args.folds, workers, threads, prune=not args.no_prune,
+                        seed=args.seed, progress=progress)
+    search["mode"] = args.mode
+    search["space"] = space
+
+    _print_leaderboard(search["leaderboard"], args.top)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(search, f, indent=4)
+    pruned = sum(r["status"] == "pruned" for r in search["leaderboard"])
+    print(f"\n{len(trials)} trials ({pruned} pruned) in {search['elapsed_sec']}s. Leaderboard saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
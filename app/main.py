@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
@@ -8,10 +8,32 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from app.schemas import PatientInput, PredictionResponse
+from app.schemas import (
+    CounterfactualRequest,
+    CounterfactualResponse,
+    PatientInput,
+    PredictionResponse,
+    RiskCurvesRequest,
+    RiskCurvesResponse,
+    SimilarPatientsRequest,
+    SimilarPatientsResponse,
+    WhatIfRequest,
+    WhatIfResponse,
+)
 from app.model_loader import load_model, get_model_performance_metrics
 from app.shap_explainer import create_shap_explainer
-from app.risk_logic import evaluate_clinical_risk
+from app.features import as_features
+from app.services.prediction_log import prediction_logger
+from app.services.shadow import shadow_evaluator
+from app.services.region_router import region_router
+from app.services.degradation import degradation_controller, request_deadline
+from app.services.stream_scoring import DuplexStreamingResponse, NDJSON_MEDIA_TYPE, score_ndjson
+from app.population_index import population_index
+from app.similar_patients import similar_patient_index
+from app.shap_lookup import shap_lookup
+from app.services.counterfactual import find_counterfactuals
+from app.services.risk_curves import risk_curve_cache, risk_curves
+from app.services.what_if import ScenarioError, evaluate_what_if
 
 app = FastAPI(
     title="CVD Risk API",
@@ -20,6 +42,7 @@ app = FastAPI(
 )
 
 import logging
+import time
 import traceback
 
 # Setup logging
@@ -52,10 +75,7 @@ app.add_middleware(
 from app.core.state import global_state
 global_state.initialize()
 
-# Assign local vars for backward compatibility if needed, or remove if unused elsewhere
-model = global_state.model
-shap_explainer = global_state.shap_explainer
-model_metrics = global_state.model_metrics
+from app.core.config import settings
 
 # -------------------------
 # TELEGRAM BOT INTEGRATION
@@ -125,7 +145,55 @@ def health_check():
 @app.get("/api/metrics")
 def get_metrics():
     """Returns model performance metrics."""
-    return model_metrics
+    return global_state.model_metrics
+
+# -------------------------
+# MODEL REGISTRY
+# -------------------------
+@app.get("/model/info")
+@app.get("/api/model/info")
+def get_model_info():
+    """Version and provenance of the model currently being served."""
+    return {
+        **global_state.bundle.describe(),
+        "last_reload": global_state.registry.last_reload,
+    }
+
+@app.post("/api/model/reload", status_code=202)
+def reload_model(request: Request, paths: dict | None = None):
+    """
+    Loads and warms a model in the background, then swaps it in atomically.
+    Requests already in flight finish on the previous version.
+    """
+    if not settings.admin_api_key or request.headers.get("X-Admin-Key") != settings.admin_api_key:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    paths = paths or {}
+    started = global_state.registry.reload_async(
+        **{k: paths[k] for k in ("model_path", "background_path", "metrics_path") if k in paths}
+    )
+    if not started:
+        raise HTTPException(status_code=409, detail="A reload is already in progress")
+    return global_state.registry.last_reload
+
+@app.post("/api/indexes/reload")
+def reload_indexes(request: Request):
+    """
+    Re-reads the population, similar-patient and SHAP lookup indexes on
+    their next use, after they were rebuilt while the API is running.
+    (Model swaps reload the model-specific ones automatically.)
+    """
+    if not settings.admin_api_key or request.headers.get("X-Admin-Key") != settings.admin_api_key:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    population_index.reload()
+    similar_patient_index.reload()
+    shap_lookup.reload()
+    return {
+        "population_index": population_index.model_version,
+        "similar_patients": similar_patient_index.available,
+        "shap_lookup": shap_lookup.model_version,
+    }
 
 # Setup logging
 logging.basicConfig(
@@ -136,24 +204,50 @@ logger = logging.getLogger(__name__)
 
 @app.post("/predict", response_model=PredictionResponse)
 @app.post("/api/predict", response_model=PredictionResponse)
-def predict_risk(patient: PatientInput):
+def predict_risk(
+    patient: PatientInput,
+    x_request_timeout_ms: float | None = Header(None),
+    x_data_consent: bool = Header(False)
+):
     """
     Predicts cardiovascular risk based on patient data.
+
+    X-Request-Timeout-Ms bounds the processing time; if the explanation
+    would overrun it, the prediction is returned with a partial explanation
+    and `pipeline_status` marks the truncated stage.
+
+    X-Data-Consent: true allows the patient input to be kept in the
+    prediction log; without it only request metadata is logged.
     """
     try:
         logger.info(f"Received prediction request for age {patient.age_years}")
-        result = evaluate_clinical_risk(
-            patient=patient,
-            model=model,
-            shap_explainer=shap_explainer,
-            lang=patient.ui_language,
-            model_metrics=model_metrics
+        deadline = request_deadline(x_request_timeout_ms)
+        started = time.perf_counter()
+        # One bundle for the whole request, even if a reload swaps meanwhile
+        bundle, route = region_router.resolve(patient.region)
+        features = as_features(patient)
+        result = degradation_controller.evaluate(
+            features, bundle, patient.ui_language, deadline=deadline
         )
         
         result['data_validation'] = {
             'is_valid': True,
             'errors': []
         }
+        # Unrounded probability: the index holds full-precision values
+        result['population_percentile'] = population_index.percentile(
+            result['raw_risk_probability'], patient.gender, patient.age_years,
+            region=region_router.normalize(patient.region), model_version=bundle.version
+        )
+
+        latency_ms = (time.perf_counter() - started) * 1000
+        region_router.record_latency(patient.region, latency_ms)
+        prediction_logger.record(patient, result, latency_ms, source="api", consent=x_data_consent)
+        if shadow_evaluator is not None:
+            shadow_evaluator.submit(
+                features.vector, result["raw_risk_probability"],
+                bundle.high_risk_threshold, bundle.version, route
+            )
         
         return result
     except Exception as e:
@@ -163,6 +257,146 @@ def predict_risk(patient: PatientInput):
         # SECURITY FIX: Do not leak exception details to the client
         raise HTTPException(status_code=500, detail="Internal Server Error: processing failed.")
 
+@app.post("/predict/stream")
+@app.post("/api/predict/stream")
+async def predict_stream(request: Request):
+    """
+    Scores an NDJSON upload (one PatientInput per line) and streams NDJSON
+    results back as they are computed: {"line": n, "risk_probability": ...}
+    per valid line, {"line": n, "error": ...} per invalid one, then a
+    {"summary": ...} line. Returns probabilities, categories and rule-based
+    flags only; use /api/predict for SHAP explanations.
+    """
+    return DuplexStreamingResponse(
+        score_ndjson(request.stream()),
+        media_type=NDJSON_MEDIA_TYPE,
+        spool_memory_bytes=settings.stream_spool_memory_bytes,
+        spool_max_bytes=settings.stream_spool_max_bytes
+    )
+
+@app.post("/predict/what-if", response_model=WhatIfResponse)
+@app.post("/api/predict/what-if", response_model=WhatIfResponse)
+def predict_what_if(request: WhatIfRequest):
+    """
+    Risk for a base patient and lifestyle scenarios ("quit smoking",
+    "lose 10 kg", "BP 130"), all scored in one model call. Returns each
+    scenario's risk, delta to the base and whether the category changes;
+    SHAP explanations only for scenarios with explain=true.
+    """
+    if len(request.scenarios) > settings.whatif_max_scenarios:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {settings.whatif_max_scenarios} scenarios per request"
+        )
+    patient = request.patient
+    bundle, _ = region_router.resolve(patient.region)
+    mode = degradation_controller.mode if degradation_controller.enabled else "full"
+    try:
+        return evaluate_what_if(
+            patient, request.scenarios, bundle, patient.ui_language,
+            explanation_mode=mode, explain_base=request.explain_base
+        )
+    except ScenarioError as e:
+        raise HTTPException(status_code=422, detail={"scenario": e.index, "errors": e.errors})
+    except Exception as e:
+        logger.error(f"Error during what-if calculation: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail="Internal Server Error: processing failed.")
+
+@app.post("/predict/counterfactual", response_model=CounterfactualResponse)
+@app.post("/api/predict/counterfactual", response_model=CounterfactualResponse)
+def predict_counterfactual(request: CounterfactualRequest):
+    """
+    Smallest sets of modifiable changes (BP, weight, smoking, alcohol,
+    activity, glucose, cholesterol) that bring a high-risk patient below
+    the high-risk threshold. Best-first search with batched model calls,
+    capped at counterfactual_max_evaluations model evaluations.
+    """
+    patient = request.patient
+    bundle, _ = region_router.resolve(patient.region)
+    budget = settings.counterfactual_max_evaluations
+    if request.max_evaluations is not None:
+        budget = min(budget, request.max_evaluations)
+    try:
+        result = find_counterfactuals(
+            patient, bundle.model, bundle.high_risk_threshold,
+            max_evaluations=budget, max_solutions=request.max_solutions, allowed=request.features
+        )
+    except Exception as e:
+        logger.error(f"Error during counterfactual search: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail="Internal Server Error: processing failed.")
+    result["model_version"] = bundle.version
+    return result
+
+@app.post("/predict/risk-curves", response_model=RiskCurvesResponse)
+@app.post("/api/predict/risk-curves", response_model=RiskCurvesResponse)
+def predict_risk_curves(request: RiskCurvesRequest):
+    """
+    Risk of this patient versus age, systolic BP and BMI for the frontend
+    charts. All curves are scored in one model call and cached on the
+    patient's model vector, so re-renders are served from memory.
+    """
+    if request.points > settings.risk_curve_max_points:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {settings.risk_curve_max_points} points per curve"
+        )
+    patient = request.patient
+    bundle, _ = region_router.resolve(patient.region)
+    try:
+        return risk_curves(patient, bundle, request.curves, request.points)
+    except Exception as e:
+        logger.error(f"Error during risk curve calculation: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail="Internal Server Error: processing failed.")
+
+@app.post("/similar-patients", response_model=SimilarPatientsResponse)
+@app.post("/api/similar-patients", response_model=SimilarPatientsResponse)
+def get_similar_patients(request: SimilarPatientsRequest):
+    """
+    Outcome rate and summary of the k most similar patients of the
+    reference cohort (standardized model features, KD-tree index built
+    offline with `python -m app.similar_patients`).
+    """
+    if request.k > settings.similar_max_k:
+        raise HTTPException(status_code=422, detail=f"k must be at most {settings.similar_max_k}")
+    try:
+        result = similar_patient_index.query(request.patient, request.k, request.include_neighbors)
+    except Exception as e:
+        logger.error(f"Error during similar-patient search: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail="Internal Server Error: processing failed.")
+    if result is None:
+        raise HTTPException(status_code=503, detail="Similar-patient index is not built")
+    return result
+
+@app.get("/metrics/risk-curves")
+@app.get("/api/metrics/risk-curves")
+def get_risk_curve_metrics():
+    """Risk curve cache size and hit rate."""
+    return risk_curve_cache.stats()
+
+@app.get("/metrics/regions")
+@app.get("/api/metrics/regions")
+def get_region_metrics():
+    """Per-region routing hits, fallbacks and latency."""
+    return region_router.metrics()
+
+@app.get("/degradation/status")
+@app.get("/api/degradation/status")
+def get_degradation_status():
+    """Current explanation mode of the adaptive load controller."""
+    return degradation_controller.status()
+
+@app.get("/shadow/stats")
+@app.get("/api/shadow/stats")
+def get_shadow_stats():
+    """Agreement statistics between the live model and the shadow candidate."""
+    if shadow_evaluator is None:
+        return {"enabled": False}
+    return shadow_evaluator.stats()
+
 from app.services.google_sheets import gs_service
 
 @app.post("/api/log-patient-data")
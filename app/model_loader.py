@@ -1,3 +1,5 @@
+import hashlib
+import json
 import joblib
 from pathlib import Path
 
@@ -8,6 +10,7 @@ from pathlib import Path
 MODEL_VERSION = "primary-care-cvd-risk-catboost-v1.0"
 
 MODEL_PATH = Path("model/improved_catboost.cbm")
+METRICS_PATH = Path("model/model_metrics.json")
 
 
 from catboost import CatBoostClassifier
@@ -16,25 +19,55 @@ from catboost import CatBoostClassifier
 # Model loading
 # -------------------------
 
-def load_model():
-    if not MODEL_PATH.exists():
+def load_model(model_path=MODEL_PATH):
+    model_path = Path(model_path)
+    if not model_path.exists():
         raise FileNotFoundError(
-            f"Model file not found at {MODEL_PATH.resolve()}"
+            f"Model file not found at {model_path.resolve()}"
         )
     model = CatBoostClassifier()
-    model.load_model(MODEL_PATH)
+    model.load_model(model_path)
     return model
 
 
+def compute_model_hash(model_path=MODEL_PATH) -> str:
+    """SHA-256 of the model file, identifies the exact weights being served."""
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def describe_model_version(model_hash: str) -> str:
+    return f"{MODEL_VERSION}+{model_hash[:12]}"
+
+
 def get_model_version():
-    return MODEL_VERSION
+    """
+    Version of the model currently served by the registry,
+    falling back to the static name before the registry is initialized.
+    """
+    from app.core.model_registry import model_registry
+
+    bundle = model_registry.current
+    return bundle.version if bundle is not None else MODEL_VERSION
+
+
+def load_training_metrics(metrics_path=METRICS_PATH) -> dict:
+    """Metrics written by train_improved_model.py next to the model."""
+    metrics_path = Path(metrics_path)
+    if not metrics_path.exists():
+        return {}
+    with open(metrics_path, "r") as f:
+        return json.load(f)
 
 
-def get_model_performance_metrics():
+def get_model_performance_metrics(training_metrics: dict | None = None):
     """
     Return model performance metrics for transparency
     """
-    return {
+    metrics = {
         "sensitivity": 0.90,
         "specificity": 0.4188,
         "roc_auc": 0.7989,
@@ -42,4 +75,18 @@ def get_model_performance_metrics():
         "recall": 0.9004,
         "f1_score": 0.72,
         "note": "Optimized for high sensitivity (Safety First)"
-    }
\ No newline at end of file
+    }
+    if training_metrics:
+        # Values measured for the loaded model take precedence; a metric its
+        # metrics file lacks is dropped rather than shown from the baseline
+        # model, so the response never mixes two models
+        for key, source in (
+            ("roc_auc", "roc_auc"),
+            ("sensitivity", "sensitivity_target"),
+            ("specificity", "specificity_at_threshold"),
+            ("precision", "precision_at_threshold"),
+            ("recall", "recall_at_threshold"),
+            ("f1_score", "f1_at_threshold"),
+        ):
+            metrics[key] = training_metrics.get(source)
+    return metrics
@@ -0,0 +1,223 @@
+"""
+Популяционный перцентиль риска: где риск пациента среди людей того же пола и возраста.
+
+Offline step: every patient of the cleaned dataset is scored once and
+the probabilities are grouped into strata (sex x age decade, plus region
+when the dataset has one). Each stratum is sorted and the strata are
+concatenated into one float32 array (`probabilities-<build>.npy`) with
+a JSON manifest of {stratum: [offset, length]} that names the array.
+At request time the array is memory-mapped and a percentile is two
+binary searches in the patient's stratum slice.
+
+Usage:
+    python -m app.population_index --output model/population_index
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from app.columnar import load_clean_frame, publish_manifest, save_mapped_array
+from app.core.config import settings
+from app.core.model_registry import model_registry
+from app.dataset import DATA_PATH
+from app.features import FeatureBatch
+from app.model_loader import MODEL_PATH, compute_model_hash, describe_model_version, load_model
+from app.subgroups import add_audit_dimensions
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = Path("model/population_index")
+ARRAY_STEM = "probabilities"
+# Array file of indexes built before the manifest named it
+LEGACY_ARRAY_NAME = "probabilities.npy"
+MANIFEST_NAME = "manifest.json"
+
+# Placeholder for "any region" strata (and for datasets without a region column)
+ANY = "*"
+
+
+def stratum_key(sex: str, age_decile: str, region: str = ANY) -> str:
+    return f"{sex}|{age_decile}|{region}"
+
+
+def age_decile(age_years) -> str:
+    """Same labels as subgroups.add_audit_dimensions: "40-49"."""
+    decade = int(age_years // 10 * 10)
+    return f"{decade}-{decade + 9}"
+
+
+def build_index(data_path=DATA_PATH, model_path=MODEL_PATH, output_dir=INDEX_DIR) -> dict:
+    """
+    Scores the cleaned dataset once and writes the sorted strata + manifest.
+    Safe while the API has the index mapped: the array goes to a new file
+    and the manifest pointing to it is swapped in last.
+    """
+    model_path = Path(model_path)
+    output_dir = Path(output_dir)
+    model = load_model(model_path)
+    df = add_audit_dimensions(load_clean_frame(data_path).reset_index(drop=True))
+
+    started = time.perf_counter()
+    proba = model.predict_proba(FeatureBatch.from_frame(df).matrix)[:, 1].astype(np.float32)
+
+    key_sets = [np.array([stratum_key(s, a) for s, a in zip(df["sex"], df["age_decile"])])]
+    if "region" in df.columns:
+        key_sets.append(np.array([
+            stratum_key(s, a, str(r)) for s, a, r in zip(df["sex"], df["age_decile"], df["region"])
+        ]))
+
+    blocks, strata, offset = [], {}, 0
+    for stratum_keys in key_sets:
+        # One stable sort by key, then each stratum's slice is sorted by probability
+        labels, codes = np.unique(stratum_keys, return_inverse=True)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(labels) + 1))
+        for label, lo, hi in zip(labels, bounds[:-1], bounds[1:]):
+            blocks.append(np.sort(proba[order[lo:hi]]))
+            strata[str(label)] = [offset, int(hi - lo)]
+            offset += int(hi - lo)
+    blocks.append(np.sort(proba))
+    strata[stratum_key(ANY, ANY)] = [offset, len(proba)]
+
+    array_name = save_mapped_array(output_dir, ARRAY_STEM, np.concatenate(blocks))
+    manifest = {
+        "array": array_name,
+        "model_version": describe_model_version(compute_model_hash(model_path)),
+        "built_at": datetime.now(timezone.utc).isoformat(),
+        "source": df.attrs.get("source", str(data_path)),
+        "patients": len(df),
+        "elapsed_sec": round(time.perf_counter() - started, 2),
+        "strata": strata,
+    }
+    publish_manifest(output_dir, MANIFEST_NAME, manifest, ARRAY_STEM)
+    return manifest
+
+
+class PopulationIndex:
+    """
+    Read side of the index. Loaded lazily on the first lookup (nothing is
+    read at API startup); the array stays memory-mapped. Percentiles are
+    only returned when the index was built with the model that produced
+    the probability, and a stratum smaller than `min_count` falls back to
+    the sex-and-age stratum, then to the whole population.
+
+    reload() re-reads the files on the next lookup; it runs on every model
+    swap and from POST /api/indexes/reload (after a rebuild). Each build
+    writes a new array file named by its manifest, so a lookup never mixes
+    two builds and a rebuild never touches the mapped file.
+    """
+
+    def __init__(self, index_dir=INDEX_DIR, min_count: int = 50):
+        self.index_dir = Path(index_dir)
+        self.min_count = min_count
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._index = None  # (manifest, array)
+
+    def _load(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            index = None
+            manifest_path = self.index_dir / MANIFEST_NAME
+            if manifest_path.exists():
+                try:
+                    with open(manifest_path) as f:
+                        manifest = json.load(f)
+                    array_path = self.index_dir / manifest.get("array", LEGACY_ARRAY_NAME)
+                    # Plain ndarray view of the mapping: slicing a np.memmap is slower
+                    index = (manifest, np.asarray(np.load(array_path, mmap_mode="r")))
+                except Exception as e:
+                    logger.error(f"Failed to load population index from {self.index_dir}: {e}")
+            else:
+                logger.info(f"No population index at {self.index_dir}")
+            self._index = index
+            self._loaded = True
+
+    def reload(self):
+        with self._lock:
+            self._loaded = False
+
+    def on_model_swap(self, bundle, previous):
+        if previous is not None and previous.version != bundle.version:
+            self.reload()
+
+    @property
+    def model_version(self) -> str | None:
+        self._load()
+        index = self._index
+        return index[0]["model_version"] if index else None
+
+    def _stratum(self, strata: dict, sex: str, decile: str, region: str | None) -> tuple:
+        candidates = []
+        if region:
+            candidates.append(stratum_key(sex, decile, region))
+        candidates += [stratum_key(sex, decile), stratum_key(ANY, ANY)]
+        for key in candidates:
+            span = strata.get(key)
+            if span is not None and (span[1] >= self.min_count or key == candidates[-1]):
+                return key, span
+        return None, None
+
+    def percentile(self, probability: float, gender: int, age_years, region: str | None = None,
+                   model_version: str | None = None) -> dict | None:
+        """
+        Mid-rank percentile of `probability` in the patient's stratum:
+        100 x (share below + half the share equal). None without an index
+        or when it belongs to another model version.
+        """
+        self._load()
+        index = self._index
+        if index is None:
+            return None
+        manifest, array = index
+        if model_version is not None and model_version != manifest["model_version"]:
+            return None
+
+        sex = "male" if gender == 2 else "female"
+        key, span = self._stratum(manifest["strata"], sex, age_decile(age_years), region)
+        if key is None:
+            return None
+        offset, length = span
+        values = array[offset:offset + length]
+        value = np.float32(probability)
+        below = np.searchsorted(values, value, side="left")
+        equal = np.searchsorted(values, value, side="right") - below
+        sex_key, decile_key, region_key = key.split("|")
+        return {
+            "percentile": round(100.0 * (below + 0.5 * equal) / length, 1),
+            "sex": sex_key,
+            "age_band": decile_key,
+            "region": None if region_key == ANY else region_key,
+            "reference_size": int(length),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the population risk percentile index")
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--model", default=str(MODEL_PATH))
+    parser.add_argument("--output", default=str(INDEX_DIR))
+    args = parser.parse_args()
+
+    manifest = build_index(args.data, args.model, args.output)
+    print(f"Scored {manifest['patients']} patients in {manifest['elapsed_sec']}s, "
+          f"{len(manifest['strata'])} strata")
+    print(f"Population index for {manifest['model_version']} saved to {args.output}")
+
+
+# Global instance
+population_index = PopulationIndex(settings.population_index_dir, settings.population_index_min_count)
+model_registry.subscribe(population_index.on_model_swap)
+
+
+if __name__ == "__main__":
+    main()
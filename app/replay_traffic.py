@@ -0,0 +1,284 @@
+"""
+Replays persisted production traffic through the current pipeline and
+diffs the outputs against what was originally served.
+
+Each record is replayed like-for-like: through the bundle the region
+router picks for the patient's region, in the explanation mode that was
+served, and with the logged SHAP seed and permutation chunk sizes. Only
+records served with a completed "full" explanation enter the explanation
+diff; degraded (summary / lookup / rules) and deadline-truncated ones
+are still compared on probability and category.
+
+Usage:
+    python -m app.replay_traffic --log logs/predictions.jsonl --since 2026-01-01
+"""
+import argparse
+import hashlib
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.prediction_log import iter_prediction_records, summarize_explanation
+
+OUTPUT_REPORT = "replay_report.json"
+
+# Worker-local pipeline, built once per process by _init_worker
+_worker = {}
+
+
+def _init_worker():
+    from types import SimpleNamespace
+
+    from app.core.model_registry import load_bundle
+    from app.services.region_router import RegionModelRouter
+
+    # Warm so replayed latencies do not include the one-off SHAP JIT compile
+    bundle = load_bundle(warm=True)
+    _worker["router"] = RegionModelRouter(
+        SimpleNamespace(current=bundle),
+        settings.region_models_dir,
+        capacity=settings.region_model_cache_size,
+    )
+
+
+def record_seed(record: dict) -> int:
+    """
+    Stable per-record seed for records logged without an explain trace
+    (before seeds were logged), so a replay does not depend on how records
+    were split across batches or workers.
+    """
+    key = str(record.get("request_id") or json.dumps(record["patient"], sort_keys=True))
+    return int(hashlib.sha256(key.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def explanation_comparable(record: dict) -> bool:
+    """Served with a complete full-SHAP explanation that replay can reproduce."""
+    return (
+        record.get("explanation_mode") == "full"
+        and record.get("explain_status") == "completed"
+        and bool(record.get("explain_trace"))
+    )
+
+
+def _replay_batch(records: list) -> list:
+    from app.schemas import PatientInput
+    from app.risk_logic import evaluate_clinical_risk
+    from app.shap_lookup import shap_lookup
+
+    replayed = []
+    for record in records:
+        try:
+            patient = PatientInput(**record["patient"])
+            bundle, _ = _worker["router"].resolve(patient.region)
+            mode = record.get("explanation_mode") or "full"
+            trace = record.get("explain_trace") or {}
+            seed = trace.get("seed")
+            started = time.perf_counter()
+            result = evaluate_clinical_risk(
+                patient=patient,
+                model=bundle.model,
+                shap_explainer=bundle.shap_explainer,
+                lang=patient.ui_language,
+                model_metrics=bundle.model_metrics,
+                model_version=bundle.version,
+                high_risk_threshold=bundle.high_risk_threshold,
+                explanation_mode=mode,
+                summary_explainer=bundle.summary_explainer,
+                shap_lookup=shap_lookup.for_version(bundle.version) if mode == "lookup" else None,
+                explain_seed=record_seed(record) if seed is None else seed,
+                explain_schedule=trace.get("chunks")
+            )
+            replayed.append({
+                "risk_probability": result["risk_probability"],
+                "risk_category": result["risk_category"],
+                "explanation": summarize_explanation(result["clinical_explanation"]),
+                "explanation_mode": result["explanation_mode"],
+                "latency_ms": (time.perf_counter() - started) * 1000,
+                "model_version": bundle.version,
+            })
+        except Exception as e:
+            replayed.append({"error": str(e)})
+    return replayed
+
+
+def explanation_signature(explanation: list) -> list:
+    return [(item["key"], item["raw_direction"]) for item in explanation]
+
+
+def compare_record(served: dict, replayed: dict) -> dict:
+    """Diffs one served record against its replay."""
+    diff = {
+        "request_id": served.get("request_id"),
+        "served_model_version": served.get("model_version"),
+        "replayed_model_version": replayed["model_version"],
+        "served_category": served.get("risk_category"),
+        "replayed_category": replayed["risk_category"],
+        "category_flip": served.get("risk_category") != replayed["risk_category"],
+        "probability_delta": replayed["risk_probability"] - served["risk_probability"],
+        "explanation_compared": False,
+        "explanation_changed": False,
+        "top_factors_changed": False,
+        "latency_delta_ms": replayed["latency_ms"] - (served.get("latency_ms") or 0.0),
+    }
+    if explanation_comparable(served) and replayed["explanation_mode"] == "full":
+        served_sig = explanation_signature(served.get("explanation", []))
+        replayed_sig = explanation_signature(replayed["explanation"])
+        diff.update({
+            "explanation_compared": True,
+            "explanation_changed": set(served_sig) != set(replayed_sig),
+            "top_factors_changed": served_sig[:3] != replayed_sig[:3],
+        })
+    return diff
+
+
+def _percentiles(values) -> dict:
+    if len(values) == 0:
+        return {"mean": None, "p50": None, "p95": None, "max": None}
+    arr = np.asarray(values, dtype=float)
+    return {
+        "mean": float(arr.mean()),
+        "p50": float(np.percentile(arr, 50)),
+        "p95": float(np.percentile(arr, 95)),
+        "max": float(arr.max()),
+    }
+
+
+def build_report(diffs: list, served_latency: list, replayed_latency: list,
+                 errors: list, top_n: int) -> dict:
+    n = len(diffs)
+    deltas = np.array([d["probability_delta"] for d in diffs], dtype=float)
+    transitions = {}
+    for d in diffs:
+        if d["category_flip"]:
+            key = f"{d['served_category']}->{d['replayed_category']}"
+            transitions[key] = transitions.get(key, 0) + 1
+
+    flips = sum(d["category_flip"] for d in diffs)
+    compared = sum(d["explanation_compared"] for d in diffs)
+    explanation_changes = sum(d["explanation_changed"] for d in diffs)
+    top_changes = sum(d["top_factors_changed"] for d in diffs)
+
+    largest = sorted(diffs, key=lambda d: abs(d["probability_delta"]), reverse=True)[:top_n]
+
+    return {
+        "records": n,
+        "errors": len(errors),
+        "category_flips": {
+            "count": int(flips),
+            "rate": flips / n if n else 0.0,
+            "transitions": transitions,
+        },
+        "probability_delta": {
+            **_percentiles(np.abs(deltas)),
+            "mean_signed": float(deltas.mean()) if n else None,
+        },
+        "explanation_changes": {
+            # Only records served with a complete full-SHAP explanation
+            "compared": int(compared),
+            "count": int(explanation_changes),
+            "rate": explanation_changes / compared if compared else 0.0,
+            "top3_changed": int(top_changes),
+        },
+        "latency_ms": {
+            "served": _percentiles(served_latency),
+            "replayed": _percentiles(replayed_latency),
+        },
+        "largest_deltas": largest,
+        "error_samples": errors[:top_n],
+    }
+
+
+def replay(records, workers: int, batch_size: int, top_n: int = 20) -> dict:
+    """
+    Streams records through a process pool in fixed-size batches.
+    At most 2 * workers batches are in flight, so memory stays bounded
+    regardless of log size.
+    """
+    diffs, served_latency, replayed_latency, errors = [], [], [], []
+    skipped = 0
+
+    def collect(future, batch):
+        for served, replayed in zip(batch, future.result()):
+            if "error" in replayed:
+                errors.append({"request_id": served.get("request_id"), "error": replayed["error"]})
+                continue
+            diffs.append(compare_record(served, replayed))
+            if served.get("latency_ms") is not None:
+                served_latency.append(served["latency_ms"])
+            replayed_latency.append(replayed["latency_ms"])
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        in_flight = {}
+        batch = []
+
+        def submit(batch):
+            in_flight[pool.submit(_replay_batch, batch)] = batch
+            if len(in_flight) >= 2 * workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future, in_flight.pop(future))
+
+        for record in records:
+            if "patient" not in record:
+                skipped += 1  # logged without consent: no input to replay
+                continue
+            batch.append(record)
+            if len(batch) >= batch_size:
+                submit(batch)
+                batch = []
+        if batch:
+            submit(batch)
+
+        for future in list(in_flight):
+            collect(future, in_flight.pop(future))
+
+    # Deterministic ordering of the report regardless of completion order
+    diffs.sort(key=lambda d: str(d["request_id"]))
+    report = build_report(diffs, served_latency, replayed_latency, errors, top_n)
+    report["skipped_without_consent"] = skipped
+    return report
+
+
+def parse_since(value: str) -> datetime:
+    since = datetime.fromisoformat(value)
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return since
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay logged predictions through the current pipeline")
+    parser.add_argument("--log", default=settings.prediction_log_path, help="Prediction log (JSONL)")
+    parser.add_argument("--since", type=parse_since, default=None, help="Only replay records after this ISO date")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--top", type=int, default=20, help="Number of largest deltas to list")
+    parser.add_argument("--output", default=OUTPUT_REPORT)
+    args = parser.parse_args()
+
+    if not args.log:
+        parser.error("No prediction log given (--log or PREDICTION_LOG_PATH)")
+
+    print(f"Replaying {args.log} with {args.workers} workers...")
+    started = time.perf_counter()
+    records = iter_prediction_records(args.log, since=args.since, limit=args.limit)
+    report = replay(records, args.workers, args.batch_size, args.top)
+    report["wall_time_sec"] = round(time.perf_counter() - started, 2)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+
+    print(f"Records: {report['records']}, errors: {report['errors']}")
+    print(f"Category flips: {report['category_flips']['count']} ({report['category_flips']['rate']:.2%})")
+    print(f"Explanation changes: {report['explanation_changes']['count']} "
+          f"of {report['explanation_changes']['compared']} comparable records")
+    print(f"Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Дообучение модели на новых размеченных данных (warm-start от текущей модели).
+
+New labeled rows come from a local export: either CVD_risk_dataset.csv
+format, or the Google Sheets consent log (app/services/google_sheets.py)
+with an added outcome column (`cardio`) and height/weight. The sheet
+stores only BMI, and the model needs height and weight. Rows go through
+the training cleaning rules (app/dataset.py).
+
+Instead of training from scratch, boosting continues from the current
+improved_catboost.cbm (CatBoost init_model) for a small number of extra
+trees, on the new rows plus the original training split (replay, so the
+model does not drift towards the new sample only). The 90%-sensitivity
+threshold is recomputed on the original test split plus a holdout of the
+new rows, and a new versioned model + model_metrics.json is written to
+model/versions/<version>/. Serve it with POST /api/model/reload.
+
+Usage:
+    python -m app.retrain --export new_rows.csv
+    python -m app.retrain --export sheet_export.csv --compare-full
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostClassifier
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import train_test_split
+
+from app.dataset import DATA_PATH, FEATURE_COLUMNS, TARGET_COLUMN, clean_dataset
+from app.features import DAYS_PER_YEAR
+from app.model_loader import (
+    MODEL_PATH,
+    compute_model_hash,
+    describe_model_version,
+    load_model,
+)
+from app.training import MODEL_PARAMS, evaluate_model, train_model
+from app.training_data import RANDOM_SEED, split_clean_dataset
+
+VERSIONS_DIR = Path("model/versions")
+
+WARM_START_ITERATIONS = 200
+NEW_HOLDOUT_FRACTION = 0.2
+
+# Google Sheets export column -> dataset column
+SHEET_COLUMNS = {
+    "systolic_bp": "ap_hi",
+    "diastolic_bp": "ap_lo",
+    "cholesterol_cat": "cholesterol",
+    "glucose_cat": "gluc",
+    "smoking": "smoke",
+    "alcohol": "alco",
+    "physical_activity": "active",
+}
+SHEET_YES_NO = ("smoke", "alco", "active")
+LABEL_COLUMNS = (TARGET_COLUMN, "outcome")
+
+
+def normalize_export(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Brings an export to CVD_risk_dataset.csv columns (age in days, gender 1/2,
+    0/1 lifestyle flags, `cardio` label). Rows without a label are dropped.
+    """
+    df = df.rename(columns=lambda c: str(c).strip())
+    if "systolic_bp" in df.columns:
+        df = df.rename(columns=SHEET_COLUMNS)
+        # The sheet logs age in years and sex as Male/Female
+        df["age"] = (pd.to_numeric(df["age"], errors="coerce") * DAYS_PER_YEAR).round()
+        df["gender"] = np.where(df["sex"].astype(str).str.strip().str.lower() == "male", 2, 1)
+        for column in SHEET_YES_NO:
+            df[column] = (df[column].astype(str).str.strip().str.lower() == "yes").astype(int)
+
+    label = next((c for c in LABEL_COLUMNS if c in df.columns), None)
+    if label is None:
+        raise ValueError(f"Export has no outcome column (one of {', '.join(LABEL_COLUMNS)})")
+    df = df.rename(columns={label: TARGET_COLUMN})
+
+    missing = [c for c in FEATURE_COLUMNS if c not in df.columns and c != "bmi"]
+    if missing:
+        raise ValueError(
+            f"Export is missing {', '.join(missing)}; "
+            "the model needs height and weight, not only BMI"
+        )
+
+    df = df[[c for c in FEATURE_COLUMNS if c != "bmi"] + [TARGET_COLUMN]].apply(pd.to_numeric, errors="coerce")
+    df = df.dropna()
+    df = df[df[TARGET_COLUMN].isin((0, 1))]
+    return df.astype({c: int for c in df.columns if c not in ("height", "weight")})
+
+
+def load_export(path) -> pd.DataFrame:
+    """Normalized and cleaned labeled rows (FEATURE_COLUMNS + cardio)."""
+    df_clean = clean_dataset(normalize_export(pd.read_csv(path)))
+    return df_clean[FEATURE_COLUMNS + [TARGET_COLUMN]].reset_index(drop=True)
+
+
+def prepare_data(new_rows: pd.DataFrame, data_path=DATA_PATH, replay: bool = True,
+                 holdout: float = NEW_HOLDOUT_FRACTION, random_seed: int = RANDOM_SEED) -> dict:
+    """
+    Training rows (new + optionally the original train split) and the
+    evaluation set (original test split + holdout of the new rows).
+    """
+    X_train, X_test, y_train, y_test = split_clean_dataset(data_path, random_seed=random_seed)
+    X_new, y_new = new_rows[FEATURE_COLUMNS], new_rows[TARGET_COLUMN]
+    if holdout > 0 and len(new_rows) >= 10:
+        stratify = y_new if y_new.nunique() > 1 else None
+        X_new, X_hold, y_new, y_hold = train_test_split(
+            X_new, y_new, test_size=holdout, random_state=random_seed, stratify=stratify
+        )
+    else:
+        X_hold, y_hold = X_new.iloc[:0], y_new.iloc[:0]
+
+    if replay:
+        X_fit, y_fit = pd.concat([X_train, X_new]), pd.concat([y_train, y_new])
+    else:
+        X_fit, y_fit = X_new, y_new
+    return {
+        "X_fit": X_fit, "y_fit": y_fit,
+        "X_eval": pd.concat([X_test, X_hold]), "y_eval": pd.concat([y_test, y_hold]),
+        "new_train_rows": len(X_new), "new_holdout_rows": len(X_hold),
+    }
+
+
+def warm_start(base_model_path, X, y, eval_set, iterations: int = WARM_START_ITERATIONS,
+               learning_rate: float | None = None) -> CatBoostClassifier:
+    """Adds up to `iterations` trees on top of the base model (early-stopped on eval_set)."""
+    params = {**MODEL_PARAMS, "iterations": iterations}
+    if learning_rate is not None:
+        params["learning_rate"] = learning_rate
+    return train_model((X, y), eval_set, params, init_model=str(base_model_path))
+
+
+def full_retrain(X, y, eval_set) -> CatBoostClassifier:
+    return train_model((X, y), eval_set)
+
+
+def save_version(model, metrics: dict, versions_dir=VERSIONS_DIR) -> Path:
+    """
+    Writes <versions_dir>/<timestamp>-<hash>/ with the model and its metrics;
+    sets metrics["version"] to the served version name.
+    """
+    versions_dir = Path(versions_dir)
+    tmp_dir = versions_dir / ".incoming"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    model_path = tmp_dir / MODEL_PATH.name
+    model.save_model(str(model_path))
+
+    model_hash = compute_model_hash(model_path)
+    metrics["version"] = describe_model_version(model_hash)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    version_dir = versions_dir / f"{stamp}-{model_hash[:12]}"
+    saved = {k: v for k, v in metrics.items() if k != "achieved_sensitivity"}
+    with open(tmp_dir / "model_metrics.json", "w") as f:
+        json.dump(saved, f, indent=4)
+    os.replace(tmp_dir, version_dir)
+    return version_dir
+
+
+def run(export_path, base_model_path=MODEL_PATH, data_path=DATA_PATH, replay: bool = True,
+        iterations: int = WARM_START_ITERATIONS, learning_rate: float | None = None,
+        holdout: float = NEW_HOLDOUT_FRACTION, compare_full: bool = False,
+        versions_dir=VERSIONS_DIR) -> dict:
+    new_rows = load_export(export_path)
+    if new_rows.empty:
+        raise ValueError(f"No usable labeled rows in {export_path}")
+    data = prepare_data(new_rows, data_path, replay, holdout)
+    eval_set = (data["X_eval"], data["y_eval"])
+
+    base_model = load_model(base_model_path)
+    base_auc = roc_auc_score(data["y_eval"], base_model.predict_proba(data["X_eval"])[:, 1])
+
+    started = time.perf_counter()
+    model = warm_start(base_model_path, data["X_fit"], data["y_fit"], eval_set, iterations, learning_rate)
+    warm_sec = time.perf_counter() - started
+
+    metrics = evaluate_model(model, data["X_eval"], data["y_eval"])
+    metrics["retraining"] = {
+        "method": "warm_start",
+        "base_model_hash": compute_model_hash(base_model_path),
+        "base_tree_count": base_model.tree_count_,
+        "tree_count": model.tree_count_,
+        "export": str(export_path),
+        "new_train_rows": data["new_train_rows"],
+        "new_holdout_rows": data["new_holdout_rows"],
+        "replay_rows": len(data["X_fit"]) - data["new_train_rows"],
+        "eval_rows": len(data["X_eval"]),
+        "base_roc_auc": round(base_auc, 4),
+        "train_sec": round(warm_sec, 2),
+        "trained_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+    report = {"metrics": metrics}
+    if compare_full:
+        started = time.perf_counter()
+        full_model = full_retrain(data["X_fit"], data["y_fit"], eval_set)
+        full_sec = time.perf_counter() - started
+        full_metrics = evaluate_model(full_model, data["X_eval"], data["y_eval"])
+        report["full_retrain"] = {
+            "roc_auc": full_metrics["roc_auc"],
+            "specificity_at_threshold": full_metrics["specificity_at_threshold"],
+            "train_sec": round(full_sec, 2),
+            "speedup": round(full_sec / warm_sec, 1),
+        }
+        metrics["retraining"]["full_retrain"] = report["full_retrain"]
+
+    report["version_dir"] = save_version(model, metrics, versions_dir)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm-start retraining from newly labeled rows")
+    parser.add_argument("--export", required=True,
+                        help="CSV in CVD_risk_dataset.csv format or a Google Sheets export with an outcome column")
+    parser.add_argument("--base-model", default=str(MODEL_PATH))
+    parser.add_argument("--data", default=DATA_PATH, help="Original training dataset (replay + test split)")
+    parser.add_argument("--iterations", type=int, default=WARM_START_ITERATIONS, help="Extra trees at most")
+    parser.add_argument("--learning-rate", type=float, default=None)
+    parser.add_argument("--holdout", type=float, default=NEW_HOLDOUT_FRACTION,
+                        help="Fraction of new rows added to the evaluation set")
+    parser.add_argument("--no-replay", action="store_true", help="Train the extra trees on the new rows only")
+    parser.add_argument("--compare-full", action="store_true", help="Also retrain from scratch and compare timing")
+    parser.add_argument("--versions-dir", default=str(VERSIONS_DIR))
+    args = parser.parse_args()
+
+    report = run(args.export, args.base_model, args.data, replay=not args.no_replay,
+                 iterations=args.iterations, learning_rate=args.learning_rate, holdout=args.holdout,
+                 compare_full=args.compare_full, versions_dir=args.versions_dir)
+    metrics = report["metrics"]
+    info = metrics["retraining"]
+    print(f"\nNew rows: {info['new_train_rows']} train + {info['new_holdout_rows']} holdout "
+          f"(replay {info['replay_rows']}), trees {info['base_tree_count']} -> {info['tree_count']}")
+    print(f"AUC on {info['eval_rows']} eval rows: base {info['base_roc_auc']:.4f} -> {metrics['roc_auc']:.4f}")
+    print(f"Threshold (90% sensitivity): {metrics['threshold_90_sens']:.4f}, "
+          f"specificity {metrics['specificity_at_threshold']:.4f}")
+    print(f"Warm start: {info['train_sec']:.1f}s")
+    if "full_retrain" in report:
+        full = report["full_retrain"]
+        print(f"Full retrain: {full['train_sec']:.1f}s (x{full['speedup']} slower), AUC {full['roc_auc']:.4f}")
+    print(f"\nVersion {metrics['version']} saved to {report['version_dir']}")
+    print(f'Serve it: POST /api/model/reload {{"model_path": "{report["version_dir"] / MODEL_PATH.name}", '
+          f'"metrics_path": "{report["version_dir"] / "model_metrics.json"}"}}')
+
+
+if __name__ == "__main__":
+    main()
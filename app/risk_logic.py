@@ -1,12 +1,15 @@
+import time
 import numpy as np
 from app.localization import t
 from app.localization import LOCALIZATION
 from app.clinical_mapping import CLINICAL_FEATURE_MAP
-from app.shap_explainer import explain_patient
+from app.shap_explainer import explain_patient, explain_patient_progressive
 from app.shap_interpreter import interpret_shap
 from app.safety import collect_safety_warnings
 from app.risk_card import build_risk_card
 from app.audit import build_audit_block
+from app.features import as_features
+from app.clinical_rules import evaluate_rules, flags_from_bits
 
 CLINICAL_PRIORITY = {
     "high_bp": 1,
@@ -28,41 +31,37 @@ CLINICAL_PRIORITY = {
 # New threshold for 90% Sensitivity
 HIGH_RISK_THRESHOLD = 0.2673
 
-def categorize_risk(probability: float) -> str:
+# Explanation quality levels, best first (see app/services/degradation.py)
+EXPLANATION_MODES = ("full", "summary", "lookup", "rules")
+
+# Time kept free after the SHAP stage for the rule factors, risk card and
+# response (they take ~1 ms; the rest is headroom for the endpoint)
+EXPLAIN_TAIL_RESERVE_MS = 10.0
+
+def categorize_risk(probability: float, threshold: float = HIGH_RISK_THRESHOLD) -> str:
     # Adjusted thresholds for the new model distribution
     if probability < 0.15:
         return "low"
-    elif probability < HIGH_RISK_THRESHOLD:
+    elif probability < threshold:
         return "moderate"
     else:
         return "high"
 
-def collect_rule_based_flags(patient):
-    flags = []
-
-    if patient.ap_hi >= 140:
-        flags.append("high_bp")
-    
-    # Calculate BMI if not present (though it should be calculated upstream or here)
-    # We use the one calculated for the model usually, but patient might have it
-    # We re-calculate to be safe
-    bmi = patient.weight / ((patient.height / 100) ** 2)
-
-    if bmi >= 30:
-        flags.append("obesity")
-
-    if patient.cholesterol == 2:
-        flags.append("cholesterol_attention")
-
-    if patient.cholesterol == 3:
-        flags.append("cholesterol_high")
+def categorize_risk_batch(probabilities: np.ndarray, threshold: float = HIGH_RISK_THRESHOLD) -> np.ndarray:
+    # Same cut-offs as categorize_risk, over an array of probabilities
+    return np.where(
+        probabilities < 0.15, "low",
+        np.where(probabilities < threshold, "moderate", "high")
+    )
 
-    return flags
+def collect_rule_based_flags(patient):
+    # Thresholds live in app/clinical_rules.py (shared with the batch path)
+    bits = evaluate_rules(as_features(patient), groups=("condition",))
+    return flags_from_bits(bits, "condition")
 
 
-def assess_prediction_confidence(probability: float) -> dict:
+def assess_prediction_confidence(probability: float, threshold: float = HIGH_RISK_THRESHOLD) -> dict:
     # Confidence based on distance from the decision boundary
-    threshold = HIGH_RISK_THRESHOLD
     distance = abs(probability - threshold)
 
     if distance >= 0.10:
@@ -94,17 +93,9 @@ def collect_clinical_risk_factors(patient, lang: str) -> list:
             "clinical_note": loc["note"]
         })
 
-    if patient.smoke == 1:
-        add("smoke")
-
-    if patient.gluc == 3:
-        add("gluc")
-
-    if patient.alco == 1:
-        add("alco")
-
-    if patient.active == 0:
-        add("active")
+    bits = evaluate_rules(as_features(patient), groups=("behavior",))
+    for feature_key in flags_from_bits(bits, "behavior"):
+        add(feature_key)
 
     return factors
 
@@ -145,85 +136,146 @@ def build_clinical_conditions(flags, lang):
     return conditions    
 
 
+def build_feature_vector(patient) -> np.ndarray:
+    """
+    Builds the (1, 12) model input for a patient.
+    Feature Order: ['age', 'gender', 'height', 'weight', 'ap_hi', 'ap_lo', 'cholesterol', 'gluc', 'smoke', 'alco', 'active', 'bmi']
+    """
+    return as_features(patient).vector
+
+
 def evaluate_clinical_risk(
     patient,
     model,
     shap_explainer,
     lang: str,
-    model_metrics
+    model_metrics,
+    model_version: str | None = None,
+    high_risk_threshold: float = HIGH_RISK_THRESHOLD,
+    explanation_mode: str = "full",
+    summary_explainer=None,
+    deadline: float | None = None,
+    explain_estimate_ms: float | None = None,
+    shap_lookup=None,
+    explain_seed: int | None = None,
+    explain_schedule=None
 ) -> dict:
     """
     Central clinical decision pipeline.
     Returns full clinical-grade result.
+
+    `model_version` and `high_risk_threshold` come from the model bundle
+    that produced the prediction (see app/core/model_registry.py).
+    `explanation_mode` selects the SHAP stage: "full" uses `shap_explainer`,
+    "summary" uses `summary_explainer` (compressed background), "lookup"
+    takes the SHAP values of the nearest dataset patients from `shap_lookup`
+    (app/shap_lookup.py) and "rules" skips SHAP and explains with the
+    rule-based factors only. A mode whose explainer is missing falls back
+    to the next cheaper one ("summary" -> "lookup" -> "rules"), never up to
+    "full", so a load-shedding caller is not handed the costliest path.
+
+    `deadline` (time.monotonic() seconds) bounds the explanation stage: SHAP
+    runs progressively and returns whatever permutations finished
+    EXPLAIN_TAIL_RESERVE_MS before it, leaving time for the later stages.
+    The outcome of every stage is reported in `pipeline_status`.
+
+    `explain_seed` seeds the permutation SHAP chunks and `explain_schedule`
+    replays the chunk sizes of an earlier run; the seed and chunk sizes
+    used are returned in `explain_trace`, so the prediction log can be
+    replayed with the same explanation.
+
+    `patient` may be a PatientInput or a ready PatientFeatures record; the
+    derived features (age in days, BMI, model vector) are computed once here
+    and shared by every stage.
     """
-    # Securely and efficiently prepare features for the model.
-    # Feature Order: ['age', 'gender', 'height', 'weight', 'ap_hi', 'ap_lo', 'cholesterol', 'gluc', 'smoke', 'alco', 'active', 'bmi']
-    
-    age_days = patient.age_years * 365.25
-    
-    # BMI Calculation
-    if patient.height > 0:
-        bmi = patient.weight / ((patient.height / 100) ** 2)
-    else:
-        bmi = 0 # Should be handled by validation schema
-
-    # Construct the feature vector
-    patient_features = np.array([[
-        age_days,
-        patient.gender,
-        patient.height,
-        patient.weight,
-        patient.ap_hi,
-        patient.ap_lo,
-        patient.cholesterol,
-        patient.gluc,
-        patient.smoke,
-        patient.alco,
-        patient.active,
-        bmi
-    ]])
+    stage_timings = {}
+    pipeline_status = {}
+    stage_started = time.perf_counter()
+
+    # Derived features, computed once for all stages
+    features = as_features(patient)
+    patient_features = features.vector
+    bmi = features.bmi
 
     # 1. Predict risk
     risk_proba = float(model.predict_proba(patient_features)[0, 1])
+    stage_timings["predict"] = (time.perf_counter() - stage_started) * 1000
+    pipeline_status["predict"] = "completed"
 
     # 2. Категория риска
-    risk_category = categorize_risk(risk_proba)
+    risk_category = categorize_risk(risk_proba, high_risk_threshold)
 
     # 3. Confidence & uncertainty layer
-    confidence = assess_prediction_confidence(risk_proba)
+    confidence = assess_prediction_confidence(risk_proba, high_risk_threshold)
     confidence_block = t(lang, "confidence", confidence["confidence_level"])
     confidence_title = confidence_block["title"]
     confidence_note = confidence_block["note"]
 
     # 4. Safety warnings
     safety_warnings = collect_safety_warnings(
-        patient,
+        features,
         confidence["confidence_level"],
         lang
     )
     
     # 5. SHAP-based explanation 
-    shap_values = explain_patient(shap_explainer, patient_features)
+    stage_started = time.perf_counter()
+    if explanation_mode == "summary" and summary_explainer is None:
+        explanation_mode = "lookup"
+    if explanation_mode == "lookup" and shap_lookup is None:
+        explanation_mode = "rules"
+
+    shap_values = None
+    explain_trace = None
+    if explanation_mode == "rules":
+        pipeline_status["explain"] = "skipped"
+    elif explanation_mode == "lookup":
+        shap_values = shap_lookup.explain(features)
+        pipeline_status["explain"] = "completed"
+    else:
+        explainer = summary_explainer if explanation_mode == "summary" else shap_explainer
+        if deadline is None and explain_seed is None and explain_schedule is None:
+            shap_values = explain_patient(explainer, patient_features)
+            pipeline_status["explain"] = "completed"
+        else:
+            explain_deadline = None if deadline is None else deadline - EXPLAIN_TAIL_RESERVE_MS / 1000
+            shap_values, done, planned, chunks = explain_patient_progressive(
+                explainer, patient_features, explain_deadline, estimate_ms=explain_estimate_ms,
+                seed=explain_seed, schedule=explain_schedule
+            )
+            explain_trace = {"seed": explain_seed, "chunks": chunks}
+            if done == planned:
+                pipeline_status["explain"] = "completed"
+            elif done > 0:
+                pipeline_status["explain"] = f"truncated ({done}/{planned} permutations)"
+            else:
+                pipeline_status["explain"] = "skipped"
+
     # 6. Клиническое объяснение
     # 6.1. SHAP факторы
-    clinical_explanation = interpret_shap(
-        shap_values=shap_values,
-        patient_data=patient,
-        lang=lang,
-        model_metrics=model_metrics
-    )
+    if shap_values is not None:
+        clinical_explanation = interpret_shap(
+            shap_values=shap_values,
+            patient_data=features,
+            lang=lang,
+            model_metrics=model_metrics
+        )
+    else:
+        clinical_explanation = []
+    stage_timings["explain"] = (time.perf_counter() - stage_started) * 1000
+    stage_started = time.perf_counter()
     existing_keys = {item["key"] for item in clinical_explanation}
     
     # 6.2. Поведенческие факторы
     # Rule-based (clinical) factors
-    rule_factors = collect_clinical_risk_factors(patient, lang)
+    rule_factors = collect_clinical_risk_factors(features, lang)
     for item in rule_factors:
         if item["key"] not in existing_keys:
             clinical_explanation.append(item)
             existing_keys.add(item["key"])
           
     # 6.3. Пороговые клинические флаги
-    flags = collect_rule_based_flags(patient)
+    flags = collect_rule_based_flags(features)
     clinical_rule_factors = build_clinical_factors(flags, lang)
     
     for item in clinical_rule_factors:
@@ -250,6 +302,8 @@ def evaluate_clinical_risk(
     clinical_explanation.sort(
     key=lambda x: CLINICAL_PRIORITY.get(x["key"], 99)
     )
+    stage_timings["rules"] = (time.perf_counter() - stage_started) * 1000
+    pipeline_status["rules"] = "completed"
     # 7. Risk card
     risk_card = build_risk_card(
         lang=lang,
@@ -278,6 +332,16 @@ def evaluate_clinical_risk(
 
         "risk_card": risk_card,
         "disclaimer": t(lang, "disclaimer", None),
-        "audit": build_audit_block(),
-        "performance_metrics": model_metrics
+        "audit": build_audit_block(model_version),
+        "performance_metrics": model_metrics,
+
+        "explanation_mode": explanation_mode,
+        "degraded": explanation_mode != "full",
+        "stage_timings_ms": {k: round(v, 2) for k, v in stage_timings.items()},
+        "pipeline_status": pipeline_status,
+
+        # Internal (not part of the API response): the unrounded
+        # probability for shadow comparison and the SHAP seed/chunks for replay
+        "raw_risk_probability": risk_proba,
+        "explain_trace": explain_trace
     }
@@ -1,56 +1,23 @@
 from .localization import t
+from .features import as_features
+from .clinical_rules import evaluate_rules, flags_from_bits
 
 
 def input_sanity_check(patient, lang: str) -> list:
-    warnings = []
-
-    if patient.age_years < 40:
-        warnings.append(
-            t(lang, "warnings", "young_age")
-        )
-
-    if patient.ap_hi < patient.ap_lo:
-        warnings.append(
-            t(lang, "warnings", "bp_inversion")
-        )
-
-    # Calculate BMI if missing
-    bmi = patient.bmi
-    if bmi is None and patient.height > 0:
-        bmi = patient.weight / ((patient.height / 100) ** 2)
-
-    if bmi is not None and bmi < 18.5:
-        warnings.append(
-            t(lang, "warnings", "underweight")
-        )
-
-    if patient.age_years > 85:
-        warnings.append(
-            t(lang, "warnings", "very_old_age")
-        )
-
-    return warnings
+    # Thresholds live in app/clinical_rules.py (shared with the batch path)
+    bits = evaluate_rules(as_features(patient), groups=("sanity",))
+    return [
+        t(lang, "warnings", key)
+        for key in flags_from_bits(bits, "sanity")
+    ]
 
 
 def ood_check(patient, lang: str) -> list:
-    warnings = []
-
-    if patient.ap_hi > 200 or patient.ap_lo > 120:
-        warnings.append(
-            t(lang, "warnings", "extreme_bp")
-        )
-
-    # Calculate BMI if missing
-    bmi = patient.bmi
-    if bmi is None and patient.height > 0:
-        bmi = patient.weight / ((patient.height / 100) ** 2)
-
-    if bmi is not None and bmi > 50:
-        warnings.append(
-            t(lang, "warnings", "extreme_bmi")
-        )
-
-    return warnings
+    bits = evaluate_rules(as_features(patient), groups=("ood",))
+    return [
+        t(lang, "warnings", key)
+        for key in flags_from_bits(bits, "ood")
+    ]
 
 
 def uncertainty_warning(confidence_level: str, lang: str) -> list:
@@ -67,12 +34,14 @@ def collect_safety_warnings(
     lang: str
 ) -> list:
     """
-    Collects all clinical safety warnings
+    Collects all clinical safety warnings.
+    `patient` may be a PatientInput or a precomputed PatientFeatures record.
     """
 
+    features = as_features(patient)
     warnings = []
-    warnings.extend(input_sanity_check(patient, lang))
-    warnings.extend(ood_check(patient, lang))
+    warnings.extend(input_sanity_check(features, lang))
+    warnings.extend(ood_check(features, lang))
     warnings.extend(uncertainty_warning(confidence_level, lang))
 
     return warnings
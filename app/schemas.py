@@ -3,6 +3,8 @@ from typing import List
 from typing import Literal
 from pydantic import BaseModel, ConfigDict
 
+from app.features import compute_bmi
+
 # -------------------------
 # ВХОДНЫЕ ДАННЫЕ ПАЦИЕНТА
 # -------------------------
@@ -31,8 +33,7 @@ class PatientInput(BaseModel):
 
         # 2. Calculate BMI if not set
         if self.bmi is None and self.weight and self.height:
-            height_m = self.height / 100.0
-            self.bmi = round(self.weight / (height_m * height_m), 2)
+            self.bmi = round(compute_bmi(self.weight, self.height), 2)
         
         return self
 
@@ -85,6 +86,13 @@ class ModelPerformanceMetrics(BaseModel):
     f1_score: float | str | None = None
     gender_specific_roc_auc: dict | None = None
 
+class PopulationPercentile(BaseModel):
+    percentile: float = Field(..., description="Процент людей той же страты с риском ниже")
+    sex: str
+    age_band: str
+    region: str | None = None
+    reference_size: int
+
 class PredictionResponse(BaseModel):
     risk_probability: float
     risk_category: Literal["low", "moderate", "high"]
@@ -106,3 +114,154 @@ class PredictionResponse(BaseModel):
     performance_metrics: ModelPerformanceMetrics
     data_validation: dict
 
+    # "full" | "summary" | "lookup" | "rules"; degraded=True when load shedding
+    # replaced the full SHAP explanation
+    explanation_mode: Literal["full", "summary", "lookup", "rules"] = "full"
+    degraded: bool = False
+
+    # Stage -> "completed" | "truncated (k/n permutations)" | "skipped"
+    # when the per-request deadline cut the pipeline short
+    pipeline_status: dict | None = None
+    stage_timings_ms: dict | None = None
+
+    # Position among people of the same sex and age band (None without a
+    # population index built for the serving model)
+    population_percentile: PopulationPercentile | None = None
+
+
+# -------------------------
+# WHAT-IF СЦЕНАРИИ
+# -------------------------
+
+# Fields a scenario may change (the patient's lifestyle and measurements)
+WHAT_IF_FIELDS = ("weight", "ap_hi", "ap_lo", "cholesterol", "gluc", "smoke", "alco", "active")
+
+class WhatIfScenario(BaseModel):
+    name: str | None = Field(None, max_length=64, description="Метка сценария, например quit_smoking")
+    changes: dict[str, float] = Field(default_factory=dict, description="Новые значения: {\"smoke\": 0, \"ap_hi\": 130}")
+    deltas: dict[str, float] = Field(default_factory=dict, description="Сдвиги значений: {\"weight\": -10}")
+    explain: bool = Field(False, description="Вернуть SHAP-объяснение для этого сценария")
+
+    @model_validator(mode='after')
+    def validate_fields(self):
+        unknown = (set(self.changes) | set(self.deltas)) - set(WHAT_IF_FIELDS)
+        if unknown:
+            raise ValueError(f"Unsupported what-if fields: {', '.join(sorted(unknown))}")
+        if not self.changes and not self.deltas:
+            raise ValueError("A scenario must change at least one field")
+        return self
+
+class WhatIfRequest(BaseModel):
+    patient: PatientInput
+    scenarios: List[WhatIfScenario] = Field(..., min_length=1)
+    explain_base: bool = False
+
+class WhatIfResult(BaseModel):
+    name: str | None = None
+    changes: dict
+    risk_probability: float
+    risk_category: Literal["low", "moderate", "high"]
+    risk_label: str
+    delta: float
+    relative_change: float | None = None
+    category_changed: bool
+    patient_bmi: float | None = None
+    clinical_explanation: List[ClinicalExplanationItem] | None = None
+
+class WhatIfResponse(BaseModel):
+    base_risk_probability: float
+    base_risk_category: Literal["low", "moderate", "high"]
+    base_risk_label: str
+    base_explanation: List[ClinicalExplanationItem] | None = None
+    scenarios: List[WhatIfResult]
+    explanation_mode: Literal["full", "summary", "lookup", "rules"] = "full"
+    model_version: str
+
+    model_config = ConfigDict(
+        protected_namespaces=()
+    )
+
+# -------------------------
+# КОНТРФАКТИЧЕСКИЕ РЕКОМЕНДАЦИИ
+# -------------------------
+
+class CounterfactualRequest(BaseModel):
+    patient: PatientInput
+    features: List[str] | None = Field(None, description="Какие показатели можно менять (по умолчанию все изменяемые)")
+    max_solutions: int = Field(3, ge=1, le=10)
+    max_evaluations: int | None = Field(None, ge=1, description="Бюджет оценок модели (не выше серверного лимита)")
+
+    @model_validator(mode='after')
+    def validate_features(self):
+        if self.features is not None:
+            unknown = set(self.features) - set(WHAT_IF_FIELDS)
+            if unknown:
+                raise ValueError(f"Unsupported counterfactual fields: {', '.join(sorted(unknown))}")
+            if not self.features:
+                raise ValueError("At least one field must be modifiable")
+        return self
+
+class CounterfactualSolution(BaseModel):
+    changes: dict
+    risk_probability: float
+    delta: float
+    n_changes: int
+    cost: float
+
+class CounterfactualResponse(BaseModel):
+    status: Literal["not_needed", "found", "not_found"]
+    base_risk_probability: float
+    threshold: float
+    solutions: List[CounterfactualSolution]
+    best_effort: CounterfactualSolution | None = None
+    evaluations: int
+    max_evaluations: int
+    model_version: str
+
+    model_config = ConfigDict(
+        protected_namespaces=()
+    )
+
+# -------------------------
+# КРИВЫЕ РИСКА
+# -------------------------
+
+class RiskCurvesRequest(BaseModel):
+    patient: PatientInput
+    curves: List[Literal["age", "ap_hi", "bmi"]] | None = Field(None, description="По умолчанию все три кривые")
+    points: int = Field(25, ge=3, description="Точек на кривую")
+
+class RiskCurve(BaseModel):
+    x: List[float]
+    risk: List[float]
+    current: float
+
+class RiskCurvesResponse(BaseModel):
+    base_risk_probability: float
+    threshold: float
+    points: int
+    curves: dict[str, RiskCurve]
+    cached: bool
+    model_version: str
+
+    model_config = ConfigDict(
+        protected_namespaces=()
+    )
+
+# -------------------------
+# ПОХОЖИЕ ПАЦИЕНТЫ
+# -------------------------
+
+class SimilarPatientsRequest(BaseModel):
+    patient: PatientInput
+    k: int = Field(20, ge=1, description="Число ближайших пациентов")
+    include_neighbors: bool = Field(False, description="Вернуть обезличенные записи соседей")
+
+class SimilarPatientsResponse(BaseModel):
+    k: int
+    outcome_rate: float
+    cohort_outcome_rate: float
+    mean_distance: float
+    max_distance: float
+    summary: dict
+    neighbors: List[dict] | None = None
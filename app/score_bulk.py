@@ -0,0 +1,309 @@
+"""
+Bulk scoring of registry extracts in CVD_risk_dataset.csv format.
+
+Streams the input in chunks, applies the training cleaning rules
+(app/dataset.py), scores chunks in a process pool and appends the results
+in input order to a CSV file or a directory of Parquet parts. Progress is
+checkpointed after every written chunk, so an interrupted run continues
+where it stopped with --resume.
+
+Usage:
+    python -m app.score_bulk --input extract.csv --output scored.csv --workers 4
+    python -m app.score_bulk --input extract.csv --output scored/ --format parquet --shap
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+
+import pandas as pd
+
+from app.dataset import iter_clean_chunks
+from app.model_loader import MODEL_PATH, METRICS_PATH, compute_model_hash, describe_model_version
+
+DEFAULT_CHUNK_SIZE = 50_000
+DEFAULT_KEEP_COLUMNS = ("id",)
+SCORE_COLUMNS = ("risk_probability", "risk_category", "clinical_flags", "safety_flags")
+
+# Worker-local model, loaded once per process by _init_worker
+_worker = {}
+
+
+def _init_worker(model_path, metrics_path):
+    from app.model_loader import load_model, load_training_metrics
+    from app.risk_logic import HIGH_RISK_THRESHOLD
+
+    _worker["model"] = load_model(model_path)
+    _worker["threshold"] = float(
+        load_training_metrics(metrics_path).get("threshold_90_sens", HIGH_RISK_THRESHOLD)
+    )
+
+
+def _join_flags(rows) -> list:
+    return ["|".join(flags) for flags in rows]
+
+
+def result_columns(with_shap: bool) -> list:
+    """Score columns of every output chunk (after the kept input columns)."""
+    from app.features import MODEL_FEATURES
+
+    columns = list(SCORE_COLUMNS)
+    if with_shap:
+        columns += [f"shap_{feature}" for feature in MODEL_FEATURES] + ["shap_base"]
+    return columns
+
+
+def score_chunk(df: pd.DataFrame, keep_columns, with_shap: bool) -> pd.DataFrame:
+    """
+    Scores one cleaned chunk: probability, category, clinical and safety
+    flags and, with `with_shap`, per-feature CatBoost TreeSHAP values
+    (log-odds scale; shap_base is the expected value).
+    """
+    from app.clinical_rules import evaluate_rules, flags_from_batch
+    from app.features import FeatureBatch, MODEL_FEATURES
+    from app.risk_logic import categorize_risk_batch
+
+    model = _worker["model"]
+    batch = FeatureBatch.from_frame(df)
+
+    out = pd.DataFrame({c: df[c].to_numpy() for c in keep_columns if c in df.columns})
+    if len(batch) == 0:
+        # Same columns and dtypes as a scored chunk, so the output schema
+        # does not depend on which chunks were rejected entirely
+        for column in result_columns(with_shap):
+            dtype = object if column in ("risk_category", "clinical_flags", "safety_flags") else float
+            out[column] = pd.Series(dtype=dtype)
+        return out
+
+    proba = model.predict_proba(batch.matrix)[:, 1]
+    out["risk_probability"] = proba.round(4)
+    out["risk_category"] = categorize_risk_batch(proba, _worker["threshold"])
+
+    bits = evaluate_rules(batch, groups=("condition", "sanity", "ood"))
+    out["clinical_flags"] = _join_flags(flags_from_batch(bits, "condition"))
+    out["safety_flags"] = _join_flags(
+        sanity + ood
+        for sanity, ood in zip(flags_from_batch(bits, "sanity"), flags_from_batch(bits, "ood"))
+    )
+
+    if with_shap:
+        from catboost import Pool
+
+        shap_values = model.get_feature_importance(Pool(batch.matrix), type="ShapValues")
+        for j, feature in enumerate(MODEL_FEATURES):
+            out[f"shap_{feature}"] = shap_values[:, j].round(5)
+        out["shap_base"] = shap_values[:, -1].round(5)
+
+    return out
+
+
+def _score_task(number: int, raw_rows: int, df: pd.DataFrame, keep_columns, with_shap: bool):
+    return number, raw_rows, score_chunk(df, keep_columns, with_shap)
+
+
+# -------------------------
+# Output
+# -------------------------
+
+class CsvResultWriter:
+    """Appends chunks to one CSV file; the byte offset is the resume point."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def position(self) -> int:
+        return self.path.stat().st_size if self.path.exists() else 0
+
+    def rollback(self, state: dict):
+        # Drop anything written after the last checkpoint (a half-written chunk)
+        if self.path.exists():
+            with open(self.path, "r+b") as f:
+                f.truncate(state["output_position"])
+
+    def write(self, number: int, df: pd.DataFrame):
+        header = self.position() == 0
+        df.to_csv(self.path, mode="a", header=header, index=False)
+
+
+class ParquetResultWriter:
+    """One Parquet file per input chunk: <dir>/part-00000.parquet, ..."""
+
+    def __init__(self, path):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise SystemExit("Parquet output requires pyarrow (pip install pyarrow)")
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def position(self) -> int:
+        return 0
+
+    def rollback(self, state: dict):
+        for part in self.path.glob("part-*.parquet"):
+            if int(part.stem.split("-")[1]) >= state["chunks_done"]:
+                part.unlink()
+
+    def write(self, number: int, df: pd.DataFrame):
+        if df.empty:
+            # No part for a fully rejected chunk: an empty frame has no
+            # string column types and would give the part its own schema
+            return
+        tmp = self.path / f".part-{number:05d}.parquet.tmp"
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, self.path / f"part-{number:05d}.parquet")
+
+
+# -------------------------
+# Checkpoint
+# -------------------------
+
+def checkpoint_path(output) -> Path:
+    output = Path(output)
+    return output.with_name(output.name + ".checkpoint.json")
+
+
+def input_fingerprint(path) -> dict:
+    stat = Path(path).stat()
+    return {"input": str(Path(path).resolve()), "input_size": stat.st_size, "input_mtime": stat.st_mtime}
+
+
+def load_checkpoint(path, expected: dict) -> dict | None:
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, "r") as f:
+        state = json.load(f)
+    mismatched = [k for k, v in expected.items() if state.get(k) != v]
+    if mismatched:
+        raise SystemExit(
+            f"Checkpoint {path} was written for a different run ({', '.join(mismatched)} changed); "
+            f"remove it or the output to start over"
+        )
+    return state
+
+
+def save_checkpoint(path, state: dict):
+    tmp = Path(str(path) + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=4)
+    os.replace(tmp, path)
+
+
+# -------------------------
+# Driver
+# -------------------------
+
+def run(input_path, output, fmt: str = "csv", workers: int = 2, chunk_size: int = DEFAULT_CHUNK_SIZE,
+        with_shap: bool = False, keep_columns=DEFAULT_KEEP_COLUMNS, resume: bool = False,
+        model_path=MODEL_PATH, metrics_path=METRICS_PATH, progress=print) -> dict:
+    """
+    Scores `input_path` into `output`. At most 2 * workers chunks are in
+    flight or waiting to be written, so memory is bounded by the chunk size,
+    not the input size. Results are written in input order.
+    """
+    writer = ParquetResultWriter(output) if fmt == "parquet" else CsvResultWriter(output)
+    ckpt_path = checkpoint_path(output)
+
+    run_key = {
+        **input_fingerprint(input_path),
+        "chunk_size": chunk_size,
+        "format": fmt,
+        "shap": with_shap,
+        "keep_columns": list(keep_columns),
+        "model_version": describe_model_version(compute_model_hash(model_path)),
+    }
+    state = load_checkpoint(ckpt_path, run_key) if resume else None
+    if state is None:
+        state = {**run_key, "chunks_done": 0, "rows_in": 0, "rows_scored": 0,
+                 "rows_rejected": 0, "output_position": 0, "elapsed_sec": 0.0}
+    writer.rollback(state)
+
+    if state["chunks_done"]:
+        progress(f"Resuming after chunk {state['chunks_done']} ({state['rows_in']} input rows done)")
+
+    started = time.perf_counter()
+    resumed_elapsed = state["elapsed_sec"]
+    rows_at_start = state["rows_in"]
+    pending = {}
+
+    def flush():
+        # Write completed chunks strictly in input order
+        while state["chunks_done"] in pending:
+            raw_rows, scored = pending.pop(state["chunks_done"])
+            writer.write(state["chunks_done"], scored)
+            state["chunks_done"] += 1
+            state["rows_in"] += raw_rows
+            state["rows_scored"] += len(scored)
+            state["rows_rejected"] += raw_rows - len(scored)
+            state["output_position"] = writer.position()
+            state["elapsed_sec"] = resumed_elapsed + time.perf_counter() - started
+            save_checkpoint(ckpt_path, state)
+
+            rate = (state["rows_in"] - rows_at_start) / max(time.perf_counter() - started, 1e-9)
+            progress(
+                f"chunk {state['chunks_done']:>5} | rows {state['rows_in']:>10,} "
+                f"| scored {state['rows_scored']:>10,} | rejected {state['rows_rejected']:>8,} "
+                f"| {rate:,.0f} rows/s"
+            )
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(str(model_path), str(metrics_path))) as pool:
+        in_flight = set()
+
+        def drain(block_until: int):
+            nonlocal in_flight
+            while len(in_flight) + len(pending) >= block_until and in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    number, raw_rows, scored = future.result()
+                    pending[number] = (raw_rows, scored)
+                flush()
+
+        chunks = iter_clean_chunks(input_path, chunk_size, skip_chunks=state["chunks_done"])
+        for number, raw_rows, cleaned in chunks:
+            in_flight.add(pool.submit(_score_task, number, raw_rows, cleaned, tuple(keep_columns), with_shap))
+            drain(2 * workers)
+        drain(1)
+
+    state["elapsed_sec"] = resumed_elapsed + time.perf_counter() - started
+    state["completed"] = True
+    save_checkpoint(ckpt_path, state)
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a CVD_risk_dataset-format CSV in bulk")
+    parser.add_argument("--input", required=True, help="CSV in CVD_risk_dataset.csv format (age in days)")
+    parser.add_argument("--output", required=True, help="Output CSV file, or directory for --format parquet")
+    parser.add_argument("--format", choices=("csv", "parquet"), default=None,
+                        help="Output format (default: from the output extension)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--shap", action="store_true", help="Add per-feature TreeSHAP columns")
+    parser.add_argument("--keep-columns", default=",".join(DEFAULT_KEEP_COLUMNS),
+                        help="Input columns copied to the output (comma-separated)")
+    parser.add_argument("--resume", action="store_true", help="Continue from the checkpoint next to the output")
+    parser.add_argument("--model", default=str(MODEL_PATH))
+    parser.add_argument("--metrics", default=str(METRICS_PATH))
+    args = parser.parse_args()
+
+    fmt = args.format or ("parquet" if Path(args.output).suffix in ("", ".parquet") else "csv")
+    keep_columns = tuple(c for c in args.keep_columns.split(",") if c)
+
+    print(f"Scoring {args.input} -> {args.output} ({fmt}, {args.workers} workers, chunks of {args.chunk_size})")
+    state = run(
+        args.input, args.output, fmt=fmt, workers=args.workers, chunk_size=args.chunk_size,
+        with_shap=args.shap, keep_columns=keep_columns, resume=args.resume,
+        model_path=args.model, metrics_path=args.metrics,
+    )
+
+    rate = state["rows_in"] / state["elapsed_sec"] if state["elapsed_sec"] else float("nan")
+    print(f"Done: {state['rows_scored']:,} scored, {state['rows_rejected']:,} rejected by cleaning "
+          f"out of {state['rows_in']:,} rows in {state['elapsed_sec']:.1f}s ({rate:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
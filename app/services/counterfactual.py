@@ -0,0 +1,240 @@
+"""
+Контрфактические рекомендации: минимальный набор изменений, снижающий риск ниже порога
+"""
+import heapq
+import math
+
+import numpy as np
+
+from app.features import MODEL_FEATURES, PatientFeatures, as_features, compute_bmi
+from app.risk_logic import HIGH_RISK_THRESHOLD
+
+COLUMN = {name: j for j, name in enumerate(MODEL_FEATURES)}
+
+# Modifiable features, each only in the healthier direction:
+# field -> (step, realistic limit). ap_hi/ap_lo/weight move down in steps,
+# the categorical ones one level at a time.
+COUNTERFACTUAL_STEPS = {
+    "ap_hi": (10, 110),
+    "ap_lo": (5, 70),
+    "weight": (5, None),  # limit from MIN_TARGET_BMI / MAX_WEIGHT_LOSS
+    "cholesterol": (1, 1),
+    "gluc": (1, 1),
+    "smoke": (1, 0),
+    "alco": (1, 0),
+    "active": (1, 1),
+}
+COUNTERFACTUAL_FEATURES = tuple(COUNTERFACTUAL_STEPS)
+
+MIN_TARGET_BMI = 20.0
+MAX_WEIGHT_LOSS = 0.2  # fraction of current weight
+
+# Cost of a change: 1 per changed feature, plus this per extra step of the
+# same feature, so fewer features changed always wins over smaller steps
+# within a handful of steps.
+EXTRA_STEP_COST = 0.25
+
+# Weight of the remaining log-odds gap to the threshold in the search
+# priority (0 = uniform-cost search: exact minimal cost order).
+HEURISTIC_WEIGHT = 0.5
+
+# States expanded per batch; their children are scored in one predict_proba call
+EXPAND_BATCH = 8
+
+
+def _logit(p: float) -> float:
+    p = min(max(p, 1e-6), 1 - 1e-6)
+    return math.log(p / (1 - p))
+
+
+def feature_levels(features: PatientFeatures, allowed=COUNTERFACTUAL_FEATURES) -> dict:
+    """field -> values reachable from the current one (index 0 = current), within bounds."""
+    levels = {}
+    for field in allowed:
+        step, limit = COUNTERFACTUAL_STEPS[field]
+        current = getattr(features, field)
+        if field == "active":
+            values = [current] + ([1] if current < limit else [])
+        elif field == "weight":
+            floor = max(30.0, MIN_TARGET_BMI * (features.height / 100) ** 2, current * (1 - MAX_WEIGHT_LOSS))
+            values = [current] + np.arange(current - step, floor - 1e-9, -step).tolist()
+        else:
+            # Next lower multiple of the step, then whole steps down to the limit
+            nxt = int(current // step * step)
+            if nxt >= current:
+                nxt -= step
+            values = [current] + list(range(nxt, limit - 1, -step))
+        if len(values) > 1:
+            levels[field] = np.asarray(values, dtype=float)
+    return levels
+
+
+class CounterfactualSearch:
+    """
+    Best-first search over combinations of feature levels.
+
+    A state is a tuple of level indices (0 = unchanged) per modifiable
+    feature. States are expanded by moving one feature one step further;
+    the children of EXPAND_BATCH states are built as one matrix and scored
+    with one predict_proba call, and every score is cached by state. The
+    frontier is ordered by change cost plus HEURISTIC_WEIGHT x the
+    remaining log-odds gap to the threshold. States that contain an
+    already found solution are pruned (they only add changes). The search
+    stops after `max_evaluations` scored states.
+    """
+
+    def __init__(self, model, features: PatientFeatures, threshold: float = HIGH_RISK_THRESHOLD,
+                 allowed=COUNTERFACTUAL_FEATURES, heuristic_weight: float = HEURISTIC_WEIGHT):
+        self.model = model
+        self.features = features
+        self.threshold = threshold
+        self.heuristic_weight = heuristic_weight
+        self.levels = feature_levels(features, allowed)
+        self.fields = list(self.levels)
+        self.max_level = np.array([len(self.levels[f]) - 1 for f in self.fields])
+        self.cache = {}
+        self.evaluations = 0
+
+    def _matrix(self, states: np.ndarray) -> np.ndarray:
+        matrix = np.repeat(self.features.vector, len(states), axis=0)
+        for k, field in enumerate(self.fields):
+            matrix[:, COLUMN[field]] = self.levels[field][states[:, k]]
+        if "weight" in self.levels:
+            matrix[:, COLUMN["bmi"]] = compute_bmi(matrix[:, COLUMN["weight"]], matrix[:, COLUMN["height"]])
+        return matrix
+
+    def _valid(self, matrix: np.ndarray) -> np.ndarray:
+        # PatientInput bounds: systolic must stay above diastolic
+        return matrix[:, COLUMN["ap_hi"]] > matrix[:, COLUMN["ap_lo"]]
+
+    def _score(self, states: list) -> list:
+        """Probabilities for new states (None for invalid ones), one model call."""
+        array = np.asarray(states, dtype=int).reshape(len(states), len(self.fields))
+        matrix = self._matrix(array)
+        valid = self._valid(matrix)
+        proba = np.full(len(states), np.nan)
+        if valid.any():
+            proba[valid] = self.model.predict_proba(matrix[valid])[:, 1]
+        self.evaluations += int(valid.sum())
+        return [None if np.isnan(p) else float(p) for p in proba]
+
+    def cost(self, state) -> float:
+        changed = sum(1 for level in state if level)
+        extra = sum(level - 1 for level in state if level > 1)
+        return changed + EXTRA_STEP_COST * extra
+
+    def _priority(self, state, probability: float) -> float:
+        gap = max(0.0, _logit(probability) - _logit(self.threshold))
+        return self.cost(state) + self.heuristic_weight * gap
+
+    def run(self, max_evaluations: int, max_solutions: int = 3) -> dict:
+        start = tuple([0] * len(self.fields))
+        base = self._score([start])[0]
+        self.cache[start] = base
+        if base < self.threshold or not self.fields:
+            return {"base": base, "solutions": [], "best": (start, base)}
+
+        frontier = [(self._priority(start, base), 0, start)]
+        counter = 1
+        solutions = []
+        best = (start, base)
+
+        while frontier and self.evaluations < max_evaluations and len(solutions) < max_solutions:
+            children = []
+            for _ in range(min(EXPAND_BATCH, len(frontier))):
+                _, _, state = heapq.heappop(frontier)
+                if any(all(s >= o for s, o in zip(state, solution)) for solution in solutions):
+                    continue  # contains a found solution: only adds changes
+                if self.cache[state] < self.threshold:
+                    solutions.append(state)
+                    if len(solutions) >= max_solutions:
+                        break
+                    continue
+                for k in range(len(self.fields)):
+                    if state[k] < self.max_level[k]:
+                        child = state[:k] + (state[k] + 1,) + state[k + 1:]
+                        if child not in self.cache:
+                            self.cache[child] = None  # reserved, scored below
+                            children.append(child)
+
+            children = children[:max(0, max_evaluations - self.evaluations)]
+            if not children:
+                continue
+            for child, probability in zip(children, self._score(children)):
+                self.cache[child] = probability
+                if probability is None:
+                    continue
+                if probability < best[1]:
+                    best = (child, probability)
+                heapq.heappush(frontier, (self._priority(child, probability), counter, child))
+                counter += 1
+
+        # Solutions found in the last batch but not yet popped
+        if len(solutions) < max_solutions:
+            pending = sorted(
+                (self.cost(state), state) for _, _, state in frontier
+                if self.cache[state] is not None and self.cache[state] < self.threshold
+            )
+            for _, state in pending:
+                if len(solutions) >= max_solutions:
+                    break
+                if not any(all(s >= o for s, o in zip(state, solution)) for solution in solutions):
+                    solutions.append(state)
+
+        return {"base": base, "solutions": solutions, "best": best}
+
+    def describe(self, state) -> dict:
+        changes = {}
+        for k, field in enumerate(self.fields):
+            if state[k]:
+                value = self.levels[field][state[k]]
+                changes[field] = round(float(value), 1) if field == "weight" else int(value)
+        return changes
+
+
+def find_counterfactuals(patient, model, threshold: float = HIGH_RISK_THRESHOLD,
+                         max_evaluations: int = 2000, max_solutions: int = 3,
+                         allowed=None) -> dict:
+    """
+    Smallest sets of healthier changes that bring the risk below `threshold`.
+
+    Returns status ("not_needed" | "found" | "not_found"), the base risk,
+    up to `max_solutions` solutions ordered by change cost and, when
+    nothing reached the threshold within the budget, the lowest-risk
+    combination seen (`best_effort`).
+    """
+    features = as_features(patient)
+    search = CounterfactualSearch(model, features, threshold, allowed or COUNTERFACTUAL_FEATURES)
+    outcome = search.run(max_evaluations, max_solutions)
+    base = outcome["base"]
+
+    def entry(state):
+        probability = search.cache[state]
+        changes = search.describe(state)
+        return {
+            "changes": changes,
+            "risk_probability": round(probability, 3),
+            "delta": round(probability - base, 3),
+            "n_changes": len(changes),
+            "cost": round(search.cost(state), 2),
+        }
+
+    if base < threshold:
+        status = "not_needed"
+    elif outcome["solutions"]:
+        status = "found"
+    else:
+        status = "not_found"
+
+    result = {
+        "status": status,
+        "base_risk_probability": round(base, 3),
+        "threshold": threshold,
+        "solutions": [entry(state) for state in sorted(outcome["solutions"], key=search.cost)],
+        "best_effort": None,
+        "evaluations": search.evaluations,
+        "max_evaluations": max_evaluations,
+    }
+    if status == "not_found" and outcome["best"][0] != tuple([0] * len(search.fields)):
+        result["best_effort"] = entry(outcome["best"][0])
+    return result
@@ -0,0 +1,216 @@
+"""
+Адаптивная деградация объяснений под нагрузкой
+"""
+import logging
+import secrets
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from app.core.config import settings
+from app.risk_logic import evaluate_clinical_risk, EXPLANATION_MODES
+from app.shap_lookup import shap_lookup
+
+logger = logging.getLogger(__name__)
+
+# Recover only when the estimated latency of the better level is well
+# under budget, so the controller does not oscillate around the limit.
+RECOVERY_HEADROOM = 0.7
+# Assumed full/summary explain cost ratio until both have been observed
+DEFAULT_COST_RATIO = 5.0
+
+
+class DegradationController:
+    """
+    Wraps evaluate_clinical_risk and picks the explanation mode per request.
+
+    Steps down one level (full SHAP -> summarized-background SHAP ->
+    precomputed dataset SHAP lookup -> rule factors only) when the p90
+    explain-stage latency of the current level exceeds the budget or too
+    many requests are in flight. Steps back up
+    once the estimated cost of the better level fits the budget with
+    headroom and at least `cooldown_sec` has passed since the last change.
+
+    The lookup level is skipped in both directions while no SHAP lookup
+    table matches the serving model, so the controller never settles on a
+    level that is really serving rules. Timings are recorded under the
+    mode that actually ran.
+    """
+
+    def __init__(self, budget_ms: float, max_in_flight: int, window: int = 20,
+                 cooldown_sec: float = 15.0, enabled: bool = True):
+        self.budget_ms = budget_ms
+        self.max_in_flight = max_in_flight
+        self.cooldown_sec = cooldown_sec
+        self.enabled = enabled
+        self.min_samples = max(3, window // 4)
+
+        self.level = 0
+        self.transitions = 0
+        self._in_flight = 0
+        self._changed_at = time.monotonic()
+        self._recent = {mode: deque(maxlen=window) for mode in EXPLANATION_MODES}
+        # Long-run typical cost per level, survives level changes
+        self._typical = {}
+        self._lookup_available = True
+        self._lock = threading.Lock()
+
+    @property
+    def mode(self) -> str:
+        return EXPLANATION_MODES[self.level]
+
+    def evaluate(self, patient, bundle, lang: str, deadline: float | None = None) -> dict:
+        # Only a table built for this bundle's model. Looked up once degraded:
+        # loading it (and the neighbour index) is not worth it at full SHAP.
+        degraded = self.enabled and self.level > 0
+        lookup = shap_lookup.for_version(bundle.version) if degraded else None
+        with self._lock:
+            self._in_flight += 1
+            if degraded:
+                self._lookup_available = lookup is not None
+            if self.mode == "lookup" and lookup is None:
+                self._set_level(self._step(self.level, +1), "no SHAP lookup table for the model")
+            self._adjust()
+            mode = self.mode if self.enabled else "full"
+            explain_estimate_ms = self._estimate(mode)
+        # "summary" without a summary explainer falls back to the lookup table
+        needs_lookup = mode == "lookup" or (mode == "summary" and bundle.summary_explainer is None)
+        try:
+            result = evaluate_clinical_risk(
+                patient=patient,
+                model=bundle.model,
+                shap_explainer=bundle.shap_explainer,
+                lang=lang,
+                model_metrics=bundle.model_metrics,
+                model_version=bundle.version,
+                high_risk_threshold=bundle.high_risk_threshold,
+                explanation_mode=mode,
+                summary_explainer=bundle.summary_explainer,
+                deadline=deadline,
+                explain_estimate_ms=explain_estimate_ms,
+                shap_lookup=lookup if needs_lookup else None,
+                # Logged with the prediction so replay reproduces the explanation
+                explain_seed=secrets.randbits(31)
+            )
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        # A stage cut short by the request deadline says nothing about its cost;
+        # a fallback (e.g. summary -> rules) is recorded under the mode that ran
+        if result["pipeline_status"]["explain"] == "completed" or result["explanation_mode"] == "rules":
+            self.observe(result["explanation_mode"], result["stage_timings_ms"]["explain"])
+        return result
+
+    def observe(self, mode: str, explain_ms: float):
+        with self._lock:
+            self._recent[mode].append(explain_ms)
+            typical = self._typical.get(mode)
+            self._typical[mode] = explain_ms if typical is None else 0.9 * typical + 0.1 * explain_ms
+            self._adjust()
+
+    def _estimate(self, mode: str):
+        """Expected explain cost: median of the recent window, robust to one cold call."""
+        samples = self._recent[mode]
+        if samples:
+            return float(np.median(samples))
+        return self._typical.get(mode)
+
+    def _p90(self, mode: str):
+        samples = self._recent[mode]
+        if len(samples) < self.min_samples:
+            return None
+        return float(np.percentile(samples, 90))
+
+    def _step(self, level: int, direction: int) -> int:
+        """Next level in `direction` (+1 cheaper, -1 better), skipping an unavailable lookup level."""
+        level += direction
+        while EXPLANATION_MODES[level] == "lookup" and not self._lookup_available:
+            level += direction
+        return level
+
+    def _set_level(self, level: int, reason: str):
+        previous = self.mode
+        self.level = level
+        self.transitions += 1
+        self._changed_at = time.monotonic()
+        # Judge the new level on fresh samples only
+        self._recent[self.mode].clear()
+        logger.warning(f"Explanation mode {previous} -> {self.mode} ({reason})")
+
+    def _adjust(self):
+        if not self.enabled:
+            return
+
+        recent = self._p90(self.mode)
+        queue_overloaded = self._in_flight > self.max_in_flight
+        latency_overloaded = recent is not None and recent > self.budget_ms
+
+        if (queue_overloaded or latency_overloaded) and self.level < len(EXPLANATION_MODES) - 1:
+            reason = f"in_flight={self._in_flight}" if queue_overloaded else f"p90={recent:.0f}ms"
+            self._set_level(self._step(self.level, +1), reason)
+            return
+
+        if self.level == 0 or queue_overloaded:
+            return
+        if time.monotonic() - self._changed_at < self.cooldown_sec:
+            return
+        if self._in_flight > max(1, self.max_in_flight // 2):
+            return
+
+        better_level = self._step(self.level, -1)
+        better = EXPLANATION_MODES[better_level]
+        if self.mode == "rules":
+            # Rule-only explanations carry no latency signal; probe upward
+            # once the queue has drained and let the better level prove itself.
+            self._set_level(better_level, "queue drained")
+            return
+
+        if recent is None:
+            return
+        typical_current = self._typical.get(self.mode)
+        typical_better = self._typical.get(better)
+        if typical_current and typical_better:
+            ratio = typical_better / typical_current
+        else:
+            ratio = DEFAULT_COST_RATIO
+        if recent * ratio < RECOVERY_HEADROOM * self.budget_ms:
+            self._set_level(better_level, f"estimated {better}={recent * ratio:.0f}ms")
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "mode": self.mode,
+                "level": self.level,
+                "in_flight": self._in_flight,
+                "budget_ms": self.budget_ms,
+                "transitions": self.transitions,
+                "recent_p90_ms": {mode: self._p90(mode) for mode in EXPLANATION_MODES},
+                "typical_ms": dict(self._typical),
+            }
+
+
+def request_deadline(timeout_ms: float | None = None) -> float | None:
+    """
+    Absolute deadline (time.monotonic()) for a request: the caller's
+    timeout, capped by max_request_budget_ms, or the configured default.
+    """
+    budget_ms = settings.request_budget_ms
+    if timeout_ms is not None and timeout_ms > 0:
+        budget_ms = min(timeout_ms, settings.max_request_budget_ms)
+    if not budget_ms:
+        return None
+    return time.monotonic() + budget_ms / 1000
+
+
+# Global instance
+degradation_controller = DegradationController(
+    budget_ms=settings.explain_latency_budget_ms,
+    max_in_flight=settings.degradation_max_in_flight,
+    window=settings.degradation_window,
+    cooldown_sec=settings.degradation_cooldown_sec,
+    enabled=settings.adaptive_degradation,
+)
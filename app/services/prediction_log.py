@@ -0,0 +1,112 @@
+"""
+Журнал предсказаний (JSONL) для аудита и воспроизведения трафика
+"""
+import json
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def summarize_explanation(clinical_explanation: list) -> list:
+    """Compact, language-independent view of the explanation for diffing."""
+    return [
+        {
+            "key": item["key"],
+            "raw_direction": item["raw_direction"],
+            "shap_value": item.get("shap_value"),
+        }
+        for item in clinical_explanation
+    ]
+
+
+class PredictionLogger:
+    """
+    Appends one JSON record per served prediction.
+
+    The record keeps the validated input and what was returned to the
+    caller, so the same traffic can later be replayed through a changed
+    pipeline (see app/replay_traffic.py).
+
+    The input and the explanation are health data: they are only written
+    when the user consented to storing them (same rule as the Google
+    Sheets log). Without consent the record keeps request metadata, the
+    risk category and latency only, and replay skips it.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def record(self, patient, result: dict, latency_ms: float, source: str = "api",
+               consent: bool = False):
+        if not self.enabled:
+            return
+
+        audit = result.get("audit") or {}
+        entry = {
+            "request_id": audit.get("request_id"),
+            "timestamp": audit.get("timestamp"),
+            "model_version": audit.get("model_version"),
+            "source": source,
+            "consent": consent,
+            "risk_category": result.get("risk_category"),
+            "latency_ms": round(latency_ms, 2),
+            # How the explanation was produced, for a like-for-like replay
+            "explanation_mode": result.get("explanation_mode"),
+            "explain_status": (result.get("pipeline_status") or {}).get("explain"),
+            "explain_trace": result.get("explain_trace"),
+        }
+        if consent:
+            entry.update({
+                "patient": patient.model_dump(),
+                "risk_probability": result.get("risk_probability"),
+                "explanation": summarize_explanation(result.get("clinical_explanation", [])),
+            })
+        line = json.dumps(entry, ensure_ascii=False)
+
+        try:
+            with self._lock:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except OSError as e:
+            logger.error(f"Failed to write prediction log: {e}")
+
+
+def iter_prediction_records(path, since: datetime | None = None, limit: int | None = None):
+    """
+    Streams records from a prediction log, skipping malformed lines.
+    """
+    count = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping malformed prediction log line {line_no}")
+                continue
+
+            if since is not None and record.get("timestamp"):
+                if datetime.fromisoformat(record["timestamp"]) < since:
+                    continue
+
+            yield record
+            count += 1
+            if limit is not None and count >= limit:
+                return
+
+
+# Global instance
+prediction_logger = PredictionLogger(settings.prediction_log_path or None)
@@ -0,0 +1,171 @@
+"""
+Маршрутизация предсказаний на региональные модели (WHO регионы)
+"""
+import logging
+import threading
+from collections import OrderedDict, deque
+from pathlib import Path
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.model_registry import load_bundle, model_registry
+from app.model_loader import MODEL_PATH, METRICS_PATH
+from app.shap_explainer import BACKGROUND_PATH
+
+logger = logging.getLogger(__name__)
+
+WHO_REGIONS = ("AFR", "AMR", "SEAR", "EUR", "EMR", "WPR")
+
+LATENCY_WINDOW = 256
+
+
+class RegionStats:
+    __slots__ = ("requests", "region_hits", "fallbacks", "loads", "evictions", "latencies")
+
+    def __init__(self):
+        self.requests = 0
+        self.region_hits = 0
+        self.fallbacks = 0
+        self.loads = 0
+        self.evictions = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def as_dict(self) -> dict:
+        latencies = np.asarray(self.latencies, dtype=float)
+        return {
+            "requests": self.requests,
+            "region_model_hits": self.region_hits,
+            "global_fallbacks": self.fallbacks,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "latency_ms_p50": float(np.percentile(latencies, 50)) if latencies.size else None,
+            "latency_ms_p95": float(np.percentile(latencies, 95)) if latencies.size else None,
+        }
+
+
+class RegionModelRouter:
+    """
+    Chooses the model bundle for a patient's WHO region.
+
+    A region is served by its own model when `<models_dir>/<REGION>/` holds
+    an `improved_catboost.cbm` (plus optional `model_metrics.json` with its
+    own threshold and `shap_background_catboost_clean.csv`); otherwise the
+    global bundle from the registry is used. Region bundles are loaded on
+    first use and kept in a bounded LRU, so memory does not grow with the
+    number of regions that have models on disk.
+    """
+
+    def __init__(self, registry, models_dir, capacity: int = 2):
+        self.registry = registry
+        self.models_dir = Path(models_dir)
+        self.capacity = max(capacity, 0)
+
+        self._bundles = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._stats = {}
+
+    def _region_stats(self, region: str) -> RegionStats:
+        stats = self._stats.get(region)
+        if stats is None:
+            stats = self._stats.setdefault(region, RegionStats())
+        return stats
+
+    @staticmethod
+    def normalize(region) -> str | None:
+        code = (region or "").strip().upper()
+        return code if code in WHO_REGIONS else None
+
+    def region_paths(self, region: str) -> dict:
+        region_dir = self.models_dir / region
+        background = region_dir / BACKGROUND_PATH.name
+        return {
+            "model_path": region_dir / MODEL_PATH.name,
+            "background_path": background if background.exists() else BACKGROUND_PATH,
+            "metrics_path": region_dir / METRICS_PATH.name,
+        }
+
+    def resolve(self, region):
+        """
+        Returns (bundle, route_key). route_key is the region code when a
+        regional model served the request, otherwise "global".
+        """
+        code = self.normalize(region)
+        stats = self._region_stats(code or "UNKNOWN")
+
+        with self._lock:
+            stats.requests += 1
+            bundle = self._bundles.get(code) if code else None
+            if bundle is not None:
+                self._bundles.move_to_end(code)
+                stats.region_hits += 1
+                return bundle, code
+
+        if code is None or self.capacity == 0:
+            return self._fallback(stats)
+
+        paths = self.region_paths(code)
+        if not paths["model_path"].exists():
+            return self._fallback(stats)
+
+        bundle = self._load(code, paths, stats)
+        if bundle is None:
+            return self._fallback(stats)
+
+        with self._lock:
+            stats.region_hits += 1
+        return bundle, code
+
+    def _fallback(self, stats: RegionStats):
+        with self._lock:
+            stats.fallbacks += 1
+        return self.registry.current, "global"
+
+    def _load(self, code: str, paths: dict, stats: RegionStats):
+        # One loader per region; concurrent requests for the same region wait for it
+        with self._lock:
+            load_lock = self._load_locks.setdefault(code, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                bundle = self._bundles.get(code)
+            if bundle is not None:
+                return bundle
+
+            try:
+                bundle = load_bundle(warm=False, **paths)
+            except Exception as e:
+                logger.error(f"Failed to load model for region {code}: {e}")
+                return None
+
+            with self._lock:
+                self._bundles[code] = bundle
+                stats.loads += 1
+                while len(self._bundles) > self.capacity:
+                    evicted, _ = self._bundles.popitem(last=False)
+                    self._region_stats(evicted).evictions += 1
+                    logger.info(f"Evicted model for region {evicted}")
+            logger.info(f"Loaded model for region {code}: {bundle.version}")
+            return bundle
+
+    def record_latency(self, region, latency_ms: float):
+        stats = self._region_stats(self.normalize(region) or "UNKNOWN")
+        with self._lock:
+            stats.latencies.append(latency_ms)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "loaded_regions": list(self._bundles.keys()),
+                "regions": {region: stats.as_dict() for region, stats in self._stats.items()},
+            }
+
+
+# Global instance
+region_router = RegionModelRouter(
+    model_registry,
+    settings.region_models_dir,
+    capacity=settings.region_model_cache_size,
+)
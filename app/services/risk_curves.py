@@ -0,0 +1,158 @@
+"""
+Кривые риска для графиков фронтенда: риск vs возраст / систолическое АД / ИМТ
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.model_registry import model_registry
+from app.features import DAYS_PER_YEAR, MODEL_FEATURES, as_features, compute_bmi
+
+logger = logging.getLogger(__name__)
+
+COLUMN = {name: j for j, name in enumerate(MODEL_FEATURES)}
+
+# curve -> x range (age in years, ap_hi in mmHg, BMI in kg/m²)
+CURVE_RANGES = {
+    "age": (18, 90),
+    "ap_hi": (90, 200),
+    "bmi": (16.0, 45.0),
+}
+CURVES = tuple(CURVE_RANGES)
+WEIGHT_BOUNDS = (30, 250)  # PatientInput weight bounds
+
+
+def _sweep(features, curve: str, points: int) -> tuple:
+    """(x values, feature matrix) for one curve; other features stay at the patient's values."""
+    lo, hi = CURVE_RANGES[curve]
+    x = np.linspace(lo, hi, points)
+    if curve in ("age", "ap_hi"):
+        x = np.unique(np.round(x))
+    if curve == "ap_hi":
+        x = x[x > features.ap_lo]  # PatientInput: systolic above diastolic
+
+    matrix = np.repeat(features.vector, len(x), axis=0)
+    if curve == "age":
+        matrix[:, COLUMN["age"]] = x * DAYS_PER_YEAR
+    elif curve == "ap_hi":
+        matrix[:, COLUMN["ap_hi"]] = x
+    else:
+        # BMI is moved through weight at the patient's height
+        weight = x * (features.height / 100) ** 2
+        keep = (weight >= WEIGHT_BOUNDS[0]) & (weight <= WEIGHT_BOUNDS[1])
+        x, matrix = x[keep], matrix[keep]
+        matrix[:, COLUMN["weight"]] = weight[keep]
+        matrix[:, COLUMN["bmi"]] = compute_bmi(weight[keep], features.height)
+    return x, matrix
+
+
+def compute_risk_curves(features, model, curves=CURVES, points: int = 25) -> dict:
+    """
+    One-dimensional sweeps of the patient's risk. All curves are stacked
+    into one matrix and scored with a single predict_proba call.
+    """
+    sweeps = [_sweep(features, curve, points) for curve in curves]
+    matrix = np.vstack([features.vector] + [m for _, m in sweeps])
+    proba = model.predict_proba(matrix)[:, 1]
+
+    result = {"base_risk_probability": round(float(proba[0]), 4), "curves": {}}
+    offset = 1
+    for curve, (x, m) in zip(curves, sweeps):
+        current = features.age_years if curve == "age" else getattr(features, curve)
+        result["curves"][curve] = {
+            "x": [round(float(v), 2) for v in x],
+            "risk": [round(float(p), 4) for p in proba[offset:offset + len(m)]],
+            "current": round(float(current), 2),
+        }
+        offset += len(m)
+    return result
+
+
+class RiskCurveCache:
+    """
+    LRU of computed curves keyed on (model version, canonical patient
+    vector, curves, points). The canonical vector is the model feature row
+    (BMI rounded), so inputs that differ only in non-model fields such as
+    language share an entry. Entries of a replaced model are dropped on the
+    registry's swap notification.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = max(capacity, 0)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(version: str, features, curves, points: int) -> tuple:
+        vector = features.vector[0].copy()
+        vector[COLUMN["bmi"]] = round(vector[COLUMN["bmi"]], 2)
+        return version, tuple(vector.tolist()), tuple(curves), points
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.capacity == 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def drop_version(self, version: str) -> int:
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == version]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def on_model_swap(self, bundle, previous):
+        if previous is not None and previous.version != bundle.version:
+            dropped = self.drop_version(previous.version)
+            logger.info(f"Risk curve cache: dropped {dropped} entries of {previous.version}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "capacity": self.capacity,
+                    "hits": self.hits, "misses": self.misses}
+
+
+def risk_curves(patient, bundle, curves=None, points: int = 25) -> dict:
+    """Cached risk curves for a patient on the given model bundle."""
+    curves = tuple(curves or CURVES)
+    features = as_features(patient)
+    key = risk_curve_cache.key(bundle.version, features, curves, points)
+
+    cached = risk_curve_cache.get(key)
+    if cached is None:
+        cached = compute_risk_curves(features, bundle.model, curves, points)
+        risk_curve_cache.put(key, cached)
+        hit = False
+    else:
+        hit = True
+
+    return {
+        **cached,
+        "threshold": bundle.high_risk_threshold,
+        "points": points,
+        "model_version": bundle.version,
+        "cached": hit,
+    }
+
+
+# Global instance
+risk_curve_cache = RiskCurveCache(settings.risk_curve_cache_size)
+model_registry.subscribe(risk_curve_cache.on_model_swap)
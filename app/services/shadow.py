@@ -0,0 +1,172 @@
+"""
+Shadow-оценка модели-кандидата рядом с продакшн-моделью
+"""
+import logging
+import queue
+import random
+import threading
+import time
+from pathlib import Path
+
+from catboost import CatBoostClassifier
+
+from app.core.config import settings
+from app.model_loader import METRICS_PATH, load_training_metrics
+from app.risk_logic import HIGH_RISK_THRESHOLD, categorize_risk
+
+logger = logging.getLogger(__name__)
+
+
+class ShadowEvaluator:
+    """
+    Scores a sampled fraction of live traffic with a candidate model.
+
+    Requests only enqueue their feature vector; scoring happens on a single
+    background thread, so the response path never waits on the candidate.
+    The worker throttles itself to `cpu_budget` of one core and the queue is
+    bounded: when the candidate cannot keep up, samples are dropped rather
+    than buffered.
+
+    The candidate replaces the global model, so only requests served by it
+    are compared (region-routed ones are counted and skipped). Each side is
+    categorized with its own threshold: the live bundle's, and the
+    candidate's `threshold_90_sens` from the model_metrics.json next to it.
+    """
+
+    def __init__(self, model_path: str, sample_rate: float = 0.1,
+                 cpu_budget: float = 0.25, queue_size: int = 64):
+        self.model_path = Path(model_path)
+        self.sample_rate = sample_rate
+        self.cpu_budget = min(max(cpu_budget, 0.01), 1.0)
+
+        self.model = CatBoostClassifier()
+        self.model.load_model(self.model_path)
+        self.threshold = float(
+            load_training_metrics(self.model_path.parent / METRICS_PATH.name).get(
+                "threshold_90_sens", HIGH_RISK_THRESHOLD
+            )
+        )
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._reset_counters()
+
+        self._thread = threading.Thread(target=self._run, name="shadow-evaluator", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Shadow model loaded from {self.model_path} "
+            f"(threshold={self.threshold:.3f}, sample_rate={sample_rate})"
+        )
+
+    def _reset_counters(self):
+        self.scored = 0
+        self.skipped_regional = 0
+        self.live_versions = {}
+        self.dropped = 0
+        self.errors = 0
+        self.flips = 0
+        self.transitions = {}
+        self.abs_delta_sum = 0.0
+        self.max_abs_delta = 0.0
+        self.busy_sec = 0.0
+
+    def submit(self, features, live_probability: float, live_threshold: float,
+               live_version: str, route: str = "global"):
+        """
+        Non-blocking: samples the request and hands it to the worker.
+        `features` is the request's model vector, `live_probability` the
+        unrounded probability of the bundle that served it.
+        """
+        if route != "global":
+            with self._lock:
+                self.skipped_regional += 1
+            return
+        if random.random() >= self.sample_rate:
+            return
+        try:
+            self._queue.put_nowait((features, live_probability, live_threshold, live_version))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _run(self):
+        while True:
+            features, live_probability, live_threshold, live_version = self._queue.get()
+            started = time.perf_counter()
+            try:
+                shadow_probability = float(
+                    self.model.predict_proba(features, thread_count=1)[0, 1]
+                )
+                self._record(live_probability, live_threshold, live_version, shadow_probability)
+            except Exception as e:
+                logger.error(f"Shadow scoring failed: {e}")
+                with self._lock:
+                    self.errors += 1
+            busy = time.perf_counter() - started
+
+            with self._lock:
+                self.busy_sec += busy
+            # Idle long enough that busy / (busy + idle) <= cpu_budget
+            time.sleep(busy * (1.0 / self.cpu_budget - 1.0))
+
+    def _record(self, live_probability: float, live_threshold: float, live_version: str,
+                shadow_probability: float):
+        live_category = categorize_risk(live_probability, live_threshold)
+        shadow_category = categorize_risk(shadow_probability, self.threshold)
+        delta = abs(shadow_probability - live_probability)
+
+        with self._lock:
+            self.scored += 1
+            self.live_versions[live_version] = self.live_versions.get(live_version, 0) + 1
+            self.abs_delta_sum += delta
+            self.max_abs_delta = max(self.max_abs_delta, delta)
+            if live_category != shadow_category:
+                self.flips += 1
+                key = f"{live_category}->{shadow_category}"
+                self.transitions[key] = self.transitions.get(key, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            scored = self.scored
+            return {
+                "enabled": True,
+                "candidate_model": str(self.model_path),
+                "candidate_threshold": self.threshold,
+                "sample_rate": self.sample_rate,
+                "cpu_budget": self.cpu_budget,
+                "scored": scored,
+                "live_versions": dict(self.live_versions),
+                "skipped_regional": self.skipped_regional,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "queue_depth": self._queue.qsize(),
+                "category_flip_rate": self.flips / scored if scored else None,
+                "category_transitions": dict(self.transitions),
+                "mean_abs_probability_delta": self.abs_delta_sum / scored if scored else None,
+                "max_abs_probability_delta": self.max_abs_delta if scored else None,
+                "mean_shadow_latency_ms": self.busy_sec * 1000 / scored if scored else None,
+            }
+
+    def reset(self):
+        with self._lock:
+            self._reset_counters()
+
+
+def create_shadow_evaluator():
+    if not settings.shadow_model_path:
+        return None
+    try:
+        return ShadowEvaluator(
+            settings.shadow_model_path,
+            sample_rate=settings.shadow_sample_rate,
+            cpu_budget=settings.shadow_cpu_budget,
+            queue_size=settings.shadow_queue_size,
+        )
+    except Exception as e:
+        # A broken candidate must never take the live service down
+        logger.error(f"Failed to start shadow evaluator: {e}")
+        return None
+
+
+# Global instance (None when shadow mode is disabled)
+shadow_evaluator = create_shadow_evaluator()
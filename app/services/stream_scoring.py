@@ -0,0 +1,270 @@
+"""
+Потоковый скоринг NDJSON: пациенты построчно на входе, результаты построчно на выходе
+"""
+import asyncio
+import json
+import logging
+import tempfile
+import time
+
+import anyio
+
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+
+from app.core.config import settings
+from app.clinical_rules import evaluate_rules, flags_from_batch
+from app.features import FeatureBatch
+from app.localization import t
+from app.risk_logic import assess_prediction_confidence, categorize_risk_batch
+from app.schemas import PatientInput
+from app.services.region_router import region_router
+
+logger = logging.getLogger(__name__)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class ResultSpool:
+    """
+    FIFO byte buffer between the scoring loop and the response writer.
+
+    Holds up to `memory_bytes` in RAM and spills the rest to a temporary
+    file, so a client that uploads everything before reading (most HTTP
+    libraries) does not deadlock the stream and server memory stays
+    bounded. Above `max_bytes` pending, the writer side waits, which in
+    turn stops reading the upload (TCP backpressure).
+    """
+
+    def __init__(self, memory_bytes: int, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._file = tempfile.SpooledTemporaryFile(max_size=memory_bytes)
+        self._read_pos = 0
+        self._write_pos = 0
+        self._closed = False
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    @property
+    def pending(self) -> int:
+        return self._write_pos - self._read_pos
+
+    async def write(self, data: bytes):
+        while self.pending >= self.max_bytes:
+            self._writable.clear()
+            await self._writable.wait()
+        self._file.seek(self._write_pos)
+        self._file.write(data)
+        self._write_pos += len(data)
+        self._readable.set()
+
+    def close(self):
+        self._closed = True
+        self._readable.set()
+
+    async def read(self, size: int = 1 << 16) -> bytes:
+        """Next bytes in order; b"" once closed and drained."""
+        while not self.pending:
+            if self._closed:
+                self._file.close()
+                return b""
+            self._readable.clear()
+            await self._readable.wait()
+        self._file.seek(self._read_pos)
+        data = self._file.read(min(size, self.pending))
+        self._read_pos += len(data)
+        if not self.pending:
+            # Caught up: reuse the buffer from the start
+            self._read_pos = self._write_pos = 0
+            self._file.seek(0)
+            self._file.truncate()
+        self._writable.set()
+        return data
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse whose body iterator reads the request body.
+
+    The stock response listens for a client disconnect by calling
+    receive(), which would swallow body chunks; here the body iterator is
+    the only reader and sees a disconnect itself (ClientDisconnect).
+    Results go through a ResultSpool, so producing them never waits on a
+    client that is still uploading.
+    """
+
+    def __init__(self, content, media_type: str | None = None,
+                 spool_memory_bytes: int = 8 << 20, spool_max_bytes: int = 512 << 20):
+        super().__init__(content, media_type=media_type)
+        self.spool_memory_bytes = spool_memory_bytes
+        self.spool_max_bytes = spool_max_bytes
+
+    async def __call__(self, scope, receive, send):
+        spool = ResultSpool(self.spool_memory_bytes, self.spool_max_bytes)
+
+        async def produce():
+            try:
+                async for chunk in self.body_iterator:
+                    await spool.write(chunk if isinstance(chunk, bytes) else chunk.encode(self.charset))
+            finally:
+                spool.close()
+
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(produce)
+            while data := await spool.read():
+                await send({"type": "http.response.body", "body": data, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+        if self.background is not None:
+            await self.background()
+
+
+async def iter_ndjson_lines(chunks, max_line_bytes: int):
+    """
+    Splits a byte stream into lines. Yields (line_no, bytes | None, end_of_chunk);
+    None marks a line longer than `max_line_bytes` (its bytes are dropped,
+    never buffered). `end_of_chunk` is set on the last line of each received chunk.
+    """
+    buffer = b""
+    line_no = 0
+    oversized = False
+
+    async for chunk in chunks:
+        lines = (buffer + chunk).split(b"\n")
+        buffer = lines.pop()
+        complete = []
+        for raw in lines:
+            line_no += 1
+            if oversized or len(raw) > max_line_bytes:
+                complete.append((line_no, None))
+                oversized = False
+            elif raw.strip():
+                complete.append((line_no, raw))
+        if len(buffer) > max_line_bytes:
+            buffer = b""
+            oversized = True
+        for i, (number, raw) in enumerate(complete):
+            yield number, raw, i == len(complete) - 1
+
+    if oversized or buffer.strip():
+        line_no += 1
+        yield line_no, (None if oversized else buffer), True
+
+
+def parse_line(raw: bytes):
+    """Returns (patient, client_id) or raises ValueError / ValidationError."""
+    payload = json.loads(raw)
+    if not isinstance(payload, dict):
+        raise ValueError("Each line must be a JSON object")
+    return PatientInput.model_validate(payload), payload.get("id")
+
+
+def error_entry(line_no: int, error: Exception | str) -> dict:
+    if isinstance(error, ValidationError):
+        detail = [{"loc": list(e["loc"]), "msg": e["msg"]} for e in error.errors()]
+        return {"line": line_no, "error": "validation_error", "detail": detail}
+    if isinstance(error, json.JSONDecodeError):
+        return {"line": line_no, "error": "invalid_json", "detail": error.msg}
+    return {"line": line_no, "error": "invalid_line", "detail": str(error)}
+
+
+def score_patients(patients: list) -> list:
+    """
+    Scores one micro-batch. Patients are grouped by model route (region),
+    each group is scored with one predict_proba call and vectorized rules.
+    Explanations are not computed here; use /api/predict for SHAP.
+    """
+    results = [None] * len(patients)
+    routes = {}
+    for i, patient in enumerate(patients):
+        routes.setdefault(region_router.normalize(patient.region), []).append(i)
+
+    for region, indices in routes.items():
+        bundle, _ = region_router.resolve(region)
+        batch = FeatureBatch.from_patients(patients[i] for i in indices)
+        proba = bundle.model.predict_proba(batch.matrix)[:, 1]
+        categories = categorize_risk_batch(proba, bundle.high_risk_threshold)
+        bits = evaluate_rules(batch, groups=("condition", "sanity", "ood"))
+        conditions = flags_from_batch(bits, "condition")
+        sanity = flags_from_batch(bits, "sanity")
+        ood = flags_from_batch(bits, "ood")
+
+        for k, i in enumerate(indices):
+            probability = float(proba[k])
+            confidence = assess_prediction_confidence(probability, bundle.high_risk_threshold)["confidence_level"]
+            warnings = sanity[k] + ood[k] + (["low_confidence"] if confidence == "low" else [])
+            lang = patients[i].ui_language
+            results[i] = {
+                "risk_probability": round(probability, 3),
+                "risk_category": str(categories[k]),
+                "risk_label": t(lang, "risk_category", str(categories[k])),
+                "confidence_level": confidence,
+                "clinical_conditions": conditions[k],
+                "safety_flags": warnings,
+                "model_version": bundle.version,
+            }
+    return results
+
+
+async def score_ndjson(chunks, batch_size: int | None = None, max_line_bytes: int | None = None):
+    """
+    Async generator of NDJSON result lines for an NDJSON upload.
+
+    Lines are collected into micro-batches of up to `batch_size` entries
+    (a batch is also flushed at the end of each received network chunk, so
+    slow uploads get results promptly). At most one micro-batch of input is
+    held in memory; the next chunk is read only after the previous batch was
+    handed to the response (see ResultSpool). Invalid lines produce an
+    inline error entry and do not stop the stream. The last line is a summary.
+    """
+    batch_size = batch_size or settings.stream_batch_size
+    max_line_bytes = max_line_bytes or settings.max_request_size
+    started = time.perf_counter()
+    stats = {"lines": 0, "scored": 0, "errors": 0}
+
+    entries = []  # (line_no, patient, client_id) or (line_no, error_dict)
+
+    async def flush():
+        patients = [entry[1] for entry in entries if len(entry) == 3]
+        scored = iter(await run_in_threadpool(score_patients, patients)) if patients else iter(())
+        out = []
+        for entry in entries:
+            if len(entry) == 3:
+                line_no, _, client_id = entry
+                result = {"line": line_no, **next(scored)}
+                if client_id is not None:
+                    result["id"] = client_id
+                stats["scored"] += 1
+            else:
+                result = entry[1]
+                stats["errors"] += 1
+            out.append(json.dumps(result, ensure_ascii=False))
+        entries.clear()
+        return ("\n".join(out) + "\n").encode("utf-8")
+
+    try:
+        async for line_no, raw, end_of_chunk in iter_ndjson_lines(chunks, max_line_bytes):
+            stats["lines"] += 1
+            if raw is None:
+                entries.append((line_no, error_entry(line_no, f"Line exceeds {max_line_bytes} bytes")))
+            else:
+                try:
+                    patient, client_id = parse_line(raw)
+                    entries.append((line_no, patient, client_id))
+                except (ValueError, ValidationError) as e:
+                    entries.append((line_no, error_entry(line_no, e)))
+
+            if len(entries) >= batch_size or end_of_chunk:
+                yield await flush()
+        if entries:
+            yield await flush()
+    except ClientDisconnect:
+        logger.warning(f"NDJSON stream aborted by client after {stats['lines']} lines")
+        return
+
+    stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    yield (json.dumps({"summary": stats}) + "\n").encode("utf-8")
@@ -0,0 +1,112 @@
+"""
+What-if сценарии: риск пациента при изменении образа жизни / показателей одним батчем
+"""
+import logging
+
+from pydantic import ValidationError
+
+from app.features import FeatureBatch
+from app.localization import t
+from app.risk_logic import categorize_risk_batch
+from app.schemas import PatientInput
+from app.shap_explainer import explain_patient
+from app.shap_interpreter import interpret_shap_batch
+from app.shap_lookup import shap_lookup
+
+logger = logging.getLogger(__name__)
+
+
+class ScenarioError(ValueError):
+    """A scenario produced an invalid patient (e.g. ap_hi below ap_lo)."""
+
+    def __init__(self, index: int, errors: list):
+        super().__init__(f"Scenario {index} is not a valid patient")
+        self.index = index
+        self.errors = errors
+
+
+def apply_scenario(patient: PatientInput, scenario, index: int = 0) -> tuple:
+    """
+    Returns (variant PatientInput, {field: new value}). The variant goes
+    through the same validation as a /predict input; BMI is recomputed.
+    """
+    data = patient.model_dump()
+    for field, value in scenario.changes.items():
+        data[field] = value
+    for field, delta in scenario.deltas.items():
+        data[field] = data[field] + delta
+    data["bmi"] = None
+
+    try:
+        variant = PatientInput.model_validate(data)
+    except ValidationError as e:
+        errors = [{"loc": list(err["loc"]), "msg": err["msg"]} for err in e.errors()]
+        raise ScenarioError(index, errors)
+
+    touched = list(scenario.changes) + [f for f in scenario.deltas if f not in scenario.changes]
+    changes = {field: getattr(variant, field) for field in touched}
+    return variant, changes
+
+
+def evaluate_what_if(patient: PatientInput, scenarios: list, bundle, lang: str,
+                     explanation_mode: str = "full", explain_base: bool = False) -> dict:
+    """
+    Scores the base patient and every scenario with one predict_proba call
+    on a stacked feature matrix. SHAP runs (again as one batch) only for the
+    scenarios with `explain` set, and not at all in "rules" mode; in
+    "lookup" mode the explained rows take precomputed dataset SHAP.
+    """
+    applied = [apply_scenario(patient, scenario, i) for i, scenario in enumerate(scenarios)]
+    batch = FeatureBatch.from_patients([patient] + [variant for variant, _ in applied])
+
+    proba = bundle.model.predict_proba(batch.matrix)[:, 1]
+    categories = categorize_risk_batch(proba, bundle.high_risk_threshold)
+
+    explain_rows = ([0] if explain_base else []) + [
+        i + 1 for i, scenario in enumerate(scenarios) if scenario.explain
+    ]
+    explanations = {}
+    # Missing cheaper explainers fall back downward, never to full SHAP
+    if explanation_mode == "summary" and bundle.summary_explainer is None:
+        explanation_mode = "lookup"
+    lookup = shap_lookup.for_version(bundle.version) if explanation_mode == "lookup" else None
+    if explanation_mode == "lookup" and lookup is None:
+        explanation_mode = "rules"
+    if explain_rows and explanation_mode != "rules":
+        matrix = batch.matrix[explain_rows]
+        if lookup is not None:
+            shap_values = lookup.explain_batch(matrix)
+        else:
+            explainer = bundle.summary_explainer if explanation_mode == "summary" else bundle.shap_explainer
+            shap_values = explain_patient(explainer, matrix)
+        interpretation = interpret_shap_batch(shap_values, FeatureBatch(matrix))
+        for k, row in enumerate(explain_rows):
+            explanations[row] = interpretation.render(k, lang, bundle.model_metrics)
+
+    base_probability = float(proba[0])
+    results = []
+    for i, (scenario, (variant, changes)) in enumerate(zip(scenarios, applied), start=1):
+        probability = float(proba[i])
+        results.append({
+            "name": scenario.name,
+            "changes": changes,
+            "risk_probability": round(probability, 3),
+            "risk_category": str(categories[i]),
+            "risk_label": t(lang, "risk_category", str(categories[i])),
+            "delta": round(probability - base_probability, 3),
+            "relative_change": round((probability - base_probability) / base_probability, 3)
+            if base_probability > 0 else None,
+            "category_changed": bool(categories[i] != categories[0]),
+            "patient_bmi": variant.bmi,
+            "clinical_explanation": explanations.get(i),
+        })
+
+    return {
+        "base_risk_probability": round(base_probability, 3),
+        "base_risk_category": str(categories[0]),
+        "base_risk_label": t(lang, "risk_category", str(categories[0])),
+        "base_explanation": explanations.get(0),
+        "scenarios": results,
+        "explanation_mode": explanation_mode,
+        "model_version": bundle.version,
+    }
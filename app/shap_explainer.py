@@ -1,25 +1,27 @@
+import time
 import shap
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from catboost import CatBoostClassifier
 
+from app.features import MODEL_FEATURES, compute_bmi
+
 
 BACKGROUND_PATH = Path("model/shap_background_catboost_clean.csv")
 
 
-def load_background_data():
+def load_background_data(background_path=BACKGROUND_PATH):
     """Загружает background данные для SHAP объяснений"""
-    if not BACKGROUND_PATH.exists():
+    background_path = Path(background_path)
+    if not background_path.exists():
         raise FileNotFoundError(
-            f"SHAP background data not found at {BACKGROUND_PATH.resolve()}"
+            f"SHAP background data not found at {background_path.resolve()}"
         )
-    df = pd.read_csv(BACKGROUND_PATH)
+    df = pd.read_csv(background_path)
     
     # Выбираем только релевантные признаки для модели
-    relevant_features = [
-        'age', 'gender', 'height', 'weight', 'ap_hi', 'ap_lo', 
-        'cholesterol', 'gluc', 'smoke', 'alco', 'active', 'bmi'
-    ]
+    relevant_features = list(MODEL_FEATURES)
     
     # Проверяем, что все необходимые признаки присутствуют
     # Note: background file might still have 'index' etc, we just ignore them by selecting relevant_features
@@ -31,7 +33,7 @@ def load_background_data():
     if missing_features:
         # If bmi is missing, try to calculate it
         if 'bmi' in missing_features and 'weight' in df.columns and 'height' in df.columns:
-             df['bmi'] = df['weight'] / ((df['height'] / 100) ** 2)
+             df['bmi'] = compute_bmi(df['weight'], df['height'])
              missing_features.remove('bmi')
         
     if missing_features:
@@ -40,9 +42,32 @@ def load_background_data():
     return df[relevant_features]
 
 
-def create_shap_explainer(model):
+def summarize_background(background_df: pd.DataFrame, size: int) -> pd.DataFrame:
+    """
+    Сжимает background до `size` репрезентативных строк (медоиды k-means).
+
+    Берутся реальные строки, ближайшие к центрам кластеров, а не сами
+    центры: категориальные признаки (smoke, gluc, ...) остаются целыми.
+    """
+    if size >= len(background_df):
+        return background_df
+
+    from sklearn.cluster import KMeans
+
+    values = background_df.values.astype(float)
+    scaled = (values - values.mean(axis=0)) / (values.std(axis=0) + 1e-9)
+    kmeans = KMeans(n_clusters=size, n_init=4, random_state=0).fit(scaled)
+    distances = ((scaled[:, None, :] - kmeans.cluster_centers_[None, :, :]) ** 2).sum(axis=2)
+    medoids = np.unique(distances.argmin(axis=0))
+    return background_df.iloc[medoids].reset_index(drop=True)
+
+
+def create_shap_explainer(model, background_path=BACKGROUND_PATH, background_size: int | None = None):
     """
     Создает оптимизированный SHAP explainer для CatBoost модели.
+
+    background_size: если задан, background сжимается до этого числа строк
+    (быстрый режим для работы под нагрузкой, см. app/services/degradation.py).
     """
     # Получаем базовую модель (может быть обернута в CalibratedClassifierCV)
     base_model = model
@@ -59,7 +84,9 @@ def create_shap_explainer(model):
     
     if not is_catboost:
         # Fallback для других типов моделей
-        background_df = load_background_data()
+        background_df = load_background_data(background_path)
+        if background_size:
+            background_df = summarize_background(background_df, background_size)
         explainer = shap.Explainer(
             lambda x: model.predict_proba(
                 pd.DataFrame(x, columns=background_df.columns)
@@ -69,7 +96,9 @@ def create_shap_explainer(model):
         return explainer
     
     # Оптимизированный TreeExplainer для CatBoost
-    background_df = load_background_data()
+    background_df = load_background_data(background_path)
+    if background_size:
+        background_df = summarize_background(background_df, background_size)
     
     # Используем общий Explainer с lambda функцией для предсказаний
     explainer = shap.Explainer(
@@ -113,6 +142,127 @@ def explain_patient(explainer, patient_df: pd.DataFrame):
     """
     return explainer(patient_df)
 
+
+# Permutations evaluated per explainer call in progressive mode
+PERMUTATION_CHUNK = 4
+# Assumed cost of one permutation before anything was measured (first
+# request, after a reload or a mode change); ~2x the warm full-background cost
+DEFAULT_PERMUTATION_MS = 10.0
+
+
+def _permutation_chunk(explainer, patient_features, permutations: int, seed: int | None) -> np.ndarray:
+    """
+    `permutations` проходов permutation SHAP для одной строки.
+
+    Same arithmetic as shap.explainers.Permutation.explain_row (shap 0.51),
+    but the orderings come from a RandomState private to this call: the
+    explainer itself shuffles with the global np.random, which every other
+    (unseeded) SHAP call in the process also draws from, so a seed set there
+    does not survive concurrent requests. RandomState(seed) draws the same
+    orderings as np.random.seed(seed) did, so logged seeds still replay.
+    Returns the (n_features, n_outputs) values.
+    """
+    from shap.utils import MaskedModel
+
+    rng = np.random.RandomState(None if seed is None else seed % 2 ** 32)
+    row = np.asarray(patient_features)[0]
+    fm = MaskedModel(explainer.model, explainer.masker, explainer.link, explainer.linearize_link, row)
+    # Explainer.__call__ resolves batch_size="auto" the same way
+    batch_size = getattr(explainer.masker, "default_batch_size", 10)
+
+    inds = fm.varying_inputs()
+    if len(inds) == 0:
+        # Patient identical to the background in every feature: nothing to attribute
+        outputs = fm(np.zeros(1, dtype=int), zero_index=0, batch_size=1)
+        return np.zeros((len(fm),) + outputs.shape[1:])
+
+    masks = np.zeros(2 * len(inds) + 1, dtype=int)
+    masks[0] = MaskedModel.delta_mask_noop_value
+    row_values = None
+    for _ in range(permutations):
+        rng.shuffle(inds)
+        masks[1:len(inds) + 1] = inds
+        masks[len(inds) + 1:] = inds
+        outputs = fm(masks, zero_index=0, batch_size=batch_size)
+        if row_values is None:
+            row_values = np.zeros((len(fm),) + outputs.shape[1:])
+        n = len(inds)
+        # Forward pass adds features one by one, backward removes them again
+        row_values[inds] += outputs[1:n + 1] - outputs[:n]
+        row_values[inds] += outputs[n:2 * n] - outputs[n + 1:2 * n + 1]
+    return row_values / (2 * permutations)
+
+
+def explain_patient_progressive(explainer, patient_features, deadline: float | None,
+                                max_evals: int = 500, estimate_ms: float | None = None,
+                                seed: int | None = None, schedule=None):
+    """
+    Permutation SHAP в несколько проходов с ограничением по времени.
+
+    Перестановки считаются порциями по PERMUTATION_CHUNK и усредняются;
+    перед каждой порцией проверяется, укладывается ли она до `deadline`
+    (time.monotonic(); None - без ограничения). Стоимость перестановки
+    берется из `estimate_ms` (типичное время полного объяснения), затем из
+    фактических замеров. Без оценки первая порция - одна пробная
+    перестановка, и только если до deadline есть DEFAULT_PERMUTATION_MS.
+
+    With `seed`, the chunk starting at permutation `done` draws its
+    orderings from RandomState(seed + done), so the result depends only on
+    the seed and the chunk sizes, whatever else runs in the process. `schedule` (the chunk sizes of an earlier
+    run) replays exactly those chunks, ignoring the deadline; this is how
+    app/replay_traffic.py reproduces a served explanation.
+
+    Returns:
+        (shap_dict | None, permutations_done, permutations_planned, chunk_sizes)
+    """
+    evals_per_permutation = 2 * patient_features.shape[1] + 1
+    planned = max(1, max_evals // evals_per_permutation)
+    per_permutation_ms = estimate_ms / planned if estimate_ms else None
+
+    done = 0
+    chunks = []
+    total = None
+    feature_names = explainer.feature_names or list(MODEL_FEATURES)
+    while done < planned:
+        if schedule is not None:
+            if len(chunks) == len(schedule):
+                break
+            chunk = schedule[len(chunks)]
+        else:
+            chunk = min(PERMUTATION_CHUNK, planned - done)
+            if deadline is not None:
+                remaining_ms = (deadline - time.monotonic()) * 1000
+                if per_permutation_ms is not None:
+                    chunk = min(chunk, int(remaining_ms // per_permutation_ms))
+                else:
+                    # Unknown cost: a one-permutation probe measures it
+                    chunk = 1 if remaining_ms >= DEFAULT_PERMUTATION_MS else 0
+        if chunk <= 0:
+            break
+
+        started = time.perf_counter()
+        values = _permutation_chunk(
+            explainer, patient_features, chunk, None if seed is None else seed + done
+        )
+        per_permutation_ms = (time.perf_counter() - started) * 1000 / chunk
+
+        if values.ndim == 2:
+            values = values[:, 1]
+        total = values * chunk if total is None else total + values * chunk
+        done += chunk
+        chunks.append(chunk)
+
+    if done == 0:
+        return None, 0, planned, chunks
+
+    mean_values = total / done
+    return (
+        {feature: float(value) for feature, value in zip(feature_names, mean_values)},
+        done,
+        planned,
+        chunks,
+    )
+
 FEATURE_LABELS = {
     "ap_hi": "Systolic blood pressure",
     "ap_lo": "Diastolic blood pressure",
@@ -1,6 +1,8 @@
 import numpy as np
 from .localization import LOCALIZATION
 from .clinical_expectations import CLINICAL_FACTOR_RISK
+from .features import MODEL_FEATURES, FeatureBatch, as_features
+from .clinical_rules import evaluate_rules, flags_from_bits, flag_matrix
 
 CLINICAL_ONLY_FEATURES = {
     "cholesterol"
@@ -16,7 +18,14 @@ def interpret_shap(
     """
     Преобразует SHAP значения в клин. интерпретируемые факторы.
     Приоритет отдается медицинской логике (патологическим порогам).
+
+    `patient_data` is a PatientInput or a PatientFeatures record; values are
+    read in model units (age in days, derived BMI).
     """
+    features = as_features(patient_data)
+    pathological = set(flags_from_bits(
+        evaluate_rules(features, groups=("pathological",)), "pathological"
+    ))
 
     if hasattr(shap_values, "values") and hasattr(shap_values, "feature_names"):
         values = shap_values.values
@@ -42,24 +51,10 @@ def interpret_shap(
         if feature in CLINICAL_ONLY_FEATURES:
             continue
 
-        if feature == "age":
-            # Map 'age' feature (usually days) to patient data
-            val = getattr(patient_data, "age_years", None)
-            if val is not None:
-                val = val * 365.25 # Convert to days for pathological check
-        else:
-            val = getattr(patient_data, feature, None)
+        val = getattr(features, feature, None)
         
-        # 1. Принудительные патологические пороги (Medical Ground Truth)
-        is_pathological = False
-        if feature == "ap_hi" and val is not None and val >= 140: is_pathological = True
-        elif feature == "ap_lo" and val is not None and val >= 90: is_pathological = True
-        elif feature == "gluc" and val is not None and val > 1: is_pathological = True
-        elif feature == "smoke" and val == 1: is_pathological = True
-        elif feature == "alco" and val == 1: is_pathological = True
-        elif feature == "active" and val == 0: is_pathological = True
-        elif feature == "bmi" and val is not None and val >= 30: is_pathological = True
-        elif feature == "age" and val is not None and val >= 21900: is_pathological = True # 60 years * 365
+        # 1. Принудительные патологические пороги (Medical Ground Truth, app/clinical_rules.py)
+        is_pathological = feature in pathological
 
         # 2. Фильтрация
         # Важные факторы (патология или сильное влияние) оставляем
@@ -124,3 +119,132 @@ def interpret_shap(
                     break
 
     return explanations
+
+
+# -------------------------
+# BATCH INTERPRETATION
+# -------------------------
+
+# Clinical cut-offs for borderline values (same as the scalar branch above)
+CLINICAL_CUTOFFS = {"ap_hi": 135, "ap_lo": 85, "age": 55, "bmi": 25}
+ABSENT_WHEN_AT_MOST_ONE = ("smoke", "alco", "gluc")
+
+INCREASES, REDUCES = 1, -1
+
+
+class BatchShapInterpretation:
+    """
+    Array form of interpret_shap for N patients.
+
+    `keep`, `pathological` are (N, 12) bool, `direction` is (N, 12) int8
+    (+1 increases / -1 reduces) and `adjusted` holds the UI-synchronized
+    SHAP values. Localized text is produced only by render().
+    """
+
+    __slots__ = ("feature_names", "shap_values", "adjusted", "direction", "keep", "pathological")
+
+    def __init__(self, feature_names, shap_values, adjusted, direction, keep, pathological):
+        self.feature_names = feature_names
+        self.shap_values = shap_values
+        self.adjusted = adjusted
+        self.direction = direction
+        self.keep = keep
+        self.pathological = pathological
+
+    def __len__(self):
+        return self.shap_values.shape[0]
+
+    def render(self, i: int, lang: str, model_metrics: dict = None) -> list:
+        """Row i as the list interpret_shap would return."""
+        shap_factors = LOCALIZATION[lang]["shap_factors"]
+        directions = LOCALIZATION[lang]["directions"]
+
+        explanations = []
+        for j in np.flatnonzero(self.keep[i]):
+            feature = self.feature_names[j]
+            feature_loc = shap_factors.get(feature)
+            if not feature_loc:
+                continue
+            direction_key = "increases" if self.direction[i, j] == INCREASES else "reduces"
+            explanations.append({
+                "key": feature,
+                "factor": feature_loc["name"],
+                "direction": directions.get(direction_key, direction_key),
+                "raw_direction": direction_key,
+                "shap_value": float(self.adjusted[i, j]),
+                "clinical_note": feature_loc["note"]
+            })
+
+        if model_metrics:
+            precision = model_metrics.get('precision', 0.5)
+            if isinstance(precision, (int, float)) and precision < 0.6:
+                for exp in explanations:
+                    if exp['raw_direction'] == 'increases':
+                        exp['clinical_note'] += f" {LOCALIZATION[lang]['metric_warnings'].get('low_precision', '')}"
+                        break
+
+        return explanations
+
+    def render_all(self, lang: str, model_metrics: dict = None) -> list:
+        return [self.render(i, lang, model_metrics) for i in range(len(self))]
+
+
+def _shap_matrix(shap_values) -> np.ndarray:
+    values = shap_values.values if hasattr(shap_values, "values") and hasattr(shap_values, "feature_names") else shap_values
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 3:
+        values = values[:, :, 1]
+    if values.ndim != 2 or values.shape[1] != len(MODEL_FEATURES):
+        raise ValueError(f"Unsupported SHAP matrix shape: {values.shape}")
+    return values
+
+
+def interpret_shap_batch(shap_values, features: FeatureBatch, threshold: float = 0.05) -> BatchShapInterpretation:
+    """
+    Vectorized interpret_shap: (N, 12) SHAP matrix (columns in MODEL_FEATURES
+    order, or an Explanation / (N, 12, 2) array) plus the matching
+    FeatureBatch. Gives the same factors, directions and values per row.
+    """
+    values = _shap_matrix(shap_values)
+    if values.shape[0] != len(features):
+        raise ValueError(f"{values.shape[0]} SHAP rows for {len(features)} patients")
+    column = {feature: j for j, feature in enumerate(MODEL_FEATURES)}
+    x = features.matrix
+
+    # 1. Патологические пороги из таблицы правил
+    keys, path_flags = flag_matrix(evaluate_rules(features, groups=("pathological",)), "pathological")
+    pathological = np.zeros(values.shape, dtype=bool)
+    pathological[:, [column[key] for key in keys]] = path_flags
+
+    # 2. Фильтрация
+    keep = pathological | (np.abs(values) >= threshold)
+    for feature in CLINICAL_ONLY_FEATURES:
+        keep[:, column[feature]] = False
+
+    # 3-4. Направление: модель, затем клиническая коррекция (порядок приоритета как в interpret_shap)
+    direction = np.where(values > 0, INCREASES, REDUCES).astype(np.int8)
+    for feature, cutoff in CLINICAL_CUTOFFS.items():
+        j = column[feature]
+        direction[:, j] = np.where(x[:, j] >= cutoff, INCREASES, REDUCES)
+    for feature in ABSENT_WHEN_AT_MOST_ONE:
+        j = column[feature]
+        direction[:, j] = np.where(x[:, j] <= 1, REDUCES, direction[:, j])
+    j = column["active"]
+    direction[:, j] = np.where(x[:, j] == 1, REDUCES, direction[:, j])
+    direction[pathological] = INCREASES
+
+    # 5. Синхронизация значения SHAP с клиническим направлением
+    adjusted = values.copy()
+    flip_up = (direction == INCREASES) & (values < 0)
+    flip_down = (direction == REDUCES) & (values > 0)
+    adjusted[flip_up] = np.maximum(0.05, np.abs(values[flip_up]))
+    adjusted[flip_down] = np.minimum(-0.05, -np.abs(values[flip_down]))
+
+    return BatchShapInterpretation(
+        feature_names=MODEL_FEATURES,
+        shap_values=values,
+        adjusted=adjusted,
+        direction=direction,
+        keep=keep,
+        pathological=pathological,
+    )
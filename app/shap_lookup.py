@@ -0,0 +1,311 @@
+"""
+Приближённые SHAP объяснения по таблице: SHAP ближайших пациентов датасета.
+
+Offline step: CatBoost's exact TreeSHAP (ShapValues, log-odds scale) is
+computed for every row of the cleaned dataset and rescaled to the
+probability scale the served permutation explainer uses: each row's
+log-odds contributions are multiplied by the secant slope of the sigmoid
+between the model's expected value and the row's logit, so they sum to
+p(x) - sigmoid(expected value) and never change sign. The (N, 12) float32
+matrix is saved as `shap-<build>.npy` (named by the manifest) and
+memory-mapped at request time.
+
+Neighbours come from the similar-patient KD-tree (app/similar_patients.py)
+whose global row ids follow the same cleaned-dataset order; the manifest
+records its shard fingerprints and the lookup refuses a mismatched index.
+An explanation is the inverse-distance blend of the k nearest rows, a
+{feature: value} dict that interpret_shap takes unchanged. (Rescaling the
+blend to the patient's own p(x) - base was tried and roughly doubled the
+error against exact SHAP: neighbour sums near zero blow the scale up.)
+
+The build also writes a fidelity report against exact (permutation) SHAP
+on a sample of rows, each explained from its neighbours without itself.
+
+Usage:
+    python -m app.shap_lookup                     # build + fidelity report
+    python -m app.shap_lookup --sample 500 --neighbors 5
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+from catboost import Pool
+
+from app.columnar import load_clean_frame, publish_manifest, save_mapped_array
+from app.core.config import settings
+from app.core.model_registry import model_registry
+from app.dataset import DATA_PATH, FEATURE_COLUMNS
+from app.features import MODEL_FEATURES, FeatureBatch
+from app.model_loader import MODEL_PATH, compute_model_hash, describe_model_version, load_model
+from app.shap_explainer import BACKGROUND_PATH, create_shap_explainer, load_background_data
+from app.shap_interpreter import interpret_shap_batch
+from app.similar_patients import (
+    INDEX_DIR as SIMILAR_INDEX_DIR,
+    SimilarPatientIndex,
+    build_index as build_similar_index,
+    similar_patient_index,
+)
+
+logger = logging.getLogger(__name__)
+
+LOOKUP_DIR = Path("data/shap_lookup")
+SHAP_STEM = "shap"
+# Table file of lookups built before the manifest named it
+LEGACY_SHAP_NAME = "shap.npy"
+MANIFEST_NAME = "manifest.json"
+FIDELITY_NAME = "fidelity.json"
+
+DEFAULT_NEIGHBORS = 5
+# Features whose exact |SHAP| is at least this count for sign agreement
+# (same cut-off interpret_shap uses to show a factor)
+SIGNIFICANT_SHAP = 0.05
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def probability_scale_shap(model, matrix: np.ndarray) -> tuple:
+    """
+    Exact TreeSHAP rescaled to probabilities. Returns ((N, 12) values,
+    sigmoid(expected value)) with values[i].sum() == p_i - sigmoid(ev).
+    """
+    raw = model.get_feature_importance(Pool(matrix), type="ShapValues")
+    contributions, expected = raw[:, :-1], raw[:, -1]
+    logit = contributions.sum(axis=1) + expected
+    span = logit - expected
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = np.where(
+            np.abs(span) > 1e-9,
+            (_sigmoid(logit) - _sigmoid(expected)) / span,
+            _sigmoid(expected) * (1 - _sigmoid(expected)),
+        )
+    return contributions * slope[:, None], float(_sigmoid(expected[0]))
+
+
+class ShapLookup:
+    """
+    Read side. Loaded lazily on first use; serves only the model version
+    it was built for and only with the neighbour index it was built on.
+    reload() re-reads the table on next use; it runs on every model swap
+    and from POST /api/indexes/reload (after a rebuild).
+    """
+
+    def __init__(self, lookup_dir=LOOKUP_DIR, index: SimilarPatientIndex = None,
+                 neighbors: int = DEFAULT_NEIGHBORS):
+        self.lookup_dir = Path(lookup_dir)
+        self.index = index if index is not None else similar_patient_index
+        self.neighbors = neighbors
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._table = None  # (manifest, values)
+
+    def _load(self):
+        if self._loaded:
+            return self._table
+        with self._lock:
+            if self._loaded:
+                return self._table
+            self._table = self._read()
+            self._loaded = True
+            return self._table
+
+    def _read(self):
+        manifest_path = self.lookup_dir / MANIFEST_NAME
+        if not manifest_path.exists():
+            logger.info(f"No SHAP lookup table at {self.lookup_dir}")
+            return None
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            values_path = self.lookup_dir / manifest.get("array", LEGACY_SHAP_NAME)
+            values = np.asarray(np.load(values_path, mmap_mode="r"))
+        except Exception as e:
+            logger.error(f"Failed to load SHAP lookup table from {self.lookup_dir}: {e}")
+            return None
+        if manifest["index_fingerprints"] != self.index.fingerprints:
+            logger.warning("SHAP lookup table was built on another similar-patient index; rebuild it")
+            return None
+        return manifest, values
+
+    def reload(self):
+        with self._lock:
+            self._loaded = False
+
+    def on_model_swap(self, bundle, previous):
+        if previous is not None and previous.version != bundle.version:
+            self.reload()
+
+    @property
+    def model_version(self) -> str | None:
+        table = self._load()
+        return table[0]["model_version"] if table else None
+
+    def for_version(self, model_version: str):
+        """self when the table matches `model_version`, else None."""
+        return self if self.model_version == model_version else None
+
+    def explain_batch(self, matrix: np.ndarray, k: int | None = None, exclude_rows=None) -> np.ndarray:
+        """
+        (n, 12) approximate SHAP for model vectors `matrix`. `exclude_rows`
+        (one dataset row id per input, or None) drops that row from its
+        own neighbours, which the fidelity report uses.
+        """
+        _, values = self._load()
+        k = k or self.neighbors
+        extra = 1 if exclude_rows is not None else 0
+        distances, rows = self.index.nearest(matrix, k + extra)
+        if exclude_rows is not None:
+            keep = rows != np.asarray(exclude_rows)[:, None]
+            # Drop the excluded row (or the farthest one when it was not found)
+            keep[keep.all(axis=1), -1] = False
+            distances = distances[keep].reshape(len(rows), k)
+            rows = rows[keep].reshape(len(rows), k)
+
+        weights = 1.0 / (distances + 1e-6)
+        weights /= weights.sum(axis=1, keepdims=True)
+        return np.einsum("nk,nkf->nf", weights, values[rows].astype(np.float64))
+
+    def explain(self, features) -> dict:
+        """{feature: SHAP value} for one PatientFeatures record, for interpret_shap."""
+        values = self.explain_batch(features.vector)[0]
+        return {feature: float(value) for feature, value in zip(MODEL_FEATURES, values)}
+
+
+def _agreement(approx: np.ndarray, exact: np.ndarray, batch: FeatureBatch) -> dict:
+    """Error and agreement of approximate vs exact SHAP rows."""
+    abs_error = np.abs(approx - exact)
+    top = 3
+    top_exact = np.argsort(-np.abs(exact), axis=1)[:, :top]
+    top_approx = np.argsort(-np.abs(approx), axis=1)[:, :top]
+    overlap = np.mean([len(set(a) & set(e)) / top for a, e in zip(top_approx, top_exact)])
+    significant = np.abs(exact) >= SIGNIFICANT_SHAP
+    signs = np.sign(approx[significant]) == np.sign(exact[significant])
+
+    # What the user sees: the factors interpret_shap renders, and their directions
+    rendered_exact = interpret_shap_batch(exact, batch)
+    rendered_approx = interpret_shap_batch(approx, batch)
+    same_factors = [
+        [(f["key"], f["raw_direction"]) for f in rendered_approx.render(i, "en")]
+        == [(f["key"], f["raw_direction"]) for f in rendered_exact.render(i, "en")]
+        for i in range(len(batch))
+    ]
+    return {
+        "mae": round(float(abs_error.mean()), 5),
+        "relative_l1": round(float(abs_error.sum() / np.abs(exact).sum()), 4),
+        "top3_overlap": round(float(overlap), 4),
+        "sign_agreement": round(float(signs.mean()), 4) if signs.size else None,
+        "rendered_factors_identical": round(float(np.mean(same_factors)), 4),
+    }
+
+
+def fidelity_report(lookup: ShapLookup, model, df, table: np.ndarray, background_path=BACKGROUND_PATH,
+                    sample: int = 300, neighbors: int = DEFAULT_NEIGHBORS, seed: int = 0) -> dict:
+    """
+    Compares against the served exact explainer on `sample` dataset rows:
+    the row's own table entry (rescaling error only), its nearest other
+    row, and the k-neighbour blend (what the API serves).
+    """
+    rows = np.sort(np.random.default_rng(seed).choice(len(df), size=min(sample, len(df)), replace=False))
+    batch = FeatureBatch(FeatureBatch.from_frame(df).matrix[rows])
+
+    explainer = create_shap_explainer(model, background_path)
+    started = time.perf_counter()
+    exact = np.asarray(explainer(batch.matrix, silent=True).values)[:, :, 1]
+    exact_ms = (time.perf_counter() - started) * 1000 / len(rows)
+
+    started = time.perf_counter()
+    blend = lookup.explain_batch(batch.matrix, k=neighbors, exclude_rows=rows)
+    lookup_ms = (time.perf_counter() - started) * 1000 / len(rows)
+    nearest = lookup.explain_batch(batch.matrix, k=1, exclude_rows=rows)
+
+    return {
+        "sample": len(rows),
+        "neighbors": neighbors,
+        "exact_ms_per_patient": round(exact_ms, 2),
+        "lookup_ms_per_patient": round(lookup_ms, 4),
+        "own_row": _agreement(table[rows].astype(np.float64), exact, batch),
+        "nearest": _agreement(nearest, exact, batch),
+        "blend": _agreement(blend, exact, batch),
+    }
+
+
+def build_lookup(data_path=DATA_PATH, model_path=MODEL_PATH, output_dir=LOOKUP_DIR,
+                 index_dir=SIMILAR_INDEX_DIR, background_path=BACKGROUND_PATH,
+                 sample: int = 300, neighbors: int = DEFAULT_NEIGHBORS) -> dict:
+    """
+    Writes the SHAP table, manifest and fidelity report. Updates the
+    neighbour index first. Safe while the API serves the lookup level: the
+    table goes to a new file and the manifest naming it is swapped in last.
+    """
+    model_path, output_dir = Path(model_path), Path(output_dir)
+    build_similar_index(data_path, index_dir)
+    index = SimilarPatientIndex(index_dir)
+
+    model = load_model(model_path)
+    df = load_clean_frame(data_path).reset_index(drop=True)
+    started = time.perf_counter()
+    table, expected_probability = probability_scale_shap(model, df[FEATURE_COLUMNS].to_numpy(dtype=np.float64))
+
+    # Base value of the served explainer: mean model output over its background
+    background = load_background_data(background_path)
+    base_value = float(model.predict_proba(background.to_numpy(dtype=np.float64))[:, 1].mean())
+
+    table_name = save_mapped_array(output_dir, SHAP_STEM, table.astype(np.float32))
+    manifest = {
+        "array": table_name,
+        "model_version": describe_model_version(compute_model_hash(model_path)),
+        "index_fingerprints": index.fingerprints,
+        "patients": len(df),
+        "features": list(MODEL_FEATURES),
+        "base_value": base_value,
+        "tree_expected_probability": expected_probability,
+        "build_sec": round(time.perf_counter() - started, 2),
+        "built_at": datetime.now(timezone.utc).isoformat(),
+    }
+    publish_manifest(output_dir, MANIFEST_NAME, manifest, SHAP_STEM)
+
+    lookup = ShapLookup(output_dir, index=index, neighbors=neighbors)
+    report = fidelity_report(lookup, model, df, table, background_path, sample, neighbors)
+    report["model_version"] = manifest["model_version"]
+    with open(output_dir / FIDELITY_NAME, "w") as f:
+        json.dump(report, f, indent=2)
+    return {"manifest": manifest, "fidelity": report}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute dataset SHAP for approximate explanations")
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--model", default=str(MODEL_PATH))
+    parser.add_argument("--output", default=str(LOOKUP_DIR))
+    parser.add_argument("--index", default=str(SIMILAR_INDEX_DIR), help="Similar-patient index directory")
+    parser.add_argument("--sample", type=int, default=300, help="Rows compared with exact SHAP")
+    parser.add_argument("--neighbors", type=int, default=DEFAULT_NEIGHBORS)
+    args = parser.parse_args()
+
+    result = build_lookup(args.data, args.model, args.output, args.index,
+                          sample=args.sample, neighbors=args.neighbors)
+    manifest, report = result["manifest"], result["fidelity"]
+    print(f"SHAP table for {manifest['patients']} patients in {manifest['build_sec']}s")
+    print(f"Fidelity on {report['sample']} rows (exact {report['exact_ms_per_patient']} ms, "
+          f"lookup {report['lookup_ms_per_patient']} ms per patient):")
+    for name in ("own_row", "nearest", "blend"):
+        row = report[name]
+        print(f"  {name:8} MAE {row['mae']:.4f}  rel.L1 {row['relative_l1']:.3f}  "
+              f"top-3 {row['top3_overlap']:.2f}  sign {row['sign_agreement']}  "
+              f"same factors {row['rendered_factors_identical']:.2f}")
+    print(f"SHAP lookup saved to {args.output}")
+
+
+# Global instance
+shap_lookup = ShapLookup(settings.shap_lookup_dir, neighbors=settings.shap_lookup_neighbors)
+model_registry.subscribe(shap_lookup.on_model_swap)
+
+
+if __name__ == "__main__":
+    main()
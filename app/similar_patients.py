@@ -0,0 +1,274 @@
+"""
+Похожие пациенты из референсной когорты: k ближайших соседей и их частота исходов.
+
+The cleaned dataset is standardized (mean/std of each model feature) and
+split into fixed-size shards in dataset order; every shard gets its own
+sklearn KDTree, saved with joblib next to a manifest. Builds are
+incremental: a shard whose rows hash to the same fingerprint as in the
+manifest is kept, so appending rows to the CSV only rebuilds the last
+shard and adds new ones. The scaler is kept from the first build (a
+change of it, of the cleaning rules or --rebuild rebuilds every shard).
+
+The API loads the shards lazily on the first query, never at startup.
+A query searches every shard and merges the per-shard top-k.
+
+Usage:
+    python -m app.similar_patients                # build / update the index
+    python -m app.similar_patients --rebuild
+"""
+import argparse
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import joblib
+import numpy as np
+from sklearn.neighbors import KDTree
+
+from app.columnar import load_clean_frame
+from app.core.config import settings
+from app.dataset import DATA_PATH, FEATURE_COLUMNS, TARGET_COLUMN, cleaning_fingerprint
+from app.features import DAYS_PER_YEAR, MODEL_FEATURES, as_features
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = Path("data/similar_patients")
+MANIFEST = "manifest.json"
+SHARD_SIZE = 65536  # few large shards: each extra tree adds ~0.1 ms per query
+LEAF_SIZE = 40
+
+COLUMN = {name: j for j, name in enumerate(MODEL_FEATURES)}
+
+
+def shard_fingerprint(features: np.ndarray, labels: np.ndarray) -> str:
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(features, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(labels, dtype=np.int8).tobytes())
+    return digest.hexdigest()
+
+
+def read_manifest(index_dir=INDEX_DIR) -> dict:
+    path = Path(index_dir) / MANIFEST
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def build_index(data_path=DATA_PATH, index_dir=INDEX_DIR, shard_size: int = SHARD_SIZE,
+                leaf_size: int = LEAF_SIZE, rebuild: bool = False) -> dict:
+    """Builds new or changed shards and drops stale ones. Returns the manifest."""
+    index_dir = Path(index_dir)
+    started = time.perf_counter()
+    df = load_clean_frame(data_path)
+    features = df[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+    labels = df[TARGET_COLUMN].to_numpy().astype(np.int8)
+
+    previous = {} if rebuild else read_manifest(index_dir)
+    cleaning = cleaning_fingerprint()
+    if previous.get("cleaning") != cleaning or previous.get("shard_size") != shard_size:
+        previous = {}
+    if previous:
+        mean, std = np.asarray(previous["scaler"]["mean"]), np.asarray(previous["scaler"]["std"])
+    else:
+        mean, std = features.mean(axis=0), features.std(axis=0)
+        std[std == 0] = 1.0
+    old_shards = previous.get("shards", [])
+
+    index_dir.mkdir(parents=True, exist_ok=True)
+    shards, built, reused = [], 0, 0
+    for i, start in enumerate(range(0, len(features), shard_size)):
+        rows = features[start:start + shard_size]
+        outcome = labels[start:start + shard_size]
+        fingerprint = shard_fingerprint(rows, outcome)
+        name = f"shard-{i:04d}.joblib"
+        old = old_shards[i] if i < len(old_shards) else None
+        if old and old["fingerprint"] == fingerprint and (index_dir / name).exists():
+            shards.append(old)
+            reused += 1
+            continue
+        tree = KDTree((rows - mean) / std, leaf_size=leaf_size)
+        joblib.dump({"tree": tree, "rows": rows.astype(np.float32), "labels": outcome}, index_dir / name)
+        shards.append({"file": name, "rows": len(rows), "fingerprint": fingerprint})
+        built += 1
+
+    for stale in old_shards[len(shards):]:
+        (index_dir / stale["file"]).unlink(missing_ok=True)
+
+    manifest = {
+        "cleaning": cleaning,
+        "features": FEATURE_COLUMNS,
+        "scaler": {"mean": mean.tolist(), "std": std.tolist()},
+        "shard_size": shard_size,
+        "leaf_size": leaf_size,
+        "patients": len(features),
+        "outcome_rate": round(float(labels.mean()), 4),
+        "shards": shards,
+        "built_shards": built,
+        "reused_shards": reused,
+        "built_at": datetime.now(timezone.utc).isoformat(),
+        "build_sec": round(time.perf_counter() - started, 3),
+    }
+    with open(index_dir / MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=4)
+    return manifest
+
+
+class SimilarPatientIndex:
+    """
+    Read side: lazily loaded shards, k-NN over all of them. reload() (from
+    POST /api/indexes/reload after a rebuild) re-reads them on the next
+    query; manifest, scaler and shards are replaced together.
+    """
+
+    def __init__(self, index_dir=INDEX_DIR):
+        self.index_dir = Path(index_dir)
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._index = ({}, [], None, None)  # (manifest, shards, mean, std)
+
+    def _load(self) -> tuple:
+        if self._loaded:
+            return self._index
+        with self._lock:
+            if self._loaded:
+                return self._index
+            manifest = read_manifest(self.index_dir)
+            shards = []
+            try:
+                for shard in manifest.get("shards", []):
+                    shards.append(joblib.load(self.index_dir / shard["file"]))
+            except Exception as e:
+                logger.error(f"Failed to load similar-patient index from {self.index_dir}: {e}")
+                manifest, shards = {}, []
+            mean = std = None
+            if manifest:
+                mean = np.asarray(manifest["scaler"]["mean"])
+                std = np.asarray(manifest["scaler"]["std"])
+            self._index = (manifest, shards, mean, std)
+            self._loaded = True
+            return self._index
+
+    def reload(self):
+        with self._lock:
+            self._loaded = False
+
+    @property
+    def available(self) -> bool:
+        return bool(self._load()[1])
+
+    @property
+    def fingerprints(self) -> list:
+        """Shard fingerprints: identify the row order that global row ids refer to."""
+        manifest = self._load()[0]
+        return [shard["fingerprint"] for shard in manifest.get("shards", [])]
+
+    def nearest(self, vectors: np.ndarray, k: int) -> tuple:
+        """
+        (distances, global row ids), each (n, k), for raw model vectors (n, 12).
+        Row ids index the cleaned dataset in load_clean_frame order.
+        """
+        _, shards, mean, std = self._load()
+        points = (np.atleast_2d(vectors) - mean) / std
+        distances, rows, offset = [], [], 0
+        for shard in shards:
+            dist, idx = shard["tree"].query(points, k=min(k, len(shard["labels"])))
+            distances.append(dist)
+            rows.append(idx + offset)
+            offset += len(shard["labels"])
+        distances, rows = np.hstack(distances), np.hstack(rows)
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(rows, order, axis=1)
+
+    def query(self, patient, k: int = 20, include_neighbors: bool = False) -> dict | None:
+        """
+        Outcome rate and summary of the k nearest reference patients.
+        None when no index has been built.
+        """
+        manifest, shards, mean, std = self._load()
+        if not shards:
+            return None
+        point = (as_features(patient).vector - mean) / std
+
+        distances, rows, labels = [], [], []
+        for shard in shards:
+            dist, idx = shard["tree"].query(point, k=min(k, len(shard["labels"])))
+            distances.append(dist[0])
+            rows.append(shard["rows"][idx[0]])
+            labels.append(shard["labels"][idx[0]])
+        distances = np.concatenate(distances)
+        nearest = np.argsort(distances, kind="stable")[:k]
+        distances = distances[nearest]
+        rows = np.concatenate(rows)[nearest].astype(np.float64)
+        labels = np.concatenate(labels)[nearest]
+
+        # One column-wise pass; gender is 1/2, so its mean - 1 is the male share
+        means = rows.mean(axis=0)
+        elevated = (rows[:, [COLUMN["cholesterol"], COLUMN["gluc"]]] > 1).mean(axis=0)
+        result = {
+            "k": len(nearest),
+            "outcome_rate": round(float(labels.mean()), 3),
+            "cohort_outcome_rate": manifest["outcome_rate"],
+            "mean_distance": round(float(distances.mean()), 3),
+            "max_distance": round(float(distances[-1]), 3),
+            "summary": {
+                "age_years_mean": round(float(means[COLUMN["age"]] / DAYS_PER_YEAR), 1),
+                "male_share": round(float(means[COLUMN["gender"]] - 1), 3),
+                "ap_hi_mean": round(float(means[COLUMN["ap_hi"]]), 1),
+                "ap_lo_mean": round(float(means[COLUMN["ap_lo"]]), 1),
+                "bmi_mean": round(float(means[COLUMN["bmi"]]), 1),
+                "smoke_share": round(float(means[COLUMN["smoke"]]), 3),
+                "active_share": round(float(means[COLUMN["active"]]), 3),
+                "high_cholesterol_share": round(float(elevated[0]), 3),
+                "high_glucose_share": round(float(elevated[1]), 3),
+            },
+            "neighbors": None,
+        }
+        if include_neighbors:
+            # Anonymized: no ids, age in whole years, BMI rounded
+            result["neighbors"] = [
+                {
+                    "age_years": int(row[COLUMN["age"]] // DAYS_PER_YEAR),
+                    "gender": int(row[COLUMN["gender"]]),
+                    "ap_hi": int(row[COLUMN["ap_hi"]]),
+                    "ap_lo": int(row[COLUMN["ap_lo"]]),
+                    "bmi": round(float(row[COLUMN["bmi"]]), 1),
+                    "cholesterol": int(row[COLUMN["cholesterol"]]),
+                    "gluc": int(row[COLUMN["gluc"]]),
+                    "smoke": int(row[COLUMN["smoke"]]),
+                    "alco": int(row[COLUMN["alco"]]),
+                    "active": int(row[COLUMN["active"]]),
+                    "cardio": int(label),
+                    "distance": round(float(distance), 3),
+                }
+                for row, label, distance in zip(rows, labels, distances)
+            ]
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or update the similar-patient KD-tree index")
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--output", default=str(INDEX_DIR))
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--leaf-size", type=int, default=LEAF_SIZE)
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild every shard and refit the scaler")
+    args = parser.parse_args()
+
+    manifest = build_index(args.data, args.output, args.shard_size, args.leaf_size, args.rebuild)
+    print(f"{manifest['patients']} patients in {len(manifest['shards'])} shards: "
+          f"{manifest['built_shards']} built, {manifest['reused_shards']} reused "
+          f"({manifest['build_sec']}s)")
+    print(f"Similar-patient index saved to {args.output}")
+
+
+# Global instance
+similar_patient_index = SimilarPatientIndex(settings.similar_index_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,118 @@
+"""
+Аудит клинических парадоксов: монотонность модели по CLINICAL_FACTOR_RISK на всём датасете.
+
+Every clinically expected direction in CLINICAL_FACTOR_RISK becomes a
+counterfactual perturbation (smoke 0→1, gluc 1→3, active 1→0, systolic
+BP +20 mmHg, ...). Each perturbation is applied to every patient of the
+cleaned dataset at once (NumPy column edits on the feature matrix, rows
+where it does not apply or leaves the training ranges are skipped). Base
+and counterfactual batches go through the model in a single
+predict_proba call. A paradox is a risk change against the expected
+direction. Rates are reported per factor and per subgroup (sex, age
+decade, BMI band), plus the reference 45-year-old patient of the
+original stress test.
+
+Usage:
+    python -m app.stress_test_clinical_paradoxes --output model/clinical_paradoxes.json
+"""
+import argparse
+import json
+import time
 
 import numpy as np
 import pandas as pd
-from catboost import CatBoostClassifier
-import json
 
-MODEL_PATH = "model/improved_catboost.cbm"
+from app.clinical_expectations import CLINICAL_FACTOR_RISK
+from app.columnar import load_clean_frame
+from app.dataset import (
+    AP_HI_RANGE,
+    AP_LO_RANGE,
+    BMI_RANGE,
+    DATA_PATH,
+    HEIGHT_RANGE,
+    WEIGHT_RANGE,
+)
+from app.features import DAYS_PER_YEAR, MODEL_FEATURES, FeatureBatch, compute_bmi
+from app.model_loader import MODEL_PATH, load_model
+from app.subgroups import add_audit_dimensions
+
+OUTPUT_PATH = "model/clinical_paradoxes.json"
+
+# Risk changes smaller than this are treated as no change
+DEFAULT_TOLERANCE = 0.001
+SUBGROUP_DIMENSIONS = ("sex", "age_decile", "bmi_band")
+
+COLUMN = {name: j for j, name in enumerate(MODEL_FEATURES)}
+
+
+class Perturbation:
+    """
+    Counterfactual change of one column for the factor `factor`:
+    `set` a value (only where the column equals `from_value`) or `add` a delta.
+    Changing height/weight recomputes BMI.
+    """
+
+    __slots__ = ("factor", "label", "column", "op", "value", "from_value")
+
+    def __init__(self, factor: str, label: str, column: str, op: str, value, from_value=None):
+        self.factor = factor
+        self.label = label
+        self.column = column
+        self.op = op
+        self.value = value
+        self.from_value = from_value
+
+    def apply(self, matrix: np.ndarray) -> tuple:
+        """(perturbed copy, mask of rows where the change applies and stays in the training ranges)"""
+        j = COLUMN[self.column]
+        perturbed = matrix.copy()
+        if self.op == "set":
+            applies = matrix[:, j] == self.from_value
+            perturbed[:, j] = self.value
+        else:
+            applies = np.ones(len(matrix), dtype=bool)
+            perturbed[:, j] += self.value
+        if self.column in ("height", "weight"):
+            perturbed[:, COLUMN["bmi"]] = compute_bmi(perturbed[:, COLUMN["weight"]], perturbed[:, COLUMN["height"]])
+        return perturbed, applies & within_training_ranges(perturbed)
+
+    @property
+    def expected_sign(self) -> int:
+        """+1 if risk should rise, -1 if it should fall."""
+        if self.op == "set":
+            value_sign = np.sign(self.value - self.from_value)
+        else:
+            value_sign = np.sign(self.value)
+        return int(value_sign) * (1 if CLINICAL_FACTOR_RISK[self.factor] == "increases" else -1)
+
+
+# One perturbation per non-neutral factor of CLINICAL_FACTOR_RISK
+PERTURBATIONS = (
+    Perturbation("smoke", "Smoking (0→1)", "smoke", "set", 1, from_value=0),
+    Perturbation("alco", "Alcohol (0→1)", "alco", "set", 1, from_value=0),
+    Perturbation("active", "Physical activity (1→0)", "active", "set", 0, from_value=1),
+    Perturbation("cholesterol", "Cholesterol (1→3)", "cholesterol", "set", 3, from_value=1),
+    Perturbation("gluc", "Glucose (1→3)", "gluc", "set", 3, from_value=1),
+    Perturbation("ap_hi", "Systolic BP (+20 mmHg)", "ap_hi", "add", 20),
+    Perturbation("ap_lo", "Diastolic BP (+10 mmHg)", "ap_lo", "add", 10),
+    Perturbation("age", "Age (+10 years)", "age", "add", round(10 * DAYS_PER_YEAR)),
+    Perturbation("bmi", "Weight (+10 kg)", "weight", "add", 10),
+)
+
+
+def within_training_ranges(matrix: np.ndarray) -> np.ndarray:
+    """Rows that would pass the training cleaning rules (app/dataset.py)."""
+    def between(name, bounds):
+        column = matrix[:, COLUMN[name]]
+        return (column >= bounds[0]) & (column <= bounds[1])
+
+    return (
+        between("ap_hi", AP_HI_RANGE) & between("ap_lo", AP_LO_RANGE)
+        & (matrix[:, COLUMN["ap_hi"]] > matrix[:, COLUMN["ap_lo"]])
+        & between("height", HEIGHT_RANGE) & between("weight", WEIGHT_RANGE)
+        & between("bmi", BMI_RANGE)
+    )
+
 
 def create_base_patient():
     """Returns a 'healthy' baseline patient: 45 years male, non-smoker, active, normal BP/gluc/chol."""
@@ -23,110 +131,147 @@ def create_base_patient():
         "bmi": 70 / (1.75**2)
     }
 
-def get_prediction(model, p_dict):
-    features = ['age', 'gender', 'height', 'weight', 'ap_hi', 'ap_lo', 'cholesterol', 'gluc', 'smoke', 'alco', 'active', 'bmi']
-    X = pd.DataFrame([p_dict])[features]
-    return float(model.predict_proba(X)[0, 1])
-
-def run_tests():
-    model = CatBoostClassifier()
-    model.load_model("c:/HomeWork/Medical/CVD_risk_Cat_Boost/cvd-risk-api/" + MODEL_PATH)
-    
-    base = create_base_patient()
-    base_risk = get_prediction(model, base)
-    
+
+def counterfactual_deltas(model, matrix: np.ndarray, perturbations=PERTURBATIONS) -> dict:
+    """
+    Runs base rows and every applicable counterfactual through one
+    predict_proba call. Returns {"base": base risks, factor: (row indices, risk deltas)}.
+    """
+    blocks, spans = [matrix], {}
+    offset = len(matrix)
+    for perturbation in perturbations:
+        perturbed, applies = perturbation.apply(matrix)
+        rows = np.flatnonzero(applies)
+        blocks.append(perturbed[rows])
+        spans[perturbation.factor] = (rows, offset)
+        offset += len(rows)
+
+    proba = model.predict_proba(np.vstack(blocks))[:, 1]
+    base = proba[:len(matrix)]
+    result = {"base": base}
+    for factor, (rows, start) in spans.items():
+        result[factor] = (rows, proba[start:start + len(rows)] - base[rows])
+    return result
+
+
+def audit_paradoxes(model, df: pd.DataFrame, tolerance: float = DEFAULT_TOLERANCE,
+                    perturbations=PERTURBATIONS, dimensions=SUBGROUP_DIMENSIONS, min_count: int = 30) -> dict:
+    """Paradox rates per factor and per factor x subgroup for a cleaned dataset frame."""
+    batch = FeatureBatch.from_frame(df)
+    deltas = counterfactual_deltas(model, batch.matrix, perturbations)
+    groups = add_audit_dimensions(df.reset_index(drop=True))[list(dimensions)]
+
+    frames = []
+    for perturbation in perturbations:
+        rows, delta = deltas[perturbation.factor]
+        signed = delta * perturbation.expected_sign
+        frames.append(groups.iloc[rows].assign(
+            factor=perturbation.factor,
+            delta=delta,
+            paradox=signed < -tolerance,
+            no_effect=np.abs(delta) <= tolerance,
+        ))
+    long = pd.concat(frames, ignore_index=True)
+
+    def summarize(grouped):
+        summary = grouped.agg(
+            patients=("delta", "size"),
+            paradoxes=("paradox", "sum"),
+            paradox_rate=("paradox", "mean"),
+            no_effect_rate=("no_effect", "mean"),
+            mean_delta=("delta", "mean"),
+            median_delta=("delta", "median"),
+            min_delta=("delta", "min"),
+            max_delta=("delta", "max"),
+        ).reset_index()
+        return summary[summary["patients"] >= min_count]
+
+    factors = {p.factor: p for p in perturbations}
+    overall = []
+    for row in summarize(long.groupby("factor", sort=False)).to_dict("records"):
+        perturbation = factors[row["factor"]]
+        overall.append({
+            "factor": row["factor"],
+            "perturbation": perturbation.label,
+            "expected": "increases" if perturbation.expected_sign > 0 else "reduces",
+            **_rounded(row, exclude=("factor",)),
+        })
+
+    by_subgroup = {}
+    for dimension in dimensions:
+        summary = summarize(long.groupby(["factor", dimension], sort=False))
+        by_subgroup[dimension] = [_rounded(row, exclude=("factor", dimension)) for row in summary.to_dict("records")]
+
+    return {
+        "patients": len(df),
+        "counterfactuals": len(long),
+        "tolerance": tolerance,
+        "mean_base_risk": round(float(deltas["base"].mean()), 4),
+        "factors": overall,
+        "by_subgroup": by_subgroup,
+    }
+
+
+def reference_patient_results(model, tolerance: float = DEFAULT_TOLERANCE, perturbations=PERTURBATIONS) -> list:
+    """The original single-patient stress test, with the same perturbations."""
+    matrix = FeatureBatch.from_frame(pd.DataFrame([create_base_patient()])).matrix
+    deltas = counterfactual_deltas(model, matrix, perturbations)
+    base_risk = float(deltas["base"][0])
     results = []
-    
-    # 1. Smoking
-    p_smoke = base.copy()
-    p_smoke['smoke'] = 1
-    smoke_risk = get_prediction(model, p_smoke)
-    results.append({
-        "factor": "Smoking",
-        "base_val": 0,
-        "test_val": 1,
-        "base_risk": base_risk,
-        "test_risk": smoke_risk,
-        "delta": smoke_risk - base_risk,
-        "is_paradox": (smoke_risk < base_risk)
-    })
-    
-    # 2. Glucose
-    p_gluc = base.copy()
-    p_gluc['gluc'] = 3 # Well above normal
-    gluc_risk = get_prediction(model, p_gluc)
-    results.append({
-        "factor": "Glucose (High)",
-        "base_val": 1,
-        "test_val": 3,
-        "base_risk": base_risk,
-        "test_risk": gluc_risk,
-        "delta": gluc_risk - base_risk,
-        "is_paradox": (gluc_risk < base_risk)
-    })
-    
-    # 3. Cholesterol
-    p_chol = base.copy()
-    p_chol['cholesterol'] = 3 # High
-    chol_risk = get_prediction(model, p_chol)
-    results.append({
-        "factor": "Cholesterol (High)",
-        "base_val": 1,
-        "test_val": 3,
-        "base_risk": base_risk,
-        "test_risk": chol_risk,
-        "delta": chol_risk - base_risk,
-        "is_paradox": (chol_risk < base_risk)
-    })
-    
-    # 4. Activity
-    p_lazy = base.copy()
-    p_lazy['active'] = 0 # Inactive
-    lazy_risk = get_prediction(model, p_lazy)
-    # Medical logic: Inactive should have higher risk than Active
-    results.append({
-        "factor": "Physical Activity (Inactive)",
-        "base_val": 1,
-        "test_val": 0,
-        "base_risk": base_risk,
-        "test_risk": lazy_risk,
-        "delta": lazy_risk - base_risk,
-        "is_paradox": (lazy_risk < base_risk)
-    })
-
-    # 5. Alcohol (often paradoxal in some datasets due to light-moderate drinkers having better health than abstainers)
-    p_alco = base.copy()
-    p_alco['alco'] = 1
-    alco_risk = get_prediction(model, p_alco)
-    results.append({
-        "factor": "Alcohol",
-        "base_val": 0,
-        "test_val": 1,
-        "base_risk": base_risk,
-        "test_risk": alco_risk,
-        "delta": alco_risk - base_risk,
-        "is_paradox": (alco_risk < base_risk)
-    })
-    
-    # 6. Systolic BP
-    p_bp = base.copy()
-    p_bp['ap_hi'] = 150
-    bp_risk = get_prediction(model, p_bp)
-    results.append({
-        "factor": "Systolic BP (150)",
-        "base_val": 120,
-        "test_val": 150,
-        "base_risk": base_risk,
-        "test_risk": bp_risk,
-        "delta": bp_risk - base_risk,
-        "is_paradox": (bp_risk < base_risk)
-    })
-
-    # Saving results
-    with open("c:/HomeWork/Medical/CVD_risk_Cat_Boost/cvd-risk-api/model/clinical_paradoxes.json", "w") as f:
-        json.dump(results, f, indent=4)
-        
-    print("Clinical paradox stress test completed.")
+    for perturbation in perturbations:
+        rows, delta = deltas[perturbation.factor]
+        if not len(rows):
+            continue
+        results.append({
+            "factor": perturbation.label,
+            "base_risk": base_risk,
+            "test_risk": base_risk + float(delta[0]),
+            "delta": float(delta[0]),
+            "is_paradox": bool(delta[0] * perturbation.expected_sign < -tolerance),
+        })
+    return results
+
+
+def _rounded(row: dict, exclude=()) -> dict:
+    return {
+        key: value if key in exclude else int(value) if key in ("patients", "paradoxes") else round(float(value), 4)
+        for key, value in row.items()
+    }
+
+
+def run_tests(data_path=DATA_PATH, model_path=MODEL_PATH, output_path=OUTPUT_PATH,
+              tolerance: float = DEFAULT_TOLERANCE, min_count: int = 30) -> dict:
+    model = load_model(model_path)
+    df = load_clean_frame(data_path)
+
+    started = time.perf_counter()
+    report = audit_paradoxes(model, df, tolerance, min_count=min_count)
+    report["elapsed_sec"] = round(time.perf_counter() - started, 2)
+    report["reference_patient"] = reference_patient_results(model, tolerance)
+
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched clinical paradox (monotonicity) audit")
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--model", default=str(MODEL_PATH))
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Risk changes up to this size count as no effect")
+    parser.add_argument("--min-count", type=int, default=30, help="Smallest subgroup reported")
+    args = parser.parse_args()
+
+    report = run_tests(args.data, args.model, args.output, args.tolerance, args.min_count)
+    print(f"{report['counterfactuals']} counterfactuals for {report['patients']} patients "
+          f"in {report['elapsed_sec']}s")
+    for row in report["factors"]:
+        print(f"  {row['perturbation']:28} paradox {row['paradox_rate'] * 100:5.1f}%  "
+              f"mean Δ {row['mean_delta']:+.4f}  ({row['patients']} patients)")
+    print(f"Clinical paradox audit saved to {args.output}")
+
 
 if __name__ == "__main__":
-    run_tests()
+    main()
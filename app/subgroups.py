@@ -0,0 +1,211 @@
+"""
+Метрики по подгруппам (fairness audit): пересечения регион × пол × возрастная декада × BMI.
+
+Every grouping is computed in one grouped pass, with no Python loop over
+subgroups. Predictions are sorted by probability once. For a grouping, a
+stable integer sort of the group codes keeps that order inside each
+group, so a cumulative sum of negatives gives every row its within-group
+rank. From that, per-group AUC (ties count 1/2), counts, Brier,
+calibration (observed vs predicted rate, ECE) and the confusion matrix at
+the high-risk threshold all come out of np.bincount.
+
+Usage:
+    python -m app.subgroups --input scored.csv --by region,sex,age_decile,bmi_band
+    (input needs `cardio`, `risk_probability` and the raw columns for the dimensions,
+     e.g. app.score_bulk --keep-columns id,age,gender,height,weight,cardio)
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from app.dataset import TARGET_COLUMN
+from app.features import DAYS_PER_YEAR, compute_bmi
+from app.risk_logic import HIGH_RISK_THRESHOLD
+
+PROBABILITY_COLUMN = "risk_probability"
+
+# WHO adult BMI classes
+BMI_BANDS = (18.5, 25, 30, 35, 40)
+BMI_BAND_LABELS = ("underweight", "normal", "overweight", "obesity_1", "obesity_2", "obesity_3")
+
+AUDIT_DIMENSIONS = ("region", "sex", "age_decile", "bmi_band")
+
+METRIC_COLUMNS = (
+    "count", "positives", "prevalence", "mean_predicted", "auc", "brier", "ece",
+    "sensitivity", "specificity", "tp", "fp", "tn", "fn",
+)
+
+
+def add_audit_dimensions(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds sex, age_decile and bmi_band (and keeps region when present) from
+    the dataset columns (age in days, gender 1/2, height, weight or bmi).
+    """
+    df = df.copy()
+    if "gender" in df.columns:
+        df["sex"] = np.where(df["gender"].to_numpy() == 2, "male", "female")
+    if "age" in df.columns:
+        decade = (df["age"].to_numpy() / DAYS_PER_YEAR // 10 * 10).astype(int)
+        df["age_decile"] = pd.Series(decade, index=df.index).map(lambda d: f"{d}-{d + 9}")
+    if "bmi" not in df.columns and {"weight", "height"} <= set(df.columns):
+        df["bmi"] = compute_bmi(df["weight"], df["height"])
+    if "bmi" in df.columns:
+        band = np.searchsorted(BMI_BANDS, df["bmi"].to_numpy(), side="right")
+        df["bmi_band"] = np.asarray(BMI_BAND_LABELS)[band]
+    return df
+
+
+class SortedPredictions:
+    """Labels and probabilities sorted by probability once, shared by every grouping."""
+
+    def __init__(self, y_true, y_prob, threshold: float = HIGH_RISK_THRESHOLD, n_bins: int = 10):
+        self.order = np.argsort(np.asarray(y_prob, dtype=float), kind="mergesort")
+        self.y = np.asarray(y_true, dtype=float)[self.order]
+        self.p = np.asarray(y_prob, dtype=float)[self.order]
+        self.predicted = (self.p >= threshold).astype(float)
+        self.threshold = threshold
+        self.n_bins = n_bins
+        bins = np.linspace(0.0, 1.0, n_bins + 1)
+        # Same bin assignment as sklearn calibration_curve
+        self.bin_ids = np.searchsorted(bins[1:-1], self.p)
+
+    def metrics(self, codes: np.ndarray, n_groups: int) -> dict:
+        """Metric arrays of length `n_groups` for integer group codes (original row order)."""
+        g = np.asarray(codes)[self.order]
+        y, p = self.y, self.p
+
+        count = np.bincount(g, minlength=n_groups).astype(float)
+        positives = np.bincount(g, weights=y, minlength=n_groups)
+        negatives = count - positives
+        predicted_sum = np.bincount(g, weights=p, minlength=n_groups)
+        brier_sum = np.bincount(g, weights=(p - y) ** 2, minlength=n_groups)
+
+        tp = np.bincount(g, weights=y * self.predicted, minlength=n_groups)
+        fp = np.bincount(g, weights=(1 - y) * self.predicted, minlength=n_groups)
+
+        cell = g * self.n_bins + self.bin_ids
+        observed_bins = np.bincount(cell, weights=y, minlength=n_groups * self.n_bins)
+        predicted_bins = np.bincount(cell, weights=p, minlength=n_groups * self.n_bins)
+        ece_sum = np.abs(observed_bins - predicted_bins).reshape(n_groups, self.n_bins).sum(axis=1)
+
+        auc_sum = self._auc_numerators(g, n_groups)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return {
+                "count": count.astype(int),
+                "positives": positives.astype(int),
+                "prevalence": positives / count,
+                "mean_predicted": predicted_sum / count,
+                "auc": np.where((positives > 0) & (negatives > 0), auc_sum / (positives * negatives), np.nan),
+                "brier": brier_sum / count,
+                "ece": ece_sum / count,
+                "sensitivity": tp / positives,
+                "specificity": (negatives - fp) / negatives,
+                "tp": tp.astype(int),
+                "fp": fp.astype(int),
+                "tn": (negatives - fp).astype(int),
+                "fn": (positives - tp).astype(int),
+            }
+
+    def _auc_numerators(self, g: np.ndarray, n_groups: int) -> np.ndarray:
+        """Per group: sum over positives of (negatives ranked below + 1/2 tied negatives)."""
+        # Stable: within a group rows stay sorted by probability
+        within = np.argsort(g, kind="stable")
+        gs, ys, ps = g[within], self.y[within], self.p[within]
+        n = len(gs)
+
+        neg_cum = np.r_[0.0, np.cumsum(1 - ys)]  # neg_cum[i] = negatives among the first i rows
+        group_start = np.searchsorted(gs, np.arange(n_groups))
+        # Tie runs: same group and same probability
+        new_run = np.r_[True, (gs[1:] != gs[:-1]) | (ps[1:] != ps[:-1])]
+        run_starts = np.flatnonzero(new_run)
+        run = np.cumsum(new_run) - 1
+        run_ends = np.r_[run_starts[1:], n]
+
+        neg_below = neg_cum[run_starts[run]] - neg_cum[group_start[gs]]
+        neg_tied = neg_cum[run_ends[run]] - neg_cum[run_starts[run]]
+        return np.bincount(gs, weights=ys * (neg_below + 0.5 * neg_tied), minlength=n_groups)
+
+
+def subgroup_metrics(df: pd.DataFrame, groupings, y_col: str = TARGET_COLUMN,
+                     p_col: str = PROBABILITY_COLUMN, threshold: float = HIGH_RISK_THRESHOLD,
+                     n_bins: int = 10, min_count: int = 1, sorted_predictions=None) -> pd.DataFrame:
+    """
+    One row per non-empty subgroup of each grouping (a tuple of column
+    names; () is the whole sample). Columns: grouping, the dimension
+    columns (None where not part of the grouping) and METRIC_COLUMNS.
+    """
+    predictions = sorted_predictions or SortedPredictions(df[y_col], df[p_col], threshold, n_bins)
+    frames = []
+    for grouping in groupings:
+        grouping = tuple(grouping)
+        if grouping:
+            codes, uniques = pd.MultiIndex.from_frame(df[list(grouping)].astype(str)).factorize()
+            labels = pd.DataFrame(list(uniques), columns=list(grouping))
+        else:
+            codes, labels = np.zeros(len(df), dtype=np.int64), pd.DataFrame(index=[0])
+        values = predictions.metrics(codes, len(labels))
+
+        frame = labels.assign(grouping=" x ".join(grouping) or "all", **values)
+        frames.append(frame[frame["count"] >= min_count])
+
+    result = pd.concat(frames, ignore_index=True)
+    dimensions = [c for c in result.columns if c not in METRIC_COLUMNS and c != "grouping"]
+    return result[["grouping"] + dimensions + list(METRIC_COLUMNS)]
+
+
+def audit_groupings(columns, dimensions=AUDIT_DIMENSIONS) -> list:
+    """Overall, each available dimension alone and their full intersection."""
+    available = tuple(d for d in dimensions if d in columns)
+    groupings = [()] + [(d,) for d in available]
+    if len(available) > 1:
+        groupings.append(available)
+    return groupings
+
+
+def to_records(result: pd.DataFrame, digits: int = 4) -> list:
+    """JSON-friendly rows: NaN -> None, dimensions not in the grouping dropped."""
+    records = []
+    for row in result.round(digits).astype(object).where(result.notna(), None).to_dict("records"):
+        records.append({k: v for k, v in row.items() if v is not None or k in METRIC_COLUMNS})
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Intersectional subgroup metrics for scored, labeled data")
+    parser.add_argument("--input", required=True, help="CSV or Parquet with labels and risk_probability")
+    parser.add_argument("--output", default=None, help="CSV or JSON report (default: print)")
+    parser.add_argument("--by", default=",".join(AUDIT_DIMENSIONS),
+                        help="Dimensions; their singles and full intersection are reported")
+    parser.add_argument("--label", default=TARGET_COLUMN)
+    parser.add_argument("--probability", default=PROBABILITY_COLUMN)
+    parser.add_argument("--threshold", type=float, default=HIGH_RISK_THRESHOLD)
+    parser.add_argument("--min-count", type=int, default=30)
+    args = parser.parse_args()
+
+    path = Path(args.input)
+    df = pd.read_parquet(path) if path.suffix == ".parquet" or path.is_dir() else pd.read_csv(path)
+    df = add_audit_dimensions(df)
+    groupings = audit_groupings(df.columns, [d.strip() for d in args.by.split(",") if d.strip()])
+
+    started = time.perf_counter()
+    result = subgroup_metrics(df, groupings, args.label, args.probability, args.threshold,
+                              min_count=args.min_count)
+    elapsed = time.perf_counter() - started
+    print(f"{len(result)} subgroups over {len(df)} rows in {elapsed * 1000:.1f} ms")
+
+    if args.output is None:
+        print(result.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    elif args.output.endswith(".json"):
+        with open(args.output, "w") as f:
+            json.dump(to_records(result), f, indent=4, ensure_ascii=False)
+    else:
+        result.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Анализ порогов: чувствительность / специфичность / PPV / NPV и net benefit (DCA).
+
+Probabilities are sorted once; cumulative sums of positives and
+negatives along that order give the confusion matrix at any threshold
+with a binary search, so thousands of thresholds cost O(N log N + T log N)
+instead of O(T·N). A prediction is positive when probability >= threshold.
+
+Used by app/training.py (threshold for the target sensitivity)
+and clinical_validation_stats.py (decision curve, per-subgroup operating
+thresholds).
+"""
+import numpy as np
+
+METRICS = ("sensitivity", "specificity", "ppv", "npv")
+
+
+class ThresholdCurve:
+    """Confusion-matrix counts for arbitrary thresholds of one sample."""
+
+    def __init__(self, y_true, y_prob):
+        y_prob = np.asarray(y_prob, dtype=float)
+        order = np.argsort(y_prob, kind="mergesort")
+        self.scores = y_prob[order]
+        y = np.asarray(y_true, dtype=float)[order]
+        # *_below[k]: positives / negatives among the k lowest scores
+        self.pos_below = np.r_[0.0, np.cumsum(y)]
+        self.neg_below = np.r_[0.0, np.cumsum(1 - y)]
+        self.n = len(y)
+        self.positives = self.pos_below[-1]
+        self.negatives = self.neg_below[-1]
+
+    def candidate_thresholds(self) -> np.ndarray:
+        """Distinct scores, descending: every achievable operating point."""
+        return np.unique(self.scores)[::-1]
+
+    def counts(self, thresholds) -> dict:
+        thresholds = np.atleast_1d(np.asarray(thresholds, dtype=float))
+        below = np.searchsorted(self.scores, thresholds, side="left")
+        tp = self.positives - self.pos_below[below]
+        fp = self.negatives - self.neg_below[below]
+        return {
+            "threshold": thresholds,
+            "tp": tp,
+            "fp": fp,
+            "tn": self.negatives - fp,
+            "fn": self.positives - tp,
+        }
+
+    def metrics(self, thresholds) -> dict:
+        """threshold, tp/fp/tn/fn and sensitivity, specificity, PPV, NPV (NaN when undefined)."""
+        c = self.counts(thresholds)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            c["sensitivity"] = c["tp"] / self.positives
+            c["specificity"] = c["tn"] / self.negatives
+            c["ppv"] = c["tp"] / (c["tp"] + c["fp"])
+            c["npv"] = c["tn"] / (c["tn"] + c["fn"])
+        return c
+
+    def net_benefit(self, thresholds) -> dict:
+        """
+        Decision curve: net benefit of the model and of treating everyone
+        (treating no one is 0). Defined as 0 at threshold 1.
+        """
+        c = self.counts(thresholds)
+        t = c["threshold"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weight = np.where(t < 1.0, t / (1 - t), 0.0)
+        model = np.where(t < 1.0, c["tp"] / self.n - c["fp"] / self.n * weight, 0.0)
+        treat_all = np.where(t < 1.0, self.positives / self.n - self.negatives / self.n * weight, 0.0)
+        return {"threshold": t, "model": model, "all": treat_all, "none": np.zeros_like(t)}
+
+    def pick_threshold(self, min_sensitivity: float | None = None, min_specificity: float | None = None,
+                       min_ppv: float | None = None, min_npv: float | None = None,
+                       maximize: str = "specificity") -> dict | None:
+        """
+        Operating point meeting every given minimum and maximizing `maximize`
+        (ties: the highest threshold). None when no threshold qualifies.
+        """
+        m = self.metrics(self.candidate_thresholds())
+        feasible = np.ones(len(m["threshold"]), dtype=bool)
+        for name, minimum in (("sensitivity", min_sensitivity), ("specificity", min_specificity),
+                              ("ppv", min_ppv), ("npv", min_npv)):
+            if minimum is not None:
+                feasible &= np.nan_to_num(m[name], nan=-1.0) >= minimum
+        if not feasible.any():
+            return None
+        objective = np.where(feasible, np.nan_to_num(m[maximize], nan=-1.0), -np.inf)
+        i = int(np.argmax(objective))  # first maximum = highest threshold
+        return {k: float(v[i]) for k, v in m.items()}
+
+
+def decision_curve(y_true, y_prob, thresholds) -> list:
+    """Net benefit rows [{threshold, model, all, none}] for DCA plots."""
+    nb = ThresholdCurve(y_true, y_prob).net_benefit(thresholds)
+    return [
+        {"threshold": float(t), "model": float(m), "all": float(a), "none": 0.0}
+        for t, m, a in zip(nb["threshold"], nb["model"], nb["all"])
+    ]
+
+
+def threshold_for_sensitivity(y_true, y_prob, target_sensitivity: float) -> dict:
+    """Highest threshold with sensitivity >= target (best specificity for that sensitivity)."""
+    return ThresholdCurve(y_true, y_prob).pick_threshold(min_sensitivity=target_sensitivity)
+
+
+def thresholds_by_group(y_true, y_prob, groups, **constraints) -> dict:
+    """Per-subgroup operating points: group label -> pick_threshold(**constraints)."""
+    y_true, y_prob, groups = np.asarray(y_true), np.asarray(y_prob), np.asarray(groups)
+    labels, codes = np.unique(groups, return_inverse=True)
+    # One stable sort by group keeps each group's rows contiguous
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(labels) + 1))
+    return {
+        str(label): ThresholdCurve(y_true[order[lo:hi]], y_prob[order[lo:hi]]).pick_threshold(**constraints)
+        for label, lo, hi in zip(labels, bounds[:-1], bounds[1:])
+    }
@@ -0,0 +1,78 @@
+"""
+Обучение и оценка модели: параметры CatBoost, обучение, порог для целевой чувствительности.
+
+Shared by train_improved_model.py (the production model),
+app/hparam_search.py (cross-validated trials) and app/retrain.py
+(incremental retraining), so all of them train and score the model the
+same way. Data preparation lives in app/training_data.py, threshold
+arithmetic in app/thresholds.py.
+"""
+from catboost import CatBoostClassifier
+from sklearn.metrics import roc_auc_score
+
+from app.dataset import FEATURE_COLUMNS
+from app.thresholds import threshold_for_sensitivity
+from app.training_data import RANDOM_SEED
+
+TARGET_SENSITIVITY = 0.90
+
+# We use a relatively simple configuration to avoid overfitting,
+# but with sufficient depth and iterations to learn patterns.
+# CatBoost handles categorical features automatically, but here inputs are mostly numerical/ordinal integers.
+# We treat cholesterol, gluc, smoke, alco, active, gender as categorical implies we should let CatBoost know,
+# but for this dataset they are often treated as int. We'll let CatBoost auto-detect or treat as numeric (ordinal is fine for boostings).
+MODEL_PARAMS = {
+    "iterations": 1000,
+    "learning_rate": 0.03,
+    "depth": 6,
+    "loss_function": "Logloss",
+    "eval_metric": "AUC",
+    "random_seed": RANDOM_SEED,
+    "verbose": 100,
+    "allow_writing_files": False,
+}
+EARLY_STOPPING_ROUNDS = 50
+
+
+def train_model(train, eval_set, params: dict | None = None, **fit_kwargs) -> CatBoostClassifier:
+    """`train` is a Pool or an (X, y) tuple; `eval_set` likewise."""
+    model = CatBoostClassifier(**(params or MODEL_PARAMS))
+    if isinstance(train, tuple):
+        X_train, y_train = train
+        model.fit(X_train, y_train, eval_set=eval_set,
+                  early_stopping_rounds=EARLY_STOPPING_ROUNDS, **fit_kwargs)
+    else:
+        model.fit(train, eval_set=eval_set, early_stopping_rounds=EARLY_STOPPING_ROUNDS, **fit_kwargs)
+    return model
+
+
+def calibrate_threshold(y_test, y_pred_proba, target_sensitivity: float = TARGET_SENSITIVITY) -> dict:
+    """Threshold for the target sensitivity (TPR = TP / (TP + FN)) on the test set."""
+    # We want TPR >= target; the highest such threshold keeps the best specificity
+    point = threshold_for_sensitivity(y_test, y_pred_proba, target_sensitivity)
+    return {
+        "threshold": point["threshold"],
+        "sensitivity": point["sensitivity"],
+        "specificity": point["specificity"],
+        "precision": point["ppv"],
+    }
+
+
+def evaluate_model(model, X_test, y_test) -> dict:
+    """X_test may be the quantized test pool: predictions are identical to raw features."""
+    y_pred_proba = model.predict_proba(X_test)[:, 1]
+    auc = roc_auc_score(y_test, y_pred_proba)
+    calibration = calibrate_threshold(y_test, y_pred_proba)
+    precision, recall = calibration["precision"], calibration["sensitivity"]
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "roc_auc": round(auc, 4),
+        "sensitivity_target": TARGET_SENSITIVITY,
+        "threshold_90_sens": round(calibration["threshold"], 4),
+        "specificity_at_threshold": round(calibration["specificity"], 4),
+        "precision_at_threshold": round(precision, 4),
+        "recall_at_threshold": round(recall, 4),
+        "f1_at_threshold": round(f1, 4),
+        "achieved_sensitivity": calibration["sensitivity"],
+        "features": FEATURE_COLUMNS,
+    }
@@ -0,0 +1,186 @@
+"""
+Подготовка данных для обучения: train/test split и квантованные CatBoost Pool в кэше.
+
+The cleaned dataset is split once (same parameters as the training
+script) and both halves are quantized with the train borders and saved
+with CatBoost's quantized pool format. Training and evaluation scripts
+load them directly, skipping CSV parsing, cleaning and re-quantization.
+
+The cache is keyed by a fingerprint of the CSV contents, the cleaning
+rules, the split and quantization parameters and the CatBoost version;
+any change rebuilds it.
+
+Usage:
+    python -m app.training_data            # build or validate the cache
+    python -m app.training_data --rebuild
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import catboost
+import numpy as np
+from catboost import Pool
+from sklearn.model_selection import train_test_split
+
+from app.columnar import load_clean_frame
+from app.dataset import (
+    DATA_PATH,
+    FEATURE_COLUMNS,
+    TARGET_COLUMN,
+    cleaning_fingerprint,
+    file_fingerprint,
+)
+
+POOL_CACHE_DIR = Path("data/pools")
+
+TEST_SIZE = 0.2
+RANDOM_SEED = 42
+
+# CatBoost defaults for dense numeric features; fitting on raw frames
+# quantizes with the same settings, so cached pools give identical models.
+QUANTIZATION_PARAMS = {"border_count": 254, "feature_border_type": "GreedyLogSum"}
+
+MANIFEST = "manifest.json"
+TRAIN_POOL = "train.quantized"
+TEST_POOL = "test.quantized"
+BORDERS = "borders.tsv"
+
+
+class TrainingPools:
+    """Quantized train/test pools plus what they were built from."""
+
+    __slots__ = ("train", "test", "manifest", "from_cache")
+
+    def __init__(self, train: Pool, test: Pool, manifest: dict, from_cache: bool):
+        self.train = train
+        self.test = test
+        self.manifest = manifest
+        self.from_cache = from_cache
+
+    @property
+    def y_test(self) -> np.ndarray:
+        return pool_labels(self.test)
+
+    @property
+    def y_train(self) -> np.ndarray:
+        return pool_labels(self.train)
+
+
+def pool_labels(pool: Pool) -> np.ndarray:
+    # Quantized pools return labels as strings ('1.0')
+    return np.asarray(pool.get_label(), dtype=float).astype(int)
+
+
+def pool_fingerprint(data_path=DATA_PATH, test_size: float = TEST_SIZE,
+                     random_seed: int = RANDOM_SEED, quantization: dict | None = None) -> dict:
+    key = {
+        "source_sha256": file_fingerprint(data_path),
+        "cleaning": cleaning_fingerprint(),
+        "test_size": test_size,
+        "random_seed": random_seed,
+        "quantization": quantization or QUANTIZATION_PARAMS,
+        "features": FEATURE_COLUMNS,
+        "catboost": catboost.__version__,
+    }
+    key["fingerprint"] = hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+    return key
+
+
+def split_clean_dataset(data_path=DATA_PATH, test_size: float = TEST_SIZE, random_seed: int = RANDOM_SEED):
+    """Cleaned X/y split exactly as train_improved_model.py does it."""
+    df_clean = load_clean_frame(data_path)
+    X = df_clean[FEATURE_COLUMNS]
+    y = df_clean[TARGET_COLUMN]
+    return train_test_split(X, y, test_size=test_size, random_state=random_seed, stratify=y)
+
+
+def build_pools(cache_dir=POOL_CACHE_DIR, data_path=DATA_PATH, test_size: float = TEST_SIZE,
+                random_seed: int = RANDOM_SEED, quantization: dict | None = None) -> TrainingPools:
+    """Splits, quantizes with train borders and writes the cache atomically."""
+    quantization = quantization or QUANTIZATION_PARAMS
+    key = pool_fingerprint(data_path, test_size, random_seed, quantization)
+    started = time.perf_counter()
+
+    X_train, X_test, y_train, y_test = split_clean_dataset(data_path, test_size, random_seed)
+
+    cache_dir = Path(cache_dir)
+    tmp_dir = cache_dir.with_name(cache_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    train = Pool(X_train, y_train)
+    train.quantize(**quantization)
+    train.save_quantization_borders(str(tmp_dir / BORDERS))
+    # Test rows use the train borders, as CatBoost does for an eval_set
+    test = Pool(X_test, y_test)
+    test.quantize(input_borders=str(tmp_dir / BORDERS))
+    train.save(str(tmp_dir / TRAIN_POOL))
+    test.save(str(tmp_dir / TEST_POOL))
+
+    manifest = {
+        **key,
+        "train_rows": len(X_train),
+        "test_rows": len(X_test),
+        "built_at": datetime.now(timezone.utc).isoformat(),
+        "build_sec": round(time.perf_counter() - started, 3),
+    }
+    with open(tmp_dir / MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=4)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+    return load_cached_pools(cache_dir, from_cache=False)
+
+
+def read_manifest(cache_dir=POOL_CACHE_DIR) -> dict:
+    path = Path(cache_dir) / MANIFEST
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def load_cached_pools(cache_dir=POOL_CACHE_DIR, from_cache: bool = True) -> TrainingPools:
+    cache_dir = Path(cache_dir)
+    return TrainingPools(
+        train=Pool(f"quantized://{cache_dir / TRAIN_POOL}"),
+        test=Pool(f"quantized://{cache_dir / TEST_POOL}"),
+        manifest=read_manifest(cache_dir),
+        from_cache=from_cache,
+    )
+
+
+def get_training_pools(cache_dir=POOL_CACHE_DIR, data_path=DATA_PATH, rebuild: bool = False,
+                       test_size: float = TEST_SIZE, random_seed: int = RANDOM_SEED,
+                       quantization: dict | None = None) -> TrainingPools:
+    """Cached pools when the fingerprint matches, otherwise rebuilt."""
+    if not rebuild:
+        expected = pool_fingerprint(data_path, test_size, random_seed, quantization)["fingerprint"]
+        if read_manifest(cache_dir).get("fingerprint") == expected:
+            return load_cached_pools(cache_dir)
+    return build_pools(cache_dir, data_path, test_size, random_seed, quantization)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the cached quantized CatBoost train/test pools")
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--cache-dir", default=str(POOL_CACHE_DIR))
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    pools = get_training_pools(args.cache_dir, args.data, rebuild=args.rebuild)
+    action = "Loaded cached" if pools.from_cache else "Built"
+    print(f"{action} pools in {args.cache_dir} ({time.perf_counter() - started:.2f}s): "
+          f"train {pools.train.num_row()} rows, test {pools.test.num_row()} rows")
+    print(f"Fingerprint: {pools.manifest.get('fingerprint')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
+import time
 import httpx
 from bot.config import API_BASE_URL
 from app.core.state import global_state
-from app.risk_logic import evaluate_clinical_risk
+from app.features import as_features
 from app.schemas import PatientInput
+from app.services.prediction_log import prediction_logger
+from app.services.shadow import shadow_evaluator
+from app.services.region_router import region_router
+from app.services.degradation import degradation_controller, request_deadline
 
 async def get_risk_prediction(data: dict) -> dict:
     """
@@ -15,13 +20,23 @@ async def get_risk_prediction(data: dict) -> dict:
             patient_input = PatientInput(**data)
             
             # Execute logic directly
-            result = evaluate_clinical_risk(
-                patient=patient_input,
-                model=global_state.model,
-                shap_explainer=global_state.shap_explainer,
-                lang=data.get("ui_language", "en"),
-                model_metrics=global_state.model_metrics
+            started = time.perf_counter()
+            deadline = request_deadline()
+            bundle, route = region_router.resolve(patient_input.region)
+            features = as_features(patient_input)
+            result = degradation_controller.evaluate(
+                features, bundle, data.get("ui_language", "en"), deadline=deadline
             )
+            latency_ms = (time.perf_counter() - started) * 1000
+            region_router.record_latency(patient_input.region, latency_ms)
+            prediction_logger.record(
+                patient_input, result, latency_ms, source="bot", consent=bool(data.get("consent", False))
+            )
+            if shadow_evaluator is not None:
+                shadow_evaluator.submit(
+                    features.vector, result["raw_risk_probability"],
+                    bundle.high_risk_threshold, bundle.version, route
+                )
             # Return as dict (compatible with API response structure)
             return result
         except Exception as e:
@@ -1,162 +1,104 @@
+import argparse
+import json
+import time
 
-import pandas as pd
-import numpy as np
-from catboost import CatBoostClassifier
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import roc_auc_score, recall_score, precision_score, confusion_matrix
+from app.dataset import FEATURE_COLUMNS
+from app.training import MODEL_PARAMS, TARGET_SENSITIVITY, evaluate_model, train_model
+from app.training_data import POOL_CACHE_DIR, get_training_pools, split_clean_dataset
 
 # ---------------------------------------------------------
 # CONFIGURATION
 # ---------------------------------------------------------
 DATA_PATH = "CVD_risk_dataset.csv"
 MODEL_OUTPUT_PATH = "model/improved_catboost.cbm"
+METRICS_OUTPUT_PATH = "model/model_metrics.json"
 RANDOM_SEED = 42
 
-# ---------------------------------------------------------
-# 1. LOAD DATA
-# ---------------------------------------------------------
-print("Loading dataset...")
-df = pd.read_csv(DATA_PATH)
-initial_shape = df.shape
-print(f"Initial shape: {initial_shape}")
+# Model parameters, training and evaluation: app/training.py
+
 
 # ---------------------------------------------------------
-# 2. DATA CLEANING (OUTLIER REMOVAL)
+# 1-4. LOAD, CLEAN, FEATURE ENGINEERING, TRAIN/TEST SPLIT
 # ---------------------------------------------------------
 # Valid ranges based on physiological limits and common sense for this dataset
+# (shared with validation and bulk scoring, see app/dataset.py)
 # Systolic BP: 40-250
 # Diastolic BP: 30-200
 # Height: 100-250 cm
 # Weight: 30-250 kg
-
-print("\nCleaning data (removing outliers)...")
-df_clean = df.copy()
-
-# Remove unrealistic Blood Pressure
-mask_bp = (df_clean['ap_hi'] >= 40) & (df_clean['ap_hi'] <= 250) & \
-          (df_clean['ap_lo'] >= 30) & (df_clean['ap_lo'] <= 200) & \
-          (df_clean['ap_hi'] > df_clean['ap_lo']) # Systolic must be > Diastolic
-
-# Remove unrealistic Height/Weight
-mask_anthropometry = (df_clean['height'] >= 100) & (df_clean['height'] <= 250) & \
-                     (df_clean['weight'] >= 30) & (df_clean['weight'] <= 250)
-
-df_clean = df_clean[mask_bp & mask_anthropometry]
-
-print(f"Rows removed: {initial_shape[0] - df_clean.shape[0]}")
-print(f"Cleaned shape: {df_clean.shape}")
-
-# ---------------------------------------------------------
-# 3. FEATURE ENGINEERING
-# ---------------------------------------------------------
-print("\nFeature Engineering...")
-
-# Calculate BMI accurately
-# BMI = weight (kg) / (height (m))^2
-df_clean['bmi'] = df_clean['weight'] / ((df_clean['height'] / 100) ** 2)
-
-# Filter by BMI (realistic range 10-60)
-df_clean = df_clean[(df_clean['bmi'] >= 10) & (df_clean['bmi'] <= 60)]
-print(f"Shape after BMI filter: {df_clean.shape}")
-
-# Select Features for Training
+# BMI = weight (kg) / (height (m))^2, realistic range 10-60
+#
 # EXCLUDING 'index' (leakage)
 # EXCLUDING 'age_years' (redundancy, keeping 'age' in days for precision)
-feature_cols = [
-    'age',          # in days
-    'gender',       # 1=female, 2=male (usually)
-    'height',       # cm
-    'weight',       # kg
-    'ap_hi',        # systolic
-    'ap_lo',        # diastolic
-    'cholesterol',  # 1, 2, 3
-    'gluc',         # 1, 2, 3
-    'smoke',        # 0, 1
-    'alco',         # 0, 1
-    'active',       # 0, 1
-    'bmi'           # calculated
-]
-
-target_col = 'cardio'
-
-X = df_clean[feature_cols]
-y = df_clean[target_col]
-
-print(f"\nFinal Training Features: {feature_cols}")
-
-# ---------------------------------------------------------
-# 4. TRAIN/TEST SPLIT
-# ---------------------------------------------------------
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.2, random_state=RANDOM_SEED, stratify=y
-)
-
-# ---------------------------------------------------------
-# 5. MODEL TRAINING
-# ---------------------------------------------------------
-print("\nTraining CatBoost Classifier...")
-# We use a relatively simple configuration to avoid overfitting,
-# but with sufficient depth and iterations to learn patterns.
-# CatBoost handles categorical features automatically, but here inputs are mostly numerical/ordinal integers.
-# We treat cholesterol, gluc, smoke, alco, active, gender as categorical implies we should let CatBoost know,
-# but for this dataset they are often treated as int. We'll let CatBoost auto-detect or treat as numeric (ordinal is fine for boostings).
-
-model = CatBoostClassifier(
-    iterations=1000,
-    learning_rate=0.03,
-    depth=6,
-    loss_function='Logloss',
-    eval_metric='AUC',
-    random_seed=RANDOM_SEED,
-    verbose=100,
-    allow_writing_files=False
-)
-
-model.fit(X_train, y_train, eval_set=(X_test, y_test), early_stopping_rounds=50)
-
-# ---------------------------------------------------------
-# 6. EVALUATION & THRESHOLD TUNING
-# ---------------------------------------------------------
-print("\nEvaluating Model...")
-y_pred_proba = model.predict_proba(X_test)[:, 1]
-
-auc = roc_auc_score(y_test, y_pred_proba)
-print(f"Test AUC: {auc:.4f}")
-
-# Find Threshold for 90% Sensitivity
-# effective_sensitivity = TP / (TP + FN)
-from sklearn.metrics import roc_curve
-
-fpr, tpr, thresholds = roc_curve(y_test, y_pred_proba)
-# We want TPR >= 0.90
-target_sensitivity = 0.90
-idx = np.argmax(tpr >= target_sensitivity)
-required_threshold = thresholds[idx]
-achieved_sensitivity = tpr[idx]
-specificity_at_threshold = 1 - fpr[idx]
-
-print(f"\n--- SAFETY THRESHOLD CALIBRATION ---")
-print(f"Target Sensitivity: {target_sensitivity*100}%")
-print(f"Required Threshold: {required_threshold:.4f}")
-print(f"Achieved Sensitivity: {achieved_sensitivity:.4f}")
-print(f"Specificity at this threshold: {specificity_at_threshold:.4f}")
-
-# Save the model
-model.save_model(MODEL_OUTPUT_PATH)
-print(f"\nModel saved to: {MODEL_OUTPUT_PATH}")
-
-# Save metrics for the API to load
-import json
-
-metrics = {
-    "roc_auc": round(auc, 4),
-    "sensitivity_target": 0.90,
-    "threshold_90_sens": round(required_threshold, 4),
-    "specificity_at_threshold": round(specificity_at_threshold, 4),
-    "features": feature_cols
-}
-
-with open("model/model_metrics.json", "w") as f:
-    json.dump(metrics, f, indent=4)
-
-print("Metrics saved to model/model_metrics.json")
+# age (days), gender, height, weight, ap_hi, ap_lo, cholesterol, gluc,
+# smoke, alco, active, bmi (calculated)
+def load_data(use_cache: bool = True, rebuild_cache: bool = False):
+    """
+    Returns (train, eval_set, X_test, y_test) for model.fit / evaluation.
+
+    With the cache, train/test are quantized CatBoost pools from
+    app/training_data.py (rebuilt automatically when the CSV or cleaning
+    rules change); without it, pandas frames split the same way.
+    """
+    if use_cache:
+        pools = get_training_pools(POOL_CACHE_DIR, DATA_PATH, rebuild=rebuild_cache, random_seed=RANDOM_SEED)
+        source = "cache" if pools.from_cache else "rebuilt cache"
+        print(f"Training pools ({source}): train {pools.train.num_row()}, test {pools.test.num_row()} rows")
+        return pools.train, pools.test, pools.test, pools.y_test
+
+    X_train, X_test, y_train, y_test = split_clean_dataset(DATA_PATH, random_seed=RANDOM_SEED)
+    print(f"Training frames: train {len(X_train)}, test {len(X_test)} rows")
+    return (X_train, y_train), (X_test, y_test), X_test, y_test
+
+
+def save_artifacts(model, metrics: dict, model_path=MODEL_OUTPUT_PATH, metrics_path=METRICS_OUTPUT_PATH):
+    model.save_model(model_path)
+    print(f"\nModel saved to: {model_path}")
+
+    # Save metrics for the API to load
+    saved = {k: v for k, v in metrics.items() if k != "achieved_sensitivity"}
+    with open(metrics_path, "w") as f:
+        json.dump(saved, f, indent=4)
+    print(f"Metrics saved to {metrics_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the CatBoost CVD risk model")
+    parser.add_argument("--no-cache", action="store_true", help="Train from pandas frames instead of cached pools")
+    parser.add_argument("--rebuild-cache", action="store_true", help="Rebuild the quantized pool cache first")
+    parser.add_argument("--params", help="Leaderboard JSON from app.hparam_search: train with its best trial")
+    args = parser.parse_args()
+
+    params = MODEL_PARAMS
+    if args.params:
+        from app.hparam_search import best_params
+
+        params = {**MODEL_PARAMS, **best_params(args.params)}
+        print(f"Using best search trial from {args.params}: {best_params(args.params)}")
+
+    print("Loading dataset...")
+    started = time.perf_counter()
+    train, eval_set, X_test, y_test = load_data(use_cache=not args.no_cache, rebuild_cache=args.rebuild_cache)
+    print(f"Data ready in {time.perf_counter() - started:.2f}s")
+    print(f"\nFinal Training Features: {FEATURE_COLUMNS}")
+
+    print("\nTraining CatBoost Classifier...")
+    started = time.perf_counter()
+    model = train_model(train, eval_set, params)
+    print(f"Training took {time.perf_counter() - started:.1f}s")
+
+    print("\nEvaluating Model...")
+    metrics = evaluate_model(model, X_test, y_test)
+    print(f"Test AUC: {metrics['roc_auc']:.4f}")
+
+    print(f"\n--- SAFETY THRESHOLD CALIBRATION ---")
+    print(f"Target Sensitivity: {TARGET_SENSITIVITY*100}%")
+    print(f"Required Threshold: {metrics['threshold_90_sens']:.4f}")
+    print(f"Achieved Sensitivity: {metrics['achieved_sensitivity']:.4f}")
+    print(f"Specificity at this threshold: {metrics['specificity_at_threshold']:.4f}")
+
+    save_artifacts(model, metrics)
+
+
+if __name__ == "__main__":
+    main()